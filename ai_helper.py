@@ -1,142 +1,894 @@
 from google import genai
+from google.genai import types
+import asyncio
+import contextlib
+import json
 import logging
 import re
 import time
-import mysql.connector
+
+import answer_helper
+import async_helper
+import cache_helper
+import cancel_helper
+import coalesce_helper
+import context_cache_helper
+import db_helper
+import example_helper
+import guard_helper
+import metrics_helper
+import model_helper
+import profile_helper
+import ratelimit_helper
+import schema_helper
+import result_helper
+import snapshot_helper
+import sql_helper
 
 logger = logging.getLogger(__name__)
 
 # Initialize Client
 client = None
 model_name = "gemini-2.0-flash" # Default
+BACKUP_MODELS = ["gemini-flash-latest"]
+# Routes every Gemini call across model_name and the backups (see init_dispatcher)
+dispatcher = model_helper.ModelDispatcher([model_name] + BACKUP_MODELS)
+
+# Client-side RPM/TPM scheduling (replaced by init_rate_limiter; None disables it)
+rate_limiter = ratelimit_helper.RateLimiter()
+# Expected reply sizes, reserved from the tokens-per-minute quota before each call
+SQL_REPLY_TOKENS = 300
+ANSWER_REPLY_TOKENS = 400
+
+# Question -> SQL cache (replaced by init_sql_cache; None disables caching)
+sql_cache = cache_helper.QuestionCache()
+# SQL -> rows cache (replaced by init_result_cache; None disables caching)
+result_cache = cache_helper.ResultCache()
+
+# Identical questions in flight share one pipeline run (replaced by init_coalescing; None disables it)
+coalescer = coalesce_helper.Coalescer()
+
+# Sampled column values added to SQL prompts (replaced by init_profiles; None disables them)
+profiler = profile_helper.Profiler()
+
+# Verified question -> SQL examples added to SQL prompts (replaced by init_examples; None disables them)
+example_store = example_helper.ExampleStore()
+
+# Local DuckDB/Parquet snapshots for analytical queries (see init_snapshots; None = MySQL only)
+snapshots = None
+
+# Schema preambles uploaded as Gemini cached content (see init_context_cache; None disables it)
+context_cache = None
+
+# Validation, EXPLAIN cost checks and time limits for generated SQL (see init_query_guard)
+query_guard = guard_helper.QueryGuard()
+
+# Executed queries that clients can page through / export after the answer
+query_store = result_helper.QueryStore()
+
+# Rows sent to streaming clients as a preview of the result
+ROW_PREVIEW_LIMIT = 20
+# Caps on how much of a result is read from MySQL (see init_fetch_limits)
+MAX_RESULT_ROWS = 10000
+MAX_RESULT_BYTES = 16 * 1024 * 1024
+FETCH_BATCH_SIZE = 500
+# Results up to this many rows are pasted into the answer prompt; larger ones are summarized
+PROMPT_ROW_LIMIT = 50
+
+# SQL generation asks for a JSON reply matching SQL_RESPONSE_SCHEMA (see init_structured_output).
+# Models that reject JSON mode are remembered and asked for a ```sql block instead.
+STRUCTURED_OUTPUT = True
+_plain_models = set()
+SQL_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING", "enum": ["query", "chat"]},
+        "sql": {"type": "STRING"},
+        "tables": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "answer_template": {"type": "STRING"},
+        "reply": {"type": "STRING"},
+    },
+    "required": ["intent"],
+}
+_SQL_START_RE = re.compile(r"^\s*(SELECT|WITH|SHOW|DESCRIBE|DESC|EXPLAIN)\b", re.IGNORECASE)
+
+# Per-question deadline in seconds (see init_request_timeout; 0 disables it)
+REQUEST_TIMEOUT = 120
+
+# Default answer synthesis for SQL results (see answer_helper; overridable per request)
+ANSWER_MODE = "auto"
+answer_counts = {"template": 0, "model": 0}
 
 def init_client(api_key, model="gemini-2.0-flash"):
-    global client, model_name
+    global client, model_name, dispatcher
     try:
         client = genai.Client(api_key=api_key)
         model_name = model
+        dispatcher = model_helper.ModelDispatcher([model_name] + BACKUP_MODELS)
         return True
     except Exception as e:
         logger.error(f"AI Init Error: {e}")
         return False
 
-def generate_response(query, db_schema, db_config):
+def init_dispatcher(backup_models=None, hedge_percentile=95, hedge_min_delay=0.5, hedge_max_delay=15.0,
+                    hedge_default_delay=4.0, breaker_cooldown=30.0, breaker_failures=3):
+    """Rebuilds the dispatcher for model_name plus `backup_models`; hedge_percentile=None disables hedging."""
+    global dispatcher
+    models = [model_name] + list(BACKUP_MODELS if backup_models is None else backup_models)
+    dispatcher = model_helper.ModelDispatcher(
+        models, hedge_percentile=hedge_percentile, hedge_min_delay=hedge_min_delay,
+        hedge_max_delay=hedge_max_delay, hedge_default_delay=hedge_default_delay,
+        failure_threshold=breaker_failures, cooldown=breaker_cooldown
+    )
+    return dispatcher
+
+def init_rate_limiter(quotas=None, default_rpm=15, default_tpm=1000000, headroom=0.9,
+                      max_queue=100, max_wait=10.0, enabled=True):
+    global rate_limiter
+    rate_limiter = ratelimit_helper.RateLimiter(
+        quotas, default_rpm, default_tpm, headroom, max_queue, max_wait
+    ) if enabled else None
+    return rate_limiter
+
+def admission_retry_after(priority="normal", tokens=2000):
     """
-    1. Ask AI for SQL
-    2. Run SQL
-    3. Ask AI to summarize answer
+    None if a new question can be served now; otherwise the seconds a 503 should tell
+    the client to wait (every model is rate-limited or its local queue is too long).
+    """
+    models = [m for m in dispatcher.models if dispatcher.breakers[m].state != "open"]
+    if not models:
+        return min(b.retry_in() for b in dispatcher.breakers.values())
+    if rate_limiter:
+        return rate_limiter.retry_after(models, tokens, ratelimit_helper.PRIORITIES.get(priority, 1))
+    return None
+
+async def _reserve(model, tokens, priority):
+    """Waits for `model`'s quota (raises OverloadedError when the wait would be too long)."""
+    if rate_limiter:
+        await rate_limiter.acquire(model, tokens, priority)
+
+def _settle(model, estimated, response):
+    if response is not None:
+        metrics_helper.record_tokens(model, response)
+    if rate_limiter and response is not None:
+        rate_limiter.settle(model, estimated, ratelimit_helper.usage_tokens(response))
+
+def init_sql_cache(max_entries=1000, ttl=86400, path=None, enabled=True):
+    global sql_cache
+    sql_cache = cache_helper.QuestionCache(max_entries, ttl, path) if enabled else None
+    return sql_cache
+
+def init_result_cache(max_bytes=32 * 1024 * 1024, ttl=300, poll_interval=2.0, enabled=True):
+    global result_cache
+    result_cache = cache_helper.ResultCache(max_bytes, ttl, poll_interval) if enabled else None
+    return result_cache
+
+def init_context_cache(ttl=3600, min_tokens=4096, max_tokens=500000, enabled=True):
+    global context_cache
+    context_cache = context_cache_helper.ContextCache(ttl, min_tokens, max_tokens) if enabled else None
+
+def init_query_guard(max_cost=1000000, max_rows=5000000, action="limit", limit_rows=1000,
+                     timeout=30, over_cost_timeout=5, explain=True):
+    global query_guard
+    query_guard = guard_helper.QueryGuard(
+        max_cost, max_rows, action, limit_rows, timeout, over_cost_timeout, explain
+    )
+
+def init_query_store(store=None, ttl=3600):
+    global query_store
+    query_store = result_helper.QueryStore(store, ttl)
+    return query_store
+
+def init_fetch_limits(max_rows=10000, max_bytes=16 * 1024 * 1024, prompt_rows=50):
+    global MAX_RESULT_ROWS, MAX_RESULT_BYTES, PROMPT_ROW_LIMIT
+    MAX_RESULT_ROWS = int(max_rows)
+    MAX_RESULT_BYTES = int(max_bytes)
+    PROMPT_ROW_LIMIT = int(prompt_rows)
+
+def init_answer_mode(mode="auto"):
+    global ANSWER_MODE
+    ANSWER_MODE = mode if mode in answer_helper.ANSWER_MODES else "auto"
+
+def init_request_timeout(seconds=120):
+    global REQUEST_TIMEOUT
+    REQUEST_TIMEOUT = max(0.0, float(seconds or 0))
+
+def init_profiles(sample_rows=5000, max_values=20, ttl=86400, max_bytes=32 * 1024 * 1024, prompt_tokens=300,
+                  enabled=True):
+    global profiler
+    profiler = profile_helper.Profiler(sample_rows, max_values, ttl, max_bytes, prompt_tokens) if enabled else None
+    return profiler
+
+def init_examples(path=None, max_examples=5000, top_k=3, prompt_tokens=400, min_similarity=0.3,
+                  verify_seconds=300, enabled=True):
+    global example_store
+    example_store = example_helper.ExampleStore(
+        path, max_examples, top_k, prompt_tokens, min_similarity, verify_seconds
+    ) if enabled else None
+    return example_store
+
+def record_feedback(query_id, correct, session):
+    """
+    The user's verdict on an earlier answer. A wrong answer's SQL is also dropped
+    from the question cache. Raises KeyError for answers the example store never saw.
+    """
+    if not example_store:
+        raise KeyError(query_id)
+    question = example_store.feedback(query_id, correct)
+    if not correct and sql_cache:
+        cache_key = sql_cache.make_key(question, session.schema_model.fingerprint)
+        if cache_key:
+            sql_cache.invalidate(cache_key)
+
+def init_snapshots(directory=".snapshots", tables=None, refresh_interval=600, max_staleness=900,
+                   route="analytical", enabled=True):
+    global snapshots
+    if snapshots:
+        snapshots.close()
+    snapshots = None
+    if enabled and tables:
+        try:
+            snapshots = snapshot_helper.SnapshotManager(directory, tables, refresh_interval, max_staleness, route)
+        except RuntimeError as e:
+            logger.error(f"Snapshots disabled: {e}")
+    return snapshots
+
+def init_coalescing(enabled=True):
+    global coalescer
+    coalescer = coalesce_helper.Coalescer() if enabled else None
+    return coalescer
+
+def init_structured_output(enabled=True):
+    global STRUCTURED_OUTPUT
+    STRUCTURED_OUTPUT = bool(enabled)
+    _plain_models.clear()
+
+def _schema_preamble(db_schema):
+    """The static head of the SQL prompts; cached as Gemini context for large schemas."""
+    return f"""
+    You are a MySQL expert.
+    Database Schema:
+    {db_schema}
+    """
+
+def _cached_schema_note(tables):
+    # The preamble with the full schema is already in the model's cached context
+    hint = f" The tables most likely relevant are: {', '.join(tables)}." if tables else ""
+    return f"""
+    Use the database schema given above.{hint}
+    """
+
+def _prompt_head(db_schema, cached_tables=None, value_hints="", examples=""):
+    head = _cached_schema_note(cached_tables) if db_schema is None else _schema_preamble(db_schema)
+    for section in (value_hints, examples):
+        if section:
+            head += f"""
+    {section}
+    """
+    return head
+
+def _structured_sql_prompt(query, db_schema, cached_tables=None, value_hints="", examples=""):
+    head = _prompt_head(db_schema, cached_tables, value_hints, examples)
+    return head + f"""
+    The user asks: '{query}'.
+
+    Reply with a JSON object:
+    - "intent": "query" if answering needs data from the database, otherwise "chat".
+    - "sql": for "query", a single MySQL SELECT statement answering the question.
+    - "tables": for "query", the tables the SQL reads.
+    - "answer_template": for "query", only if the SQL returns exactly one row: a one-sentence
+      answer with the result columns as {{column_alias}} placeholders, e.g. "There are {{total}} customers.".
+    - "reply": for "chat", your answer to the user, using the schema context.
+    """
+
+def _sql_prompt(query, db_schema, cached_tables=None, value_hints="", examples=""):
+    head = _prompt_head(db_schema, cached_tables, value_hints, examples)
+    return head + f"""
+    The user asks: '{query}'.
+    
+    If the user asks for a query, provide ONLY the SQL query in a code block (```sql ... ```).
+    If the user asks a general question, answer it using the schema context.
+    """
+
+def _parse_sql_reply(bot_reply):
+    """
+    Reads a reply to either SQL prompt into a plan dict: intent ("query" or "chat"),
+    sql, tables, answer_template and reply (the text to show for "chat").
+    Structured replies are JSON; older models' free text is searched for a ```sql
+    block, any fenced block holding a statement, or a bare statement.
+    """
+    plan = {"intent": "chat", "sql": None, "tables": [], "answer_template": None, "reply": bot_reply}
+    text = (bot_reply or "").strip()
+    unfenced = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    try:
+        data = json.loads(unfenced)
+    except ValueError:
+        data = None
+    if isinstance(data, dict) and ("sql" in data or "intent" in data):
+        sql = (data.get("sql") or "").strip().rstrip(";").strip()
+        if sql and data.get("intent", "query") == "query":
+            plan.update(
+                intent="query", sql=sql,
+                tables=[t for t in data.get("tables") or [] if isinstance(t, str)],
+                answer_template=data.get("answer_template") or None,
+            )
+        else:
+            plan["reply"] = data.get("reply") or bot_reply
+        return plan
+
+    blocks = re.findall(r"```([a-zA-Z]*)[ \t]*\n?(.*?)```", text, re.DOTALL)
+    sql = next((body for lang, body in blocks if lang.lower() in ("sql", "mysql")), None)
+    if sql is None:
+        sql = next((body for _, body in blocks if _SQL_START_RE.match(body)), None)
+    if sql is None and _SQL_START_RE.match(text) and not blocks:
+        sql = text
+    if sql and sql.strip():
+        plan.update(intent="query", sql=sql.strip().rstrip(";").strip())
+    return plan
+
+async def _generate_sql(query, db_schema, priority=1, session=None, tables=None, span=None, value_hints="",
+                        examples=""):
+    """
+    Asks the model for SQL through the dispatcher (hedging / fallback across models).
+    Returns Dispatched whose value is (chat, raw_reply, cached_content); the chat is
+    reused for the answer. With a `session` whose schema qualifies for context caching, the chat refers to
+    the cached full-schema preamble and the prompt only names the likely `tables`.
+    `value_hints` (profile_helper lines) and `examples` (example_helper's nearest
+    earlier questions) follow the schema in either case.
+    Token counts of the reply are set on `span` (a metrics_helper.Span) when given.
+    """
+    use_context_cache = bool(
+        context_cache and session and context_cache.applies_to(session.schema_index.total_tokens)
+    )
+
+    async def ask(model, allow_cache=True):
+        cached_content = None
+        if use_context_cache and allow_cache:
+            cached_content = await context_cache.get(
+                client, model, session.scope, session.schema_model.fingerprint,
+                _schema_preamble(session.schema_preamble)
+            )
+        structured = STRUCTURED_OUTPUT and model not in _plain_models
+        if cached_content:
+            build = _structured_sql_prompt if structured else _sql_prompt
+            prompt = build(query, None, tables, value_hints, examples)
+            estimated = schema_helper.estimate_tokens(prompt) + session.schema_index.total_tokens + SQL_REPLY_TOKENS
+        else:
+            prompt = (_structured_sql_prompt if structured else _sql_prompt)(query, db_schema, None, value_hints, examples)
+            estimated = schema_helper.estimate_tokens(prompt) + SQL_REPLY_TOKENS
+        json_settings = {"response_mime_type": "application/json", "response_schema": SQL_RESPONSE_SCHEMA}
+        await _reserve(model, estimated, priority)
+        logger.info(f"Attempting to generate response with model: {model}")
+        if cached_content:
+            # Later turns on this chat (the answer) keep the cached context too
+            chat = client.aio.chats.create(
+                model=model, config=types.GenerateContentConfig(cached_content=cached_content)
+            )
+        else:
+            chat = client.aio.chats.create(model=model)
+        try:
+            if structured:
+                config = types.GenerateContentConfig(cached_content=cached_content, **json_settings)
+                response = await chat.send_message(prompt, config=config)
+            else:
+                response = await chat.send_message(prompt)
+        except Exception as e:
+            if cached_content and context_cache_helper.is_missing_cache_error(e):
+                # Expired or deleted on the provider's side: recreate it next time
+                context_cache.forget(model, session.scope)
+                return await ask(model, allow_cache=False)
+            if not structured or not re.search(r"response_(mime_type|schema)|JSON mode", str(e), re.IGNORECASE):
+                raise
+            # This model predates JSON mode: ask for a ```sql block from now on
+            logger.warning(f"Model {model} rejected structured output; using plain SQL replies")
+            _plain_models.add(model)
+            return await ask(model, allow_cache)
+        _settle(model, estimated, response)
+        if span is not None:
+            prompt_tokens, response_tokens, cached_tokens = metrics_helper.usage_counts(response)
+            span.set(prompt_tokens=prompt_tokens, response_tokens=response_tokens, cached_tokens=cached_tokens)
+        return chat, response.text, cached_content
+
+    return await dispatcher.call(ask)
+
+def _execute_snapshot(snapshot, duck_sql, sql_query, stage, running=None):
     """
+    _execute_sql's execute and fetch stages on a snapshot_helper.SnapshotEngine,
+    within the query guard's time limit.
+    """
+    with snapshot.connection() as conn, snapshot.deadline(conn, query_guard.timeout if query_guard else 0):
+        with stage("execute", engine="snapshot") as span:
+            span.set(snapshot_age=round(snapshot.max_age(sql_query), 1))
+            if running is not None:
+                running.attach(snapshot, conn)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(duck_sql)
+            finally:
+                if running is not None:
+                    running.detach()
+            span.set(cache_hit=False)
+        with stage("fetch") as span:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            rows, summary, _ = result_helper.fetch_bounded(cursor, MAX_RESULT_ROWS, MAX_RESULT_BYTES, FETCH_BATCH_SIZE)
+            span.set(rows=len(rows), truncated=summary.truncated)
+    return columns, rows, summary
+
+def _execute_sql(db_pool, sql_query, cache_scope="", trace=None, running=None, snapshot=None):
+    """
+    Runs SQL through the query guard and the result cache, reading at most
+    MAX_RESULT_ROWS / MAX_RESULT_BYTES. Returns (columns, rows, summary,
+    served_from_cache, guarded); guarded is the guard's GuardedQuery, or None when
+    there is no guard or the result came from the cache. The connect, execute and
+    fetch stages are recorded as spans of `trace` (a metrics_helper.Trace). While the
+    statement runs, its connection is attached to `running` (a cancel_helper.RunningQuery)
+    so a cancelled request can kill it. With a `snapshot` engine, queries it accepts
+    run there instead of on MySQL (no cost check or result cache needed), falling
+    back to MySQL if DuckDB can't run them, but not if they run out of time.
+    """
+    stage = trace.span if trace is not None else metrics_helper.span
+    if query_guard:
+        # Cheap and local: nothing but a single read-only statement reaches the server
+        query_guard.validate(sql_query)
+    if snapshot is not None:
+        duck_sql, _ = snapshot.route(sql_query)
+        if duck_sql:
+            try:
+                columns, rows, summary = _execute_snapshot(snapshot, duck_sql, sql_query, stage, running)
+                return columns, rows, summary, False, None
+            except (cancel_helper.QueryCancelledError, snapshot_helper.SnapshotTimeoutError):
+                raise
+            except Exception as e:
+                if running is not None and running.cancelled:
+                    raise
+                snapshot.record_fallback(e)
+    with contextlib.ExitStack() as stack:
+        with stage("connect") as span:
+            connect = db_pool.connection
+            if hasattr(db_pool, "write_connection"):
+                try:
+                    guard_helper.validate(sql_query)
+                except guard_helper.QueryRejectedError:
+                    # Only without a query guard: writes go to the primary and pin reads to it
+                    connect = db_pool.write_connection
+            conn = stack.enter_context(connect())
+            if hasattr(db_pool, "route_of"):
+                # Which replica (or the primary) router_helper picked
+                span.set(route=db_pool.route_of(conn))
+        with stage("execute") as span:
+            table_versions = {}
+            if result_cache:
+                try:
+                    sql_tables = sql_helper.referenced_tables(sql_query)
+                    table_versions = result_cache.table_versions(
+                        sql_tables, lambda stale: db_helper.fetch_table_versions(conn, stale), cache_scope
+                    )
+                    cached_result = result_cache.get(sql_query, table_versions, cache_scope)
+                    metrics_helper.record_cache("result", bool(cached_result))
+                    if cached_result:
+                        columns, rows = cached_result
+                        span.set(cache_hit=True, cached_rows=len(rows))
+                        return columns, rows, result_helper.summarize_rows(columns, rows), True, None
+                except Exception as cache_err:
+                    logger.warning(f"Result cache lookup skipped: {cache_err}")
+
+            guarded = query_guard.check(conn, sql_query) if query_guard else None
+            if guarded:
+                span.set(estimated_cost=guarded.cost, estimated_rows=guarded.rows, rewritten=guarded.rewritten)
+
+            if running is not None:
+                running.attach(db_pool, conn)
+                stack.callback(running.detach)
+            # Unbuffered: rows stay on the server until fetched, so the caps bound our memory
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(guarded.execute_sql if guarded else sql_query)
+            span.set(cache_hit=False)
+
+        with stage("fetch") as span:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            rows, summary, exhausted = result_helper.fetch_bounded(
+                cursor, MAX_RESULT_ROWS, MAX_RESULT_BYTES, FETCH_BATCH_SIZE
+            )
+            span.set(rows=len(rows), truncated=summary.truncated)
+
+            if not exhausted:
+                # Closing the socket is cheaper than draining millions of unread rows
+                db_pool.discard_on_release(conn)
+            else:
+                cursor.close()
+                # Rows of a LIMIT-rewritten query are not the answer to sql_query; don't cache them as such
+                if result_cache and columns and not (guarded and guarded.rewritten):
+                    result_cache.put(sql_query, table_versions, columns, rows, cache_scope)
+        return columns, rows, summary, False, guarded
+
+def _summary_prompt(query, columns, rows, summary):
+    if len(rows) <= PROMPT_ROW_LIMIT and not summary.truncated:
+        data_summary = f"Columns: {columns}\nRows: {rows}"
+    else:
+        # Too many rows to paste; describe them instead
+        data_summary = summary.to_prompt()
+    return f"""
+    The database returned this data:
+    {data_summary}
+    
+    Based on this data, please answer the user's original question: '{query}'.
+    Answer in a friendly, natural language sentence. 
+    Do NOT show the SQL query or the raw data structure in your final response.
+    """
+
+async def stream_response_async(query, session, schema_top_k=8, schema_token_budget=4000, priority="normal",
+                                answer_mode=None, timeout=None):
+    """
+    Same pipeline as generate_response, as an async generator of (event, data) pairs:
+    - ("step", text)             a thought_process entry, as soon as it happens
+    - ("sql", sql_query)         the SQL about to run
+    - ("rows", {...})            columns, the first ROW_PREVIEW_LIMIT rows and the row count
+    - ("answer", text)           a chunk of the final answer, streamed from Gemini
+    - ("answer_reset", None)     discard streamed answer text (a backup model is retrying)
+    - ("done", result)           the full result dict, identical to generate_response()
+    Gemini calls use the async client and the SQL runs on async_helper's thread pool,
+    so a slow model or query never holds a server thread. `session` is the caller's
+    session_helper.Session (schema index, connection pool, cache scope). `priority`
+    ("high", "normal", "low") orders this request in the per-model quota queues.
+    `answer_mode` ("auto", "template", "llm"; default ANSWER_MODE) picks how results
+    are phrased: simple shapes can be answered from answer_helper's templates
+    without a second Gemini call.
+    Each stage runs in a metrics_helper span; the result's "trace" lists their timings.
+    While an identical question on the same database, as the same MySQL user, is
+    being answered, this joins that run (see coalesce_helper) instead of starting
+    another; its query_id is then re-registered for this session.
+    The question is cancelled after `timeout` seconds (at most REQUEST_TIMEOUT), ending
+    with a "timed_out" result, or when the caller closes this generator or cancels
+    the task iterating it (client gone): pending Gemini calls are aborted and a
+    running query is killed (see cancel_helper).
+    """
+    mode = answer_mode if answer_mode in answer_helper.ANSWER_MODES else ANSWER_MODE
+    question = cache_helper.question_key(query)
+    if not (coalescer and client and question):
+        events = _traced_pipeline(query, session, schema_top_k, schema_token_budget, priority, mode)
+    else:
+        # session.scope names the MySQL user too: users with different grants never share rows
+        key = (session.scope, session.schema_model.fingerprint, question, mode)
+        events = _own_query_ids(coalescer.subscribe(key, lambda: _traced_pipeline(
+            query, session, schema_top_k, schema_token_budget, priority, mode
+        )), session)
+    limits = [t for t in (timeout, REQUEST_TIMEOUT) if t]
+    deadline = time.monotonic() + min(limits) if limits else None
+    finished = False
+    try:
+        while True:
+            try:
+                if deadline is None:
+                    item = await events.__anext__()
+                else:
+                    item = await asyncio.wait_for(events.__anext__(), max(0.0, deadline - time.monotonic()))
+            except StopAsyncIteration:
+                finished = True
+                return
+            except asyncio.TimeoutError:
+                finished = True
+                cancel_helper.cancellations.record("deadline")
+                yield "done", {
+                    "success": False,
+                    "error": f"No answer within {min(limits):g}s; the question was cancelled.",
+                    "timed_out": True
+                }
+                return
+            if item[0] == "done":
+                finished = True
+            yield item
+    except (GeneratorExit, asyncio.CancelledError):
+        if not finished:
+            cancel_helper.cancellations.record("disconnect")
+        raise
+    finally:
+        await events.aclose()
+
+async def _own_query_ids(events, session):
+    """`events` of a coalesced run, with its query handle (owned by the session that started the run) adopted by `session`."""
+    adopted = {}
+    try:
+        async for event, data in events:
+            query_id = data.get("query_id") if event in ("rows", "done") else None
+            if query_id:
+                if query_id not in adopted:
+                    adopted[query_id] = query_store.adopt(query_id, session.id)
+                if event == "done" and example_store and adopted[query_id]:
+                    example_store.share(query_id, adopted[query_id])
+                data = dict(data, query_id=adopted[query_id])
+            yield event, data
+    finally:
+        await events.aclose()
+
+async def _traced_pipeline(query, session, schema_top_k, schema_token_budget, priority, answer_mode):
+    trace = metrics_helper.Trace("chat")
+    pipeline = _stream_pipeline(
+        query, session, schema_top_k, schema_token_budget, priority, answer_mode, trace
+    )
+    try:
+        async for event, data in pipeline:
+            if event == "done":
+                trace.finish(_trace_outcome(trace, data))
+                data["trace"] = trace.to_dict()
+                if example_store:
+                    example_store.record_run(session, query, trace, data)
+            yield event, data
+    finally:
+        # Client went away (or the deadline passed) before "done"
+        trace.finish("cancelled")
+        await pipeline.aclose()
+        if trace.outcome == "cancelled":
+            cancel_helper.cancellations.record_trace(trace)
+
+def _trace_outcome(trace, result):
+    if not result.get("success"):
+        return "overloaded" if result.get("overloaded") else "error"
+    if result.get("rejected"):
+        return "rejected"
+    if any(span.name in ("execute", "fetch") and span.outcome == "error" for span in trace.spans):
+        return "query_error"
+    return "ok"
+
+async def _stream_pipeline(query, session, schema_top_k, schema_token_budget, priority, answer_mode, trace):
     if not client:
-        return {"success": False, "error": "AI Client not ready"}
+        yield "done", {"success": False, "error": "AI Client not ready"}
+        return
 
     steps = []
-    steps.append("Analyzing database schema...")
+
+    def step(text):
+        steps.append(text)
+        return "step", text
+
+    yield step("Analyzing database schema...")
     
     # 1. Generate SQL
-    steps.append("Identifying relevant tables...")
+    yield step("Identifying relevant tables...")
+    schema_index = session.schema_index
+    with trace.span("schema") as span:
+        db_schema, tables = schema_index.context_for(query, schema_top_k, schema_token_budget)
+        value_hints = ""
+        if profiler:
+            profiler.ensure(session)
+            value_hints = profiler.hints_for(session, query, tables)
+        span.set(tables=len(tables), schema_tokens=schema_helper.estimate_tokens(db_schema),
+                 profile_tokens=schema_helper.estimate_tokens(value_hints))
+    total_tables = len(schema_index.model.tables)
+    if len(tables) < total_tables:
+        preview = ", ".join(tables[:5]) + ("..." if len(tables) > 5 else "")
+        yield step(f"Using {len(tables)} of {total_tables} tables: {preview}")
+    if value_hints:
+        yield step(f"Adding {value_hints.count(chr(10))} sampled column profiles to the prompt.")
+
+    # A question we have already answered against this schema skips SQL generation
+    cache_key = None
+    cached_sql = None
+    if sql_cache:
+        cache_key = sql_cache.make_key(query, schema_index.model.fingerprint)
+        if cache_key:
+            cached_sql = sql_cache.get(cache_key)
+            metrics_helper.record_cache("question", cached_sql is not None)
+    rank = ratelimit_helper.PRIORITIES.get(priority, 1)
     try:
-        # Define models to try in order
-        models_to_try = [model_name, "gemini-flash-latest"]
-        # If the primary model is already gemini-flash-latest, don't duplicate it in the list efficiently
-        if model_name == "gemini-flash-latest":
-            models_to_try = ["gemini-flash-latest"]
-            
-        final_exception = None
+        chat, chat_model, chat_tokens = None, None, 0
+        answer_template = None
+        if cached_sql:
+            with trace.span("generate", cache_hit=True):
+                sql_query = cached_sql
+            yield step("Reusing SQL from an earlier identical question (cache hit).")
+        else:
+            hint_tables = tables if len(tables) < total_tables else None
+            examples, example_count = example_store.prompt_for(session, query) if example_store else ("", 0)
+            if example_count:
+                yield step(f"Adding {example_count} verified example(s) of similar earlier questions to the prompt.")
+            with trace.span("generate", cache_hit=False, examples=example_count) as span:
+                dispatched = await _generate_sql(
+                    query, db_schema, rank, session, hint_tables, span, value_hints, examples
+                )
+                chat, bot_reply, cached_content = dispatched.value
+                span.set(model=dispatched.model, context_cache=bool(cached_content))
+            for note in dispatched.notes:
+                yield step(note)
+            chat_model = dispatched.model
+            if cached_content:
+                yield step("Full schema read from the model's context cache.")
+            chat_tokens = schema_helper.estimate_tokens(db_schema) + schema_helper.estimate_tokens(bot_reply)
+            plan = _parse_sql_reply(bot_reply)
+            sql_query, answer_template = plan["sql"], plan["answer_template"]
+            if not sql_query:
+                # General Chat (No SQL)
+                yield "answer", plan["reply"]
+                yield "done", {
+                    "success": True,
+                    "response": plan["reply"],
+                    "is_sql_query": False,
+                    "thought_process": ["Analyzed query.", f"Generated direct response with {chat_model}."]
+                }
+                return
+            if plan["tables"]:
+                yield step(f"Generated SQL ({chat_model}) over {', '.join(plan['tables'])}: {sql_query[:50]}...")
+            else:
+                yield step(f"Generated SQL ({chat_model}): {sql_query[:50]}...")
+        yield "sql", sql_query
         
-        for current_model in models_to_try:
-            try:
-                logger.info(f"Attempting to generate response with model: {current_model}")
-                chat = client.chats.create(model=current_model)
-                
-                context = f"""
-                You are a MySQL expert. 
-                Database Schema:
-                {db_schema}
-                
-                The user asks: '{query}'.
-                
-                If the user asks for a query, provide ONLY the SQL query in a code block (```sql ... ```).
-                If the user asks a general question, answer it using the schema context.
-                """
-                
-                response = chat.send_message(context)
-                bot_reply = response.text
-                
-                # Check for SQL
-                sql_match = re.search(r"```sql\n(.*?)\n```", bot_reply, re.DOTALL)
-                
-                if sql_match:
-                    sql_query = sql_match.group(1).strip()
-                    steps.append(f"Generated SQL ({current_model}): {sql_query[:50]}...")
-                    
-                    # 2. Execute SQL
-                    steps.append("Executing query against database...")
+        # 2. Execute SQL
+        yield step("Executing query against database...")
+        try:
+            running = cancel_helper.RunningQuery()
+            snapshot = snapshots.engine_for(session) if snapshots else None
+            columns, rows, summary, cached_result, guarded = await async_helper.run_blocking(
+                _execute_sql, session.pool, sql_query, session.scope, trace, running, snapshot,
+                on_cancel=running.cancel
+            )
+        except guard_helper.QueryRejectedError as rejected:
+            if cache_key:
+                sql_cache.invalidate(cache_key)
+            yield step(f"Query not run: {rejected}")
+            yield "done", {
+                "success": True,
+                "response": f"I wrote a query for this but did not run it. {rejected}",
+                "sql_query": sql_query,
+                "is_sql_query": True,
+                "rejected": True,
+                "thought_process": steps
+            }
+            return
+        except Exception as db_err:
+            if cache_key:
+                # Never keep serving SQL that no longer runs
+                sql_cache.invalidate(cache_key)
+            yield step(f"Error executing SQL: {db_err}")
+            yield "done", {
+                "success": True, # Still a valid AI interaction, just a DB error response
+                "response": f"I tried to run a query but encountered an error: {str(db_err)}",
+                "sql_query": sql_query,
+                "is_sql_query": True,
+                "thought_process": steps
+            }
+            return
+        
+        if cache_key and not cached_sql:
+            sql_cache.put(cache_key, sql_query)
+        if cached_result:
+            yield step("Tables unchanged since last run; reusing cached results.")
+        executed = next((s for s in reversed(trace.spans) if s.name == "execute"), None)
+        if executed is not None and executed.attributes.get("engine") == "snapshot":
+            yield step(
+                f"Ran on the local snapshot (data up to {executed.attributes['snapshot_age']:.0f}s old). "
+                "Result pages and exports read the live database."
+            )
+        if guarded:
+            for note in guarded.notes:
+                yield step(note)
+            if guarded.rewritten:
+                # The added LIMIT is part of what the rows (and later pages) mean
+                sql_query = guarded.sql
+        if summary.truncated:
+            yield step(f"Retrieved the first {len(rows)} rows of data (row limit reached).")
+        else:
+            yield step(f"Retrieved {len(rows)} rows of data.")
+        query_id = query_store.register(
+            sql_query, columns, len(rows), summary.truncated, session.id
+        ) if columns else None
+        yield "rows", {
+            "query_id": query_id,
+            "columns": columns,
+            "rows": rows[:ROW_PREVIEW_LIMIT],
+            "row_count": len(rows),
+            "truncated": summary.truncated
+        }
+        
+        # 3. Synthesize Answer
+        mode = answer_mode if answer_mode in answer_helper.ANSWER_MODES else ANSWER_MODE
+        with trace.span("synthesize") as span:
+            answer = None
+            if mode != "llm":
+                answer = answer_helper.synthesize(
+                    columns, rows, sql_query, truncated=summary.truncated, force=mode == "template",
+                    template=answer_template
+                )
+            if answer is not None:
+                span.set(source="template")
+                answer_counts["template"] += 1
+                yield step("Answered from a template (simple result shape, no second model call).")
+                yield "answer", answer
+            else:
+                span.set(source="model")
+                answer_counts["model"] += 1
+                yield step("Synthesizing natural language answer...")
+                summary_prompt = _summary_prompt(query, columns, rows, summary)
+
+                answer_tokens = schema_helper.estimate_tokens(summary_prompt) + ANSWER_REPLY_TOKENS
+
+                async def answer_stream(model):
+                    # The SQL chat already holds the question; other models start a fresh chat
+                    reuse = model == chat_model
+                    # Requests that already hold SQL results go ahead of new questions
+                    await _reserve(model, answer_tokens + (chat_tokens if reuse else 0), rank - 0.5)
+                    model_chat = chat if reuse else client.aio.chats.create(model=model)
+                    return await model_chat.send_message_stream(summary_prompt)
+
+                answer_parts = []
+                for attempt in range(len(dispatcher.models)):
+                    dispatched = await dispatcher.stream(answer_stream)
+                    for note in dispatched.notes:
+                        yield step(note)
+                    first_chunk, chunks = dispatched.value
+                    last_chunk = first_chunk
                     try:
-                        conn = mysql.connector.connect(**db_config)
-                        cursor = conn.cursor()
-                        cursor.execute(sql_query)
-                        
-                        columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                        rows = cursor.fetchall()
-                        
-                        cursor.close()
-                        conn.close()
-                        
-                        steps.append(f"Retrieved {len(rows)} rows of data.")
-                        
-                        # 3. Synthesize Answer
-                        steps.append("Synthesizing natural language answer...")
-                        data_summary = f"Columns: {columns}\nRows: {rows}"
-                        
-                        followup_prompt = f"""
-                        The database returned this data:
-                        {data_summary}
-                        
-                        Based on this data, please answer the user's original question: '{query}'.
-                        Answer in a friendly, natural language sentence. 
-                        Do NOT show the SQL query or the raw data structure in your final response.
-                        """
-                        
-                        final_response = chat.send_message(followup_prompt)
-                        return {
-                            "success": True,
-                            "response": final_response.text,
-                            "sql_query": sql_query,
-                            "is_sql_query": True,
-                            "thought_process": steps
-                        }
-                        
-                    except Exception as db_err:
-                        return {
-                            "success": True, # Still a valid AI interaction, just a DB error response
-                            "response": f"I tried to run a query but encountered an error: {str(db_err)}",
-                            "sql_query": sql_query,
-                            "is_sql_query": True,
-                            "thought_process": steps + [f"Error executing SQL: {db_err}"]
-                        }
-                else:
-                    # General Chat (No SQL)
-                    return {
-                        "success": True,
-                        "response": bot_reply,
-                        "is_sql_query": False,
-                        "thought_process": ["Analyzed query.", f"Generated direct response with {current_model}."]
-                    }
-                    
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    logger.warning(f"Rate limit hit for {current_model}. Trying next model...")
-                    steps.append(f"Rate limit hit for {current_model}. Switching backup model...")
-                    final_exception = e
-                    continue # Try next model
-                else:
-                    raise e # Re-raise if it's not a rate limit issue
+                        if first_chunk is not None and first_chunk.text:
+                            answer_parts.append(first_chunk.text)
+                            yield "answer", first_chunk.text
+                        async for chunk in chunks:
+                            last_chunk = chunk
+                            if chunk.text:
+                                answer_parts.append(chunk.text)
+                                yield "answer", chunk.text
+                        # Usage is reported on the final chunk
+                        reserved = answer_tokens + (chat_tokens if dispatched.model == chat_model else 0)
+                        _settle(dispatched.model, reserved, last_chunk)
+                        break
+                    except Exception as stream_err:
+                        # Broke off mid-answer: discard the partial text and ask again
+                        dispatcher.record_failure(dispatched.model, stream_err)
+                        if attempt == len(dispatcher.models) - 1:
+                            raise
+                        yield step(f"Answer from {dispatched.model} was interrupted; retrying...")
+                        yield "answer_reset", None
+                        answer_parts = []
+                    finally:
+                        # Also when the request is cancelled mid-answer: stop the response stream
+                        await model_helper.close_iterator(chunks)
+                prompt_tokens, response_tokens, _ = metrics_helper.usage_counts(last_chunk)
+                span.set(model=dispatched.model, prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+                answer = "".join(answer_parts)
         
-        # If we get here, all models failed
-        if final_exception:
-            raise final_exception
+        yield "done", {
+            "success": True,
+            "response": answer,
+            "sql_query": sql_query,
+            "query_id": query_id,
+            "is_sql_query": True,
+            "cached_sql": bool(cached_sql),
+            "cached_result": cached_result,
+            "answer_source": span.attributes["source"],
+            "thought_process": steps
+        }
             
     except Exception as e:
         logger.error(f"AI Generation Error: {e}")
-        return {"success": False, "error": str(e)}
+        result = {"success": False, "error": str(e)}
+        if getattr(e, "shed", False):
+            # Quota exhausted locally or every model is rate-limited: the client should retry
+            result.update(overloaded=True, retry_after=round(e.retry_after or 1, 1))
+        yield "done", result
+
+def stream_response(query, session, schema_top_k=8, schema_token_budget=4000, priority="normal",
+                    answer_mode=None, timeout=None):
+    """stream_response_async for synchronous callers (the Flask views), run on the pipeline loop."""
+    return async_helper.iterate_in_loop(
+        stream_response_async(query, session, schema_top_k, schema_token_budget, priority, answer_mode, timeout)
+    )
+
+async def generate_response_async(query, session, schema_top_k=8, schema_token_budget=4000, priority="normal",
+                                  answer_mode=None, timeout=None):
+    """Runs stream_response_async to completion and returns its final result dict."""
+    result = {"success": False, "error": "No response generated"}
+    async for event, data in stream_response_async(query, session, schema_top_k, schema_token_budget, priority, answer_mode, timeout):
+        if event == "done":
+            result = data
+    return result
+
+def generate_response(query, session, schema_top_k=8, schema_token_budget=4000, priority="normal",
+                      answer_mode=None, timeout=None):
+    """
+    1. Ask AI for SQL (with only the tables relevant to the question)
+    2. Run SQL
+    3. Ask AI to summarize answer
+    Runs stream_response to completion and returns its final result dict.
+    """
+    result = {"success": False, "error": "No response generated"}
+    for event, data in stream_response(query, session, schema_top_k, schema_token_budget, priority, answer_mode, timeout):
+        if event == "done":
+            result = data
+    return result
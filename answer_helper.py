@@ -0,0 +1,176 @@
+import datetime
+import decimal
+import math
+import re
+
+import sql_helper
+
+# Local answer synthesis: phrases common result shapes (a single value, a single
+# row, a short list, a ranking or a group-by aggregate) from templates, so those
+# questions skip the second model call. Anything else returns None and is left to
+# the model.
+#   "auto"     - template when the shape is recognised, otherwise the model
+#   "template" - never call the model; unrecognised shapes get a generic overview
+#   "llm"      - always ask the model
+
+ANSWER_MODES = ("auto", "template", "llm")
+
+# Longest list phrased inline; longer results go to the model (or the overview)
+MAX_LIST_ROWS = 15
+
+_PLACEHOLDER_RE = re.compile(r"\{([^{}]+)\}")
+_AGGREGATE_RE = re.compile(r"^(count|sum|avg|min|max)\s*\((.*)\)$", re.IGNORECASE)
+
+def _is_number(value):
+    return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)
+
+def _is_finite(value):
+    if isinstance(value, decimal.Decimal):
+        return value.is_finite()
+    return not isinstance(value, float) or math.isfinite(value)
+
+def format_value(value):
+    """Readable text for one value; None for NaN and infinities, which no template should phrase."""
+    if value is None:
+        return "no value"
+    if not _is_finite(value):
+        return None
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, (float, decimal.Decimal)):
+        if value == int(value) and abs(value) < 1e15:
+            return f"{int(value):,}"
+        return f"{float(value):,.2f}"
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    return str(value)
+
+def label(column):
+    """Readable name for a result column: "total_amount" -> "total amount", "COUNT(*)" -> "count"."""
+    match = _AGGREGATE_RE.match(column.strip())
+    if match:
+        func, arg = match.group(1).lower(), match.group(2).strip().strip("`")
+        names = {"count": "count", "sum": "total", "avg": "average", "min": "minimum", "max": "maximum"}
+        if arg in ("*", "1") or func == "count" and arg.upper().startswith("DISTINCT"):
+            return names[func] if arg in ("*", "1") else f"number of distinct {label(arg[8:].strip())}"
+        return f"{names[func]} {label(arg.split('.')[-1])}"
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", column.split(".")[-1].strip("`"))
+    return re.sub(r"[_\s]+", " ", text).strip().lower() or column
+
+def _join(items):
+    items = list(items)
+    if len(items) <= 1:
+        return "".join(items)
+    return ", ".join(items[:-1]) + " and " + items[-1]
+
+def _order(sql):
+    """"DESC" or "ASC": the direction of the first key of the outermost ORDER BY; None without one."""
+    tokens = [t.upper() for t in sql_helper.tokenize(sql)]
+    direction, depth, i = None, 0, 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == "(":
+            depth += 1
+        elif tok == ")":
+            depth -= 1
+        elif depth == 0 and tok == "ORDER" and i + 1 < len(tokens) and tokens[i + 1] == "BY":
+            direction, key_depth = "ASC", 0
+            for tok in tokens[i + 2:]:
+                if tok == "(":
+                    key_depth += 1
+                elif tok == ")":
+                    key_depth -= 1
+                elif key_depth == 0 and tok in (",", "LIMIT", ";", "ASC", "DESC"):
+                    direction = tok if tok in ("ASC", "DESC") else direction
+                    break
+        i += 1
+    return direction
+
+def _grouped(sql):
+    tokens = [t.upper() for t in sql_helper.tokenize(sql)]
+    return any(a == "GROUP" and b == "BY" for a, b in zip(tokens, tokens[1:]))
+
+def shape(columns, rows, sql=""):
+    """Names the result shape: empty, single_value, single_row, list, ranking, group_by, or None."""
+    if not columns:
+        return None
+    if not rows:
+        return "empty"
+    if len(rows) == 1:
+        return "single_value" if len(columns) == 1 else "single_row"
+    if len(rows) > MAX_LIST_ROWS:
+        return None
+    if len(columns) == 1:
+        return "list"
+    if len(columns) == 2 and all(_is_number(r[1]) or r[1] is None for r in rows):
+        if _grouped(sql):
+            return "group_by"
+        if _order(sql):
+            return "ranking"
+    return None
+
+def render_template(template, columns, rows):
+    """
+    Fills a model-supplied answer template ("There are {total} customers.") from a
+    single-row result. None unless every placeholder names a result column with a
+    value format_value can phrase.
+    """
+    if not template or len(rows) != 1:
+        return None
+    values = {}
+    for column, value in zip(columns, rows[0]):
+        values[column.lower()] = values[label(column)] = format_value(value)
+    names = [name.strip().lower() for name in _PLACEHOLDER_RE.findall(template)]
+    if not names or any(values.get(name) is None for name in names):
+        return None
+    return _PLACEHOLDER_RE.sub(lambda m: values[m.group(1).strip().lower()], template)
+
+def synthesize(columns, rows, sql="", truncated=False, force=False, template=None):
+    """
+    Returns a natural-language answer for `rows`, or None when the shape needs the
+    model. A `template` written by the model alongside the SQL wins for single-row
+    results. Truncated results are left to the model unless `force` (the "template"
+    mode), which always returns an answer.
+    """
+    if not all(_is_finite(value) for row in rows for value in row):
+        return overview(columns, rows, truncated) if force else None
+    rendered = render_template(template, columns, rows)
+    if rendered:
+        return rendered
+    kind = None if truncated else shape(columns, rows, sql)
+    if kind == "empty":
+        return "No matching records were found."
+    if kind == "single_value":
+        return f"The {label(columns[0])} is {format_value(rows[0][0])}."
+    if kind == "single_row":
+        fields = _join(f"{label(c)} {format_value(v)}" for c, v in zip(columns, rows[0]))
+        return f"I found one matching record: {fields}."
+    if kind == "list":
+        values = _join(format_value(r[0]) for r in rows)
+        return f"The {len(rows)} matching {label(columns[0])} values are {values}."
+    if kind == "ranking":
+        items = _join(f"{format_value(r[0])} ({format_value(r[1])})" for r in rows)
+        which = "top" if _order(sql) == "DESC" else "lowest"
+        return f"Ranked by {label(columns[1])}, the {which} {len(rows)} are {items}."
+    if kind == "group_by":
+        items = _join(f"{format_value(r[0])}: {format_value(r[1])}" for r in rows)
+        return f"The {label(columns[1])} by {label(columns[0])} is {items}."
+    if force:
+        return overview(columns, rows, truncated)
+    return None
+
+def overview(columns, rows, truncated=False, preview_rows=3):
+    """Generic description for shapes without a template (used in "template" mode)."""
+    count = f"at least {len(rows):,}" if truncated else f"{len(rows):,}"
+    text = f"The query returned {count} rows with columns {_join(label(c) for c in columns)}."
+    if rows:
+        samples = "; ".join(
+            ", ".join(f"{label(c)} {format_value(v) or v}" for c, v in zip(columns, row))
+            for row in rows[:preview_rows]
+        )
+        text += f" First {'row' if min(len(rows), preview_rows) == 1 else 'rows'}: {samples}."
+    return text
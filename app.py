@@ -1,13 +1,22 @@
 import os
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import logging
 import concurrent.futures
 import json
+import math
 
 # Import our new modules
 import db_helper
 import ai_helper
+import async_helper
+import batch_helper
+import cancel_helper
+import export_helper
+import metrics_helper
+import result_helper
+import session_helper
+import store_helper
 
 app = Flask(__name__)
 CORS(app)
@@ -35,14 +44,208 @@ def load_config():
 config = load_config()
 API_KEY = config.get("GOOGLE_API_KEY")
 GEMINI_MODEL = config.get("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+GEMINI_BACKUP_MODELS = config.get("GEMINI_BACKUP_MODELS", ["gemini-flash-latest"])
+MODEL_HEDGE_PERCENTILE = config.get("MODEL_HEDGE_PERCENTILE", 95)  # null disables hedging
+MODEL_HEDGE_MIN_SECONDS = float(config.get("MODEL_HEDGE_MIN_SECONDS", 0.5))
+MODEL_HEDGE_MAX_SECONDS = float(config.get("MODEL_HEDGE_MAX_SECONDS", 15))
+MODEL_HEDGE_DEFAULT_SECONDS = float(config.get("MODEL_HEDGE_DEFAULT_SECONDS", 4))
+MODEL_BREAKER_COOLDOWN = float(config.get("MODEL_BREAKER_COOLDOWN_SECONDS", 30))
+MODEL_BREAKER_FAILURES = int(config.get("MODEL_BREAKER_FAILURES", 3))
+RATE_LIMIT_ENABLED = bool(config.get("RATE_LIMIT_ENABLED", True))
+MODEL_QUOTAS = config.get("MODEL_QUOTAS", {})  # model -> {"rpm": n, "tpm": n}
+RATE_LIMIT_DEFAULT_RPM = int(config.get("RATE_LIMIT_DEFAULT_RPM", 15))
+RATE_LIMIT_DEFAULT_TPM = int(config.get("RATE_LIMIT_DEFAULT_TPM", 1000000))
+RATE_LIMIT_HEADROOM = float(config.get("RATE_LIMIT_HEADROOM", 0.9))
+RATE_LIMIT_MAX_QUEUE = int(config.get("RATE_LIMIT_MAX_QUEUE", 100))
+RATE_LIMIT_MAX_WAIT = float(config.get("RATE_LIMIT_MAX_WAIT_SECONDS", 10))
+DB_POOL_SIZE = int(config.get("DB_POOL_SIZE", 5))
+DB_POOL_MAX_IDLE = int(config.get("DB_POOL_MAX_IDLE_SECONDS", 300))
+DB_CONNECTIONS = config.get("DB_CONNECTIONS", {})  # name -> {host, port, user, password, database, replicas}
+REPLICA_MAX_LAG = config.get("REPLICA_MAX_LAG_SECONDS", 30)  # null disables the lag limit
+REPLICA_LAG_CHECK = float(config.get("REPLICA_LAG_CHECK_SECONDS", 5))
+REPLICA_FAILURE_COOLDOWN = float(config.get("REPLICA_FAILURE_COOLDOWN_SECONDS", 30))
+REPLICA_READ_FROM_PRIMARY = bool(config.get("REPLICA_READ_FROM_PRIMARY", True))
+SCHEMA_CACHE_DIR = config.get("SCHEMA_CACHE_DIR", ".schema_cache")
+SCHEMA_TOP_K = int(config.get("SCHEMA_TOP_K", 8))
+SCHEMA_TOKEN_BUDGET = int(config.get("SCHEMA_TOKEN_BUDGET", 4000))
+QUESTION_CACHE_ENABLED = bool(config.get("QUESTION_CACHE_ENABLED", True))
+QUESTION_CACHE_SIZE = int(config.get("QUESTION_CACHE_SIZE", 1000))
+QUESTION_CACHE_TTL = int(config.get("QUESTION_CACHE_TTL_SECONDS", 86400))
+QUESTION_CACHE_PATH = config.get("QUESTION_CACHE_PATH")  # e.g. "question_cache.db"; unset = memory only
+RESULT_CACHE_ENABLED = bool(config.get("RESULT_CACHE_ENABLED", True))
+RESULT_CACHE_MAX_MB = float(config.get("RESULT_CACHE_MAX_MB", 32))
+RESULT_CACHE_TTL = int(config.get("RESULT_CACHE_TTL_SECONDS", 300))
+RESULT_CACHE_POLL_INTERVAL = float(config.get("RESULT_CACHE_POLL_SECONDS", 2))
+RESULT_MAX_ROWS = int(config.get("RESULT_MAX_ROWS", 10000))
+RESULT_MAX_MB = float(config.get("RESULT_MAX_MB", 16))
+PROMPT_MAX_ROWS = int(config.get("PROMPT_MAX_ROWS", 50))
+ANSWER_MODE = config.get("ANSWER_MODE", "auto")  # auto | template | llm
+COALESCE_ENABLED = bool(config.get("COALESCE_ENABLED", True))
+REQUEST_TIMEOUT = float(config.get("REQUEST_TIMEOUT_SECONDS", 120))  # Per question; 0 disables
+SQL_STRUCTURED_OUTPUT = bool(config.get("SQL_STRUCTURED_OUTPUT", True))
+CONTEXT_CACHE_ENABLED = bool(config.get("CONTEXT_CACHE_ENABLED", True))
+CONTEXT_CACHE_TTL = int(config.get("CONTEXT_CACHE_TTL_SECONDS", 3600))
+CONTEXT_CACHE_MIN_TOKENS = int(config.get("CONTEXT_CACHE_MIN_TOKENS", 4096))  # Smaller schemas are pruned instead
+CONTEXT_CACHE_MAX_TOKENS = int(config.get("CONTEXT_CACHE_MAX_TOKENS", 500000))
+QUERY_EXPLAIN_ENABLED = bool(config.get("QUERY_EXPLAIN_ENABLED", True))
+QUERY_MAX_COST = config.get("QUERY_MAX_COST", 1000000)  # EXPLAIN query_cost; null disables
+QUERY_MAX_ROWS_EXAMINED = config.get("QUERY_MAX_ROWS_EXAMINED", 5000000)  # null disables
+QUERY_OVER_COST_ACTION = config.get("QUERY_OVER_COST_ACTION", "limit")  # limit | hint | refuse
+QUERY_OVER_COST_LIMIT_ROWS = int(config.get("QUERY_OVER_COST_LIMIT_ROWS", 1000))
+QUERY_OVER_COST_TIMEOUT = float(config.get("QUERY_OVER_COST_TIMEOUT_SECONDS", 5))
+QUERY_TIMEOUT = float(config.get("QUERY_TIMEOUT_SECONDS", 30))  # Server-side limit per query; 0 disables
+EXPORT_PAGE_SIZE = int(config.get("EXPORT_PAGE_SIZE", 5000))
+BATCH_MAX_QUESTIONS = int(config.get("BATCH_MAX_QUESTIONS", 200))
+BATCH_CONCURRENCY = int(config.get("BATCH_CONCURRENCY", 4))  # Questions answered at once per batch
+DB_EXECUTOR_WORKERS = int(config.get("DB_EXECUTOR_WORKERS", 16))  # Threads for blocking MySQL calls
+CONNECT_WORKERS = int(config.get("CONNECT_WORKERS", 4))
+WSGI_THREADS = int(config.get("WSGI_THREADS", 10))  # Threads for Flask views under asgi.py
+SESSION_STORE = config.get("SESSION_STORE", "memory")  # memory | sqlite | redis
+SESSION_STORE_PATH = config.get("SESSION_STORE_PATH", "sessions.db")
+SESSION_REDIS_URL = config.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_IDLE_TIMEOUT = int(config.get("SESSION_IDLE_TIMEOUT_SECONDS", 1800))
+SESSION_MAX_LIVE = int(config.get("SESSION_MAX_LIVE", 50))
+SESSION_MAX_MEMORY_MB = float(config.get("SESSION_MAX_MEMORY_MB", 512))
+SESSION_SECRET_KEY = config.get("SESSION_SECRET_KEY")  # Encrypts stored DB passwords; needs cryptography
+SESSION_COOKIE = "talk2db_session"
+PROFILE_ENABLED = bool(config.get("PROFILE_ENABLED", True))
+PROFILE_SAMPLE_ROWS = int(config.get("PROFILE_SAMPLE_ROWS", 5000))  # Rows sampled per table
+PROFILE_MAX_VALUES = int(config.get("PROFILE_MAX_VALUES", 20))  # Columns with more distinct values get a range
+PROFILE_TTL_SECONDS = float(config.get("PROFILE_TTL_SECONDS", 86400))
+PROFILE_MAX_MB = float(config.get("PROFILE_MAX_MB", 32))
+PROFILE_PROMPT_TOKENS = int(config.get("PROFILE_PROMPT_TOKENS", 300))
+EXAMPLES_ENABLED = bool(config.get("EXAMPLES_ENABLED", True))
+EXAMPLES_PATH = config.get("EXAMPLES_PATH")  # e.g. "sql_examples.db"; unset = memory only
+EXAMPLES_MAX = int(config.get("EXAMPLES_MAX", 5000))
+EXAMPLES_TOP_K = int(config.get("EXAMPLES_TOP_K", 3))
+EXAMPLES_PROMPT_TOKENS = int(config.get("EXAMPLES_PROMPT_TOKENS", 400))
+EXAMPLES_MIN_SIMILARITY = float(config.get("EXAMPLES_MIN_SIMILARITY", 0.3))
+EXAMPLES_VERIFY_SECONDS = float(config.get("EXAMPLES_VERIFY_SECONDS", 300))  # Unchallenged this long = verified
+SNAPSHOT_ENABLED = bool(config.get("SNAPSHOT_ENABLED", False))  # Needs duckdb and pyarrow
+SNAPSHOT_DIR = config.get("SNAPSHOT_DIR", ".snapshots")
+SNAPSHOT_TABLES = config.get("SNAPSHOT_TABLES", {})  # {table: {"incremental_column", "refresh_seconds", "max_staleness_seconds"}}
+SNAPSHOT_REFRESH_SECONDS = float(config.get("SNAPSHOT_REFRESH_SECONDS", 600))
+SNAPSHOT_MAX_STALENESS_SECONDS = float(config.get("SNAPSHOT_MAX_STALENESS_SECONDS", 900))
+SNAPSHOT_ROUTE = config.get("SNAPSHOT_ROUTE", "analytical")  # analytical | all
+OTEL_TRACES_ENABLED = bool(config.get("OTEL_TRACES_ENABLED", False))  # Needs the opentelemetry packages
+OTEL_SERVICE_NAME = config.get("OTEL_SERVICE_NAME", "talk2db")
 
 # Initialize AI
 ai_helper.init_client(API_KEY, GEMINI_MODEL)
+ai_helper.init_dispatcher(
+    GEMINI_BACKUP_MODELS, MODEL_HEDGE_PERCENTILE, MODEL_HEDGE_MIN_SECONDS, MODEL_HEDGE_MAX_SECONDS,
+    MODEL_HEDGE_DEFAULT_SECONDS, MODEL_BREAKER_COOLDOWN, MODEL_BREAKER_FAILURES
+)
+ai_helper.init_rate_limiter(
+    MODEL_QUOTAS, RATE_LIMIT_DEFAULT_RPM, RATE_LIMIT_DEFAULT_TPM, RATE_LIMIT_HEADROOM,
+    RATE_LIMIT_MAX_QUEUE, RATE_LIMIT_MAX_WAIT, enabled=RATE_LIMIT_ENABLED
+)
+ai_helper.init_sql_cache(
+    QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL, QUESTION_CACHE_PATH, enabled=QUESTION_CACHE_ENABLED
+)
+ai_helper.init_result_cache(
+    int(RESULT_CACHE_MAX_MB * 1024 * 1024), RESULT_CACHE_TTL, RESULT_CACHE_POLL_INTERVAL,
+    enabled=RESULT_CACHE_ENABLED
+)
+ai_helper.init_fetch_limits(RESULT_MAX_ROWS, int(RESULT_MAX_MB * 1024 * 1024), PROMPT_MAX_ROWS)
+ai_helper.init_answer_mode(ANSWER_MODE)
+ai_helper.init_coalescing(COALESCE_ENABLED)
+ai_helper.init_request_timeout(REQUEST_TIMEOUT)
+ai_helper.init_profiles(
+    PROFILE_SAMPLE_ROWS, PROFILE_MAX_VALUES, PROFILE_TTL_SECONDS, int(PROFILE_MAX_MB * 1024 * 1024),
+    PROFILE_PROMPT_TOKENS, enabled=PROFILE_ENABLED
+)
+ai_helper.init_examples(
+    EXAMPLES_PATH, EXAMPLES_MAX, EXAMPLES_TOP_K, EXAMPLES_PROMPT_TOKENS, EXAMPLES_MIN_SIMILARITY,
+    EXAMPLES_VERIFY_SECONDS, enabled=EXAMPLES_ENABLED
+)
+ai_helper.init_snapshots(
+    SNAPSHOT_DIR, SNAPSHOT_TABLES, SNAPSHOT_REFRESH_SECONDS, SNAPSHOT_MAX_STALENESS_SECONDS, SNAPSHOT_ROUTE,
+    enabled=SNAPSHOT_ENABLED
+)
+ai_helper.init_structured_output(SQL_STRUCTURED_OUTPUT)
+ai_helper.init_context_cache(
+    CONTEXT_CACHE_TTL, CONTEXT_CACHE_MIN_TOKENS, CONTEXT_CACHE_MAX_TOKENS, enabled=CONTEXT_CACHE_ENABLED
+)
+ai_helper.init_query_guard(
+    QUERY_MAX_COST, QUERY_MAX_ROWS_EXAMINED, QUERY_OVER_COST_ACTION, QUERY_OVER_COST_LIMIT_ROWS,
+    QUERY_TIMEOUT, QUERY_OVER_COST_TIMEOUT, explain=QUERY_EXPLAIN_ENABLED
+)
+async_helper.init_executor(DB_EXECUTOR_WORKERS)
+metrics_helper.init_tracing(OTEL_TRACES_ENABLED, OTEL_SERVICE_NAME)
+
+def try_connect(params):
+    """db_helper.try_connect_db with session parameters (host, port, user, password, database, replicas)."""
+    return db_helper.try_connect_db(
+        params['host'], params['port'], params['user'], params['password'], params['database'],
+        pool_size=DB_POOL_SIZE, pool_max_idle=DB_POOL_MAX_IDLE,
+        schema_cache_dir=SCHEMA_CACHE_DIR, replicas=params.get('replicas'),
+        max_replica_lag=REPLICA_MAX_LAG, replica_lag_check_interval=REPLICA_LAG_CHECK,
+        replica_failure_cooldown=REPLICA_FAILURE_COOLDOWN, read_from_primary=REPLICA_READ_FROM_PRIMARY
+    )
+
+def named_connection(name, database=None):
+    """Session parameters of DB_CONNECTIONS[name], optionally on another `database` of the same server."""
+    conn = DB_CONNECTIONS[name]
+    params = {
+        'connection': name, 'host': conn.get('host'), 'port': int(conn.get('port', 3306)),
+        'user': conn.get('user'), 'password': conn.get('password'),
+        'database': database or conn.get('database')
+    }
+    if conn.get('replicas'):
+        params['replicas'] = [dict(replica) for replica in conn['replicas']]
+    return params
+
+def open_connection(params):
+    """Connects with stored session parameters; returns (schema_model, pool) or raises."""
+    if 'password' not in params and params.get('connection') in DB_CONNECTIONS:
+        # Restored without its password: the named connection's come from the config
+        params = named_connection(params['connection'], params.get('database'))
+    success, result = try_connect(params)
+    if not success:
+        raise ConnectionError(result)
+    return result
+
+# Sessions and query handles live in the shared store so any worker can serve them.
+# In memory each gets an LRU of its own, so a burst of answers never evicts live sessions.
+session_store = store_helper.make_store(SESSION_STORE, path=SESSION_STORE_PATH, url=SESSION_REDIS_URL)
+query_handle_store = store_helper.MemoryStore() if SESSION_STORE == "memory" else session_store
+sessions = session_helper.SessionManager(
+    session_store, open_connection, idle_timeout=SESSION_IDLE_TIMEOUT,
+    max_sessions=SESSION_MAX_LIVE, max_bytes=int(SESSION_MAX_MEMORY_MB * 1024 * 1024),
+    secret_key=SESSION_SECRET_KEY
+)
+ai_helper.init_query_store(query_handle_store)
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=CONNECT_WORKERS)
+
+# Point-in-time values for /metrics, read at scrape time
+metrics_helper.REGISTRY.gauge(
+    "talk2db_sessions_live", "Sessions with an open connection pool in this process.",
+    lambda: sessions.stats()["live"]
+)
+metrics_helper.REGISTRY.gauge(
+    "talk2db_model_breaker_open", "1 while a model's circuit breaker is open.",
+    lambda: {model: s["breaker"] == "open" for model, s in ai_helper.dispatcher.stats()["models"].items()},
+    ("model",)
+)
+metrics_helper.REGISTRY.gauge(
+    "talk2db_rate_limit_queued", "Requests waiting for a model's local quota.",
+    lambda: {model: s["queued"] for model, s in (ai_helper.rate_limiter.stats() if ai_helper.rate_limiter else {}).items()},
+    ("model",)
+)
 
-# Global State (Simulated Session)
-db_config = {}
-db_schema = ""
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+def session_id_from(headers, cookies, args=None):
+    """The caller's session ID: X-Session-ID header, then cookie, then ?session_id= (downloads)."""
+    return headers.get('X-Session-ID') or cookies.get(SESSION_COOKIE) or (args or {}).get('session_id')
+
+def current_session():
+    """The caller's Session, or None if it never connected (or its session expired)."""
+    session_id = session_id_from(request.headers, request.cookies, request.args)
+    try:
+        return sessions.get(session_id)
+    except Exception as e:
+        logger.error(f"Could not restore session: {e}")
+        return None
 
 @app.before_request
 def log_request():
@@ -59,37 +262,55 @@ def health():
 @app.route('/api/connect', methods=['POST'])
 def connect_database():
     data = request.json
-    global db_config, db_schema
-    
-    host = data.get('host')
-    if host == 'localhost': host = '127.0.0.1'
-    
-    port = int(data.get('port', 3306))
-    user = data.get('user')
-    password = data.get('password')
-    database = data.get('database')
+
+    # A named connection from DB_CONNECTIONS; the request may only pick another database.
+    # Its configured credentials must never be sent to a host the caller chose.
+    name = data.get('connection')
+    if name:
+        if name not in DB_CONNECTIONS:
+            return jsonify({'success': False, 'error': f"Unknown connection '{name}'"}), 400
+        overrides = sorted(k for k, v in data.items() if k not in ('connection', 'database') and v not in (None, ''))
+        if overrides:
+            return jsonify({
+                'success': False,
+                'error': f"A named connection only accepts 'database', not {', '.join(overrides)}"
+            }), 400
+        params = named_connection(name, data.get('database'))
+    else:
+        params = {
+            'host': data.get('host'), 'port': int(data.get('port') or 3306), 'user': data.get('user'),
+            'password': data.get('password'), 'database': data.get('database')
+        }
+        if data.get('replicas'):
+            # Read replicas of this database: [{"name", "host", "port", "user", "password"}]
+            params['replicas'] = list(data['replicas'])
+    if params['host'] == 'localhost': params['host'] = '127.0.0.1'
+    host, port = params['host'], params['port']
     
     logger.info(f"Connecting to {host}:{port}...")
 
-    # Define a helper wrapper for specific args to run in thread
-    def connection_task():
-        return db_helper.try_connect_db(host, port, user, password, database)
-
     try:
         # Run connection in background thread
-        future = executor.submit(connection_task)
+        future = executor.submit(try_connect, params)
         success, result = future.result(timeout=10)
         
         if success:
-            # Store config for later use
-            db_config = {
-                'host': host, 'port': port, 'user': user,
-                'password': password, 'database': database,
-                'use_pure': True
-            }
-            db_schema = result # Result is the schema string
-            logger.info("Connected & Schema Fetched.")
-            return jsonify({'success': True})
+            # Result is (SchemaModel, connection pool); retire this caller's previous session
+            schema_model, pool = result
+            sessions.drop(session_id_from(request.headers, request.cookies))
+            session = sessions.create(params, schema_model, pool)
+            if ai_helper.profiler:
+                # Sample column values in the background before the first question
+                ai_helper.profiler.ensure(session)
+            if ai_helper.snapshots:
+                # Start the first snapshot refresh now rather than at the first question
+                ai_helper.snapshots.engine_for(session)
+            logger.info(f"Connected & Schema Fetched (session {session.id[:8]}).")
+            response = jsonify({'success': True, 'session_id': session.id})
+            response.set_cookie(
+                SESSION_COOKIE, session.id, max_age=SESSION_IDLE_TIMEOUT, httponly=True, samesite='Lax'
+            )
+            return response
         else:
             return jsonify({'success': False, 'error': result}), 400
 
@@ -98,22 +319,290 @@ def connect_database():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/connections')
+def list_connections():
+    """Named connections from DB_CONNECTIONS, without credentials."""
+    return jsonify({'success': True, 'connections': [
+        {
+            'name': name, 'host': c.get('host'), 'port': c.get('port', 3306), 'database': c.get('database'),
+            'replicas': [r.get('name') or f"replica{i + 1}" for i, r in enumerate(c.get('replicas', []))]
+        }
+        for name, c in DB_CONNECTIONS.items()
+    ]})
+
+@app.route('/api/disconnect', methods=['POST'])
+def disconnect_database():
+    sessions.drop(session_id_from(request.headers, request.cookies))
+    response = jsonify({'success': True})
+    response.delete_cookie(SESSION_COOKIE)
+    return response
+
+def overloaded_response(retry_after):
+    """503 for requests shed before reaching Gemini (quota queue full or all models rate-limited)."""
+    retry_after = max(1, math.ceil(retry_after or 1))
+    return jsonify({
+        'success': False,
+        'error': 'The AI service is at capacity, please retry shortly',
+        'overloaded': True,
+        'retry_after': retry_after
+    }), 503, {'Retry-After': str(retry_after)}
+
+def request_timeout(data):
+    """The request body's `timeout` in seconds (capped at REQUEST_TIMEOUT by the pipeline), or None."""
+    try:
+        return float(data['timeout']) if data.get('timeout') else None
+    except (TypeError, ValueError):
+        return None
+
+def admission_retry_after(priority):
+    """None to serve a new question now, else seconds until the models should have room."""
+    return ai_helper.admission_retry_after(priority, tokens=SCHEMA_TOKEN_BUDGET + ai_helper.SQL_REPLY_TOKENS)
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    if not db_config:
+    session = current_session()
+    if not session:
         return jsonify({'success': False, 'error': 'Database not connected'}), 400
         
     data = request.json
     user_query = data.get('query')
+    priority = data.get('priority', 'normal')
+    retry_after = admission_retry_after(priority)
+    if retry_after is not None:
+        return overloaded_response(retry_after)
     
     # Delegate complex logic to AI Helper
-    result = ai_helper.generate_response(user_query, db_schema, db_config)
+    result = ai_helper.generate_response(
+        user_query, session,
+        schema_top_k=SCHEMA_TOP_K, schema_token_budget=SCHEMA_TOKEN_BUDGET, priority=priority,
+        answer_mode=data.get('answer_mode'), timeout=request_timeout(data)
+    )
     
     if result.get("success"):
         return jsonify(result)
+    elif result.get("overloaded"):
+        return overloaded_response(result.get("retry_after"))
+    elif result.get("timed_out"):
+        return jsonify(result), 504
     else:
         return jsonify(result), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat, streamed as Server-Sent Events (see ai_helper.stream_response)."""
+    session = current_session()
+    if not session:
+        return jsonify({'success': False, 'error': 'Database not connected'}), 400
+
+    data = request.json
+    user_query = data.get('query')
+    priority = data.get('priority', 'normal')
+    retry_after = admission_retry_after(priority)
+    if retry_after is not None:
+        return overloaded_response(retry_after)
+
+    def events():
+        for event, payload in ai_helper.stream_response(
+            user_query, session,
+            schema_top_k=SCHEMA_TOP_K, schema_token_budget=SCHEMA_TOKEN_BUDGET, priority=priority,
+            answer_mode=data.get('answer_mode'), timeout=request_timeout(data)
+        ):
+            yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        # Keep proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def batch_error(data):
+    """Why a /api/batch body is unusable, or None."""
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return "'questions' must be a non-empty list"
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return f"At most {BATCH_MAX_QUESTIONS} questions per batch"
+    return None
+
+def batch_concurrency(data):
+    """The requested concurrency, capped at BATCH_CONCURRENCY."""
+    try:
+        return max(1, min(int(data.get('concurrency') or BATCH_CONCURRENCY), BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return BATCH_CONCURRENCY
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """Answers a list of questions, streamed as NDJSON (see batch_helper.run_batch)."""
+    session = current_session()
+    if not session:
+        return jsonify({'success': False, 'error': 'Database not connected'}), 400
+
+    data = request.json
+    error = batch_error(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    def lines():
+        for item in async_helper.iterate_in_loop(batch_helper.run_batch(
+            data['questions'], session, concurrency=batch_concurrency(data),
+            schema_top_k=SCHEMA_TOP_K, schema_token_budget=SCHEMA_TOKEN_BUDGET,
+            priority=data.get('priority', 'low'), answer_mode=data.get('answer_mode')
+        )):
+            yield json.dumps(item, default=str) + "\n"
+
+    return Response(
+        stream_with_context(lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/results/<query_id>')
+def result_page(query_id):
+    """One page of a previous answer's rows: ?page=1&page_size=100 (max 1000)."""
+    session = current_session()
+    handle = ai_helper.query_store.get(query_id, session.id) if session else None
+    if not handle:
+        return jsonify({'success': False, 'error': 'Unknown or expired query'}), 404
+
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = min(max(1, request.args.get('page_size', 100, type=int)), 1000)
+    try:
+        columns, rows, has_more = result_helper.fetch_page(
+            session.pool, handle['sql'], page, page_size, timeout=QUERY_TIMEOUT
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({
+        'success': True,
+        'query_id': query_id,
+        'page': page,
+        'page_size': page_size,
+        'columns': columns,
+        'rows': [[export_helper.to_json_value(v) for v in row] for row in rows],
+        'has_more': has_more
+    })
+
+@app.route('/api/results/<query_id>/export')
+def export_results(query_id):
+    """Full result of a previous answer as a chunked download: ?format=csv|ndjson|arrow."""
+    session = current_session()
+    handle = ai_helper.query_store.get(query_id, session.id) if session else None
+    if not handle:
+        return jsonify({'success': False, 'error': 'Unknown or expired query'}), 404
+
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in export_helper.FORMATS:
+        return jsonify({'success': False, 'error': f'Unsupported format: {fmt}'}), 400
+    if fmt == 'arrow' and export_helper.pa is None:
+        return jsonify({'success': False, 'error': 'Arrow export requires pyarrow'}), 400
+
+    writers = {
+        'csv': export_helper.export_csv,
+        'ndjson': export_helper.export_ndjson,
+        'arrow': export_helper.export_arrow,
+    }
+    pages = result_helper.iter_result_pages(session.pool, handle['sql'], EXPORT_PAGE_SIZE, QUERY_TIMEOUT)
+    mimetype, extension = export_helper.FORMATS[fmt]
+    return Response(
+        stream_with_context(writers[fmt](pages)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="query_{query_id[:8]}.{extension}"'}
+    )
+
+@app.route('/api/feedback', methods=['POST'])
+def feedback():
+    """The user's verdict on an answer: {"query_id": ..., "correct": true|false}."""
+    session = current_session()
+    data = request.get_json(silent=True) or {}
+    query_id = data.get('query_id')
+    if not isinstance(data.get('correct'), bool):
+        return jsonify({'success': False, 'error': '"correct" must be true or false'}), 400
+    if not session or not query_id or not ai_helper.query_store.get(query_id, session.id):
+        return jsonify({'success': False, 'error': 'Unknown or expired query'}), 404
+    try:
+        ai_helper.record_feedback(query_id, data['correct'], session)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'Unknown or expired query'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/pool/stats')
+def pool_stats():
+    session = current_session()
+    if not session:
+        return jsonify({'success': False, 'error': 'Database not connected'}), 400
+    return jsonify({'success': True, 'stats': session.pool.stats()})
+
+@app.route('/api/snapshots')
+def snapshot_stats():
+    session = current_session()
+    if not session:
+        return jsonify({'success': False, 'error': 'Database not connected'}), 400
+    if not ai_helper.snapshots:
+        return jsonify({'success': False, 'error': 'Snapshots are not enabled'}), 400
+    return jsonify({'success': True, 'stats': ai_helper.snapshots.engine_for(session).stats()})
+
+@app.route('/api/snapshots/refresh', methods=['POST'])
+def refresh_snapshots():
+    session = current_session()
+    if not session:
+        return jsonify({'success': False, 'error': 'Database not connected'}), 400
+    if not ai_helper.snapshots:
+        return jsonify({'success': False, 'error': 'Snapshots are not enabled'}), 400
+    data = request.get_json(silent=True) or {}
+    ai_helper.snapshots.engine_for(session)
+    queued = ai_helper.snapshots.request_refresh(session.scope, data.get('tables'), bool(data.get('full')))
+    return jsonify({'success': True, 'queued': queued}), 202
+
+@app.route('/api/models/stats')
+def model_stats():
+    rate_limiter = ai_helper.rate_limiter
+    return jsonify({
+        'success': True,
+        'stats': ai_helper.dispatcher.stats(),
+        'rate_limits': rate_limiter.stats() if rate_limiter else None,
+        'answers': dict(ai_helper.answer_counts),
+        'context_cache': ai_helper.context_cache.stats() if ai_helper.context_cache else None
+    })
+
+@app.route('/api/guard/stats')
+def guard_stats():
+    guard = ai_helper.query_guard
+    return jsonify({'success': True, 'stats': guard.stats() if guard else None})
+
+@app.route('/api/examples/stats')
+def example_stats():
+    example_store = ai_helper.example_store
+    return jsonify({'success': True, 'stats': example_store.stats() if example_store else None})
+
+@app.route('/api/cancellations/stats')
+def cancellation_stats():
+    return jsonify({'success': True, 'stats': cancel_helper.cancellations.stats()})
+
+@app.route('/api/sessions/stats')
+def session_stats():
+    return jsonify({'success': True, 'stats': sessions.stats()})
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format; counters are per worker process
+    return Response(metrics_helper.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    sql_cache = ai_helper.sql_cache
+    result_cache = ai_helper.result_cache
+    coalescer = ai_helper.coalescer
+    profiler = ai_helper.profiler
+    return jsonify({
+        'success': True,
+        'question_cache': sql_cache.stats() if sql_cache else None,
+        'result_cache': result_cache.stats() if result_cache else None,
+        'coalescing': coalescer.stats() if coalescer else None,
+        'column_profiles': profiler.stats() if profiler else None
+    })
+
 if __name__ == '__main__':
     try:
         app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import math
+from http.cookies import SimpleCookie
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # uvicorn ships an older equivalent
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+from werkzeug.datastructures import Headers
+
+import ai_helper
+import app as server
+import async_helper
+import batch_helper
+
+logger = logging.getLogger(__name__)
+
+# ASGI entry point: `uvicorn asgi:application --host 0.0.0.0 --port 5000`.
+# The chat endpoints run natively on the event loop, so a request waiting on Gemini
+# costs a coroutine rather than a thread. Everything else (connect, paging, exports,
+# static files) is the unchanged Flask app, run on a thread pool.
+
+wsgi_app = WSGIMiddleware(server.app, workers=server.WSGI_THREADS)
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return None
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload, default=str).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"access-control-allow-origin", b"*"), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _until_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def _unless_disconnected(receive, coro):
+    """
+    Runs `coro` until it finishes or the client disconnects, whichever is first;
+    on a disconnect `coro` is cancelled (pending Gemini calls and running queries
+    with it) and None is returned.
+    """
+    work = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_until_disconnect(receive))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+            try:
+                await work
+            except (asyncio.CancelledError, Exception):
+                pass
+    if work.cancelled():
+        return None
+    return work.result()
+
+async def _session(scope):
+    """The caller's Session (see app.current_session), restored off the event loop if needed."""
+    headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers", [])])
+    cookies = {k: morsel.value for k, morsel in SimpleCookie(headers.get("Cookie", "")).items()}
+    try:
+        return await async_helper.run_blocking(
+            server.sessions.get, server.session_id_from(headers, cookies)
+        )
+    except Exception as e:
+        logger.error(f"Could not restore session: {e}")
+        return None
+
+async def _send_overloaded(send, retry_after):
+    retry_after = max(1, math.ceil(retry_after or 1))
+    await _send_json(send, {
+        'success': False,
+        'error': 'The AI service is at capacity, please retry shortly',
+        'overloaded': True,
+        'retry_after': retry_after
+    }, 503, [(b"retry-after", str(retry_after).encode())])
+
+async def chat(scope, receive, send):
+    """POST /api/chat - same contract as the Flask view."""
+    data = await _read_json(receive)
+    session = await _session(scope)
+    if not session:
+        return await _send_json(send, {'success': False, 'error': 'Database not connected'}, 400)
+    if data is None:
+        return await _send_json(send, {'success': False, 'error': 'Invalid JSON body'}, 400)
+    priority = data.get('priority', 'normal')
+    retry_after = server.admission_retry_after(priority)
+    if retry_after is not None:
+        return await _send_overloaded(send, retry_after)
+
+    result = await _unless_disconnected(receive, ai_helper.generate_response_async(
+        data.get('query'), session,
+        schema_top_k=server.SCHEMA_TOP_K, schema_token_budget=server.SCHEMA_TOKEN_BUDGET, priority=priority,
+        answer_mode=data.get('answer_mode'), timeout=server.request_timeout(data)
+    ))
+    if result is None:
+        logger.info("Chat client disconnected, question cancelled.")
+        return
+    if result.get("overloaded"):
+        return await _send_overloaded(send, result.get("retry_after"))
+    if result.get("timed_out"):
+        return await _send_json(send, result, 504)
+    await _send_json(send, result, 200 if result.get("success") else 500)
+
+async def chat_stream(scope, receive, send):
+    """POST /api/chat/stream - Server-Sent Events, same events as the Flask view."""
+    data = await _read_json(receive)
+    session = await _session(scope)
+    if not session:
+        return await _send_json(send, {'success': False, 'error': 'Database not connected'}, 400)
+    if data is None:
+        return await _send_json(send, {'success': False, 'error': 'Invalid JSON body'}, 400)
+    priority = data.get('priority', 'normal')
+    retry_after = server.admission_retry_after(priority)
+    if retry_after is not None:
+        return await _send_overloaded(send, retry_after)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"), (b"access-control-allow-origin", b"*")],
+    })
+    events = ai_helper.stream_response_async(
+        data.get('query'), session,
+        schema_top_k=server.SCHEMA_TOP_K, schema_token_budget=server.SCHEMA_TOKEN_BUDGET, priority=priority,
+        answer_mode=data.get('answer_mode'), timeout=server.request_timeout(data)
+    )
+
+    async def relay():
+        try:
+            async for event, payload in events:
+                frame = f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+                await send({"type": "http.response.body", "body": frame.encode(), "more_body": True})
+        finally:
+            await events.aclose()
+        return True
+
+    try:
+        finished = await _unless_disconnected(receive, relay())
+    except OSError:
+        finished = None
+    if not finished:
+        logger.info("Chat stream client disconnected, question cancelled.")
+        return
+    await send({"type": "http.response.body", "body": b""})
+
+async def batch(scope, receive, send):
+    """POST /api/batch - NDJSON lines, same as the Flask view."""
+    data = await _read_json(receive)
+    session = await _session(scope)
+    if not session:
+        return await _send_json(send, {'success': False, 'error': 'Database not connected'}, 400)
+    error = server.batch_error(data)
+    if error:
+        return await _send_json(send, {'success': False, 'error': error}, 400)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"), (b"access-control-allow-origin", b"*")],
+    })
+    items = batch_helper.run_batch(
+        data['questions'], session, concurrency=server.batch_concurrency(data),
+        schema_top_k=server.SCHEMA_TOP_K, schema_token_budget=server.SCHEMA_TOKEN_BUDGET,
+        priority=data.get('priority', 'low'), answer_mode=data.get('answer_mode')
+    )
+
+    async def relay():
+        try:
+            async for item in items:
+                line = json.dumps(item, default=str) + "\n"
+                await send({"type": "http.response.body", "body": line.encode(), "more_body": True})
+        finally:
+            await items.aclose()
+        return True
+
+    try:
+        finished = await _unless_disconnected(receive, relay())
+    except OSError:
+        finished = None
+    if not finished:
+        logger.info("Batch client disconnected, remaining questions cancelled.")
+        return
+    await send({"type": "http.response.body", "body": b""})
+
+ROUTES = {
+    ("POST", "/api/chat"): chat,
+    ("POST", "/api/chat/stream"): chat_stream,
+    ("POST", "/api/batch"): batch,
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Run every pipeline, including ones started from Flask threads, on this loop
+            async_helper.set_pipeline_loop(asyncio.get_running_loop())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    handler = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler:
+        server.logger.info(f"Incoming request: {scope['method']} {scope['path']}")
+        return await handler(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
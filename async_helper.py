@@ -0,0 +1,87 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The chat pipeline is async (ai_helper.stream_response_async). All of it runs on
+# one event loop per process so the Gemini async client is only ever used from a
+# single loop. Under the ASGI server that loop is the server's own (set_pipeline_loop);
+# under plain Flask a background thread runs it. Blocking MySQL work goes to a
+# sized thread pool instead of pinning a request thread.
+
+_loop = None
+_loop_lock = threading.Lock()
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="db")
+
+def init_executor(max_workers=8):
+    """Resizes the thread pool used for blocking database calls."""
+    global _executor
+    old = _executor
+    _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    old.shutdown(wait=False)
+
+def set_pipeline_loop(loop):
+    """Makes `loop` (e.g. the ASGI server's) the loop the pipeline runs on."""
+    global _loop
+    with _loop_lock:
+        _loop = loop
+
+def pipeline_loop():
+    """Returns the pipeline loop, starting a background loop thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="pipeline-loop", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+async def run_blocking(func, *args, on_cancel=None):
+    """
+    Runs a blocking call on the database thread pool and awaits its result.
+    Cancelling the awaiting task does not stop the call; `on_cancel` (blocking,
+    e.g. cancel_helper.RunningQuery.cancel) is then run on a thread of its own.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    except asyncio.CancelledError:
+        if on_cancel is not None:
+            threading.Thread(target=on_cancel, name="cancel", daemon=True).start()
+        raise
+
+def iterate_in_loop(agen):
+    """
+    Drives an async generator on the pipeline loop from synchronous code, yielding
+    its items. Closing this generator early (e.g. a client disconnect) closes `agen`.
+    """
+    loop = pipeline_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("iterate_in_loop() would block the pipeline loop; use the async API")
+
+    finished = False
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                finished = True
+                return
+            yield item
+    finally:
+        if not finished:
+            try:
+                asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result(timeout=5)
+            except Exception as e:
+                logger.debug(f"Closing pipeline generator failed: {e}")
+
+def run_in_loop(coro):
+    """Runs a coroutine on the pipeline loop from synchronous code and returns its result."""
+    return asyncio.run_coroutine_threadsafe(coro, pipeline_loop()).result()
@@ -0,0 +1,100 @@
+"""
+Answers a list of questions from the command line, one NDJSON line per question.
+
+    python batch.py questions.txt --connection analytics          # a DB_CONNECTIONS entry
+    python batch.py questions.txt --host 127.0.0.1 --user report --database shop > answers.ndjson
+    cat questions.txt | python batch.py - --connection analytics --concurrency 8
+
+Questions are read one per line (blank lines and lines starting with # are
+skipped) or as a JSON list. The password comes from --password or MYSQL_PWD.
+Gemini, rate-limit, cache and replica settings come from config.json, as for the
+server; the lines are the same as POST /api/batch returns, ending with a summary.
+Exits 1 if any question failed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import app as server
+import async_helper
+import batch_helper
+import session_helper
+
+def _read_questions(path):
+    if path == "-":
+        text = sys.stdin.read()
+    else:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    if text.strip().startswith("["):
+        return json.loads(text)
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+def _params(args):
+    if args.connection and args.connection not in server.DB_CONNECTIONS:
+        sys.exit(f"Unknown connection '{args.connection}' (see DB_CONNECTIONS in config.json)")
+    params = dict(server.DB_CONNECTIONS.get(args.connection, {}))
+    for key in ("host", "port", "user", "password", "database"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    params.setdefault("password", os.environ.get("MYSQL_PWD"))
+    params["port"] = int(params.get("port", 3306))
+    missing = [key for key in ("host", "user", "database") if not params.get(key)]
+    if missing:
+        sys.exit(f"Missing {', '.join(missing)}: pass --connection or --{' --'.join(missing)}")
+    return params
+
+async def _run(args, questions, session, out):
+    async_helper.set_pipeline_loop(asyncio.get_running_loop())
+    summary = {}
+    async for item in batch_helper.run_batch(
+        questions, session, concurrency=args.concurrency,
+        schema_top_k=server.SCHEMA_TOP_K, schema_token_budget=server.SCHEMA_TOKEN_BUDGET,
+        priority=args.priority, answer_mode=args.answer_mode
+    ):
+        out.write(json.dumps(item, default=str) + "\n")
+        out.flush()
+        summary = item
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="file with one question per line or a JSON list; - for stdin")
+    parser.add_argument("--connection", help="name of a DB_CONNECTIONS entry in config.json")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--database")
+    parser.add_argument("--concurrency", type=int, default=server.BATCH_CONCURRENCY)
+    parser.add_argument("--priority", choices=["high", "normal", "low"], default="low")
+    parser.add_argument("--answer-mode", choices=["auto", "template", "llm"])
+    parser.add_argument("--output", help="write the NDJSON lines to a file instead of stdout")
+    args = parser.parse_args()
+
+    questions = _read_questions(args.questions)
+    if not questions:
+        sys.exit("No questions to answer.")
+    params = _params(args)
+    success, result = server.try_connect(params)
+    if not success:
+        sys.exit(f"Could not connect: {result}")
+    schema_model, pool = result
+    session = session_helper.Session("batch", params, schema_model, pool)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        summary = asyncio.run(_run(args, questions, session, out))
+    finally:
+        session.close()
+        if args.output:
+            out.close()
+    print(f"{summary.get('unique', 0)} unique of {summary.get('questions', 0)} questions: "
+          f"{summary.get('succeeded', 0)} answered, {summary.get('failed', 0)} failed "
+          f"in {summary.get('elapsed', 0):.1f}s", file=sys.stderr)
+    sys.exit(1 if summary.get("failed") else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+import ai_helper
+import cache_helper
+
+logger = logging.getLogger(__name__)
+
+# Batches of questions against one session (nightly report jobs). Questions are
+# deduplicated with the question cache's key, then answered by up to
+# `concurrency` pipelines at once: SQL generation waits for the rate limiter like
+# any other request (at `priority`, "low" by default so interactive users go first)
+# and the queries share the session's connection pool. Results stream as they finish.
+
+MAX_OVERLOAD_RETRIES = 3
+
+def dedupe(questions):
+    """
+    [(question, [indexes])] with one entry per distinct question, in first-seen
+    order. Questions that differ only in case, punctuation or spacing ("Top 10
+    customers!" / "top 10 customers") share an entry; blank ones are dropped.
+    """
+    groups = {}
+    for index, question in enumerate(questions):
+        if not isinstance(question, str) or not question.strip():
+            continue
+        key = cache_helper.question_key(question) or question.strip().lower()
+        groups.setdefault(key, (question.strip(), []))[1].append(index)
+    return list(groups.values())
+
+async def _answer(question, session, schema_top_k, schema_token_budget, priority, answer_mode):
+    """generate_response_async, retried when the pipeline sheds it for lack of quota."""
+    for attempt in range(MAX_OVERLOAD_RETRIES + 1):
+        result = await ai_helper.generate_response_async(
+            question, session, schema_top_k, schema_token_budget, priority, answer_mode
+        )
+        if not result.get("overloaded") or attempt == MAX_OVERLOAD_RETRIES:
+            return result
+        await asyncio.sleep(result.get("retry_after") or 1)
+    return result
+
+async def run_batch(questions, session, concurrency=4, schema_top_k=8, schema_token_budget=4000,
+                    priority="low", answer_mode=None):
+    """
+    Answers `questions` on `session`, yielding NDJSON-ready dicts:
+    - {"type": "result", "index", "question", "duplicate_of", "result"} once per
+      input question, as soon as its answer is ready; duplicates repeat the first
+      occurrence's result and name its index in "duplicate_of"
+    - {"type": "summary", ...} counts and elapsed time, last
+    """
+    started = time.perf_counter()
+    groups = dedupe(questions)
+    semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def one(question, indexes):
+        async with semaphore:
+            try:
+                result = await _answer(question, session, schema_top_k, schema_token_budget, priority, answer_mode)
+            except Exception as e:
+                logger.error(f"Batch question failed: {e}")
+                result = {"success": False, "error": str(e)}
+        return question, indexes, result
+
+    tasks = [asyncio.ensure_future(one(question, indexes)) for question, indexes in groups]
+    succeeded = failed = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            question, indexes, result = await finished
+            if result.get("success"):
+                succeeded += 1
+            else:
+                failed += 1
+            for index in indexes:
+                yield {
+                    "type": "result",
+                    "index": index,
+                    "question": questions[index],
+                    "duplicate_of": indexes[0] if index != indexes[0] else None,
+                    "result": result,
+                }
+    finally:
+        # The consumer went away: stop the questions still waiting or running
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "type": "summary",
+        "questions": len(questions),
+        "unique": len(groups),
+        "skipped": len(questions) - sum(len(indexes) for _, indexes in groups),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
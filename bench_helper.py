@@ -0,0 +1,361 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import context_cache_helper
+import schema_helper
+import sql_helper
+
+# Offline stand-ins for benchmarks: a deterministic fake of the google-genai async
+# client (latency, jitter and injected 429s) and a SQLite database behind the same
+# pool/connection/cursor surface the pipeline uses for MySQL, plus a question corpus
+# whose SQL runs on both.
+
+# (question, SQL the fake model answers with; None = a general question without SQL)
+CORPUS = [
+    ("How many customers do we have?", "SELECT COUNT(*) AS total FROM customers"),
+    ("How many orders were placed?", "SELECT COUNT(*) AS total FROM orders"),
+    ("Top 10 customers by total order amount",
+     "SELECT c.name, SUM(o.total_amount) AS total FROM customers c JOIN orders o ON o.customer_id = c.id "
+     "GROUP BY c.id, c.name ORDER BY total DESC LIMIT 10"),
+    ("Which products are out of stock?", "SELECT title FROM products WHERE stock = 0"),
+    ("Average salary per department",
+     "SELECT d.name, AVG(e.salary) AS average_salary FROM employees e JOIN departments d ON d.id = e.department_id "
+     "GROUP BY d.name"),
+    ("Total payments by payment method", "SELECT method, SUM(amount) AS total FROM payments GROUP BY method"),
+    ("Orders per status", "SELECT status, COUNT(*) AS orders FROM orders GROUP BY status"),
+    ("Most expensive product", "SELECT title, price FROM products ORDER BY price DESC LIMIT 1"),
+    ("Customers in Germany", "SELECT name, email FROM customers WHERE country = 'Germany'"),
+    ("Every order with its customer",
+     "SELECT o.id, c.name, o.total_amount, o.status FROM orders o JOIN customers c ON c.id = o.customer_id"),
+    ("Products that were never ordered",
+     "SELECT p.title FROM products p LEFT JOIN order_items i ON i.product_id = p.id WHERE i.id IS NULL"),
+    ("Revenue per product category",
+     "SELECT p.category, SUM(i.quantity * i.unit_price) AS revenue FROM order_items i "
+     "JOIN products p ON p.id = i.product_id GROUP BY p.category ORDER BY revenue DESC"),
+    ("What can you tell me about this database?", None),
+    ("Hello!", None),
+]
+
+TABLES = {
+    "customers": "id INTEGER PRIMARY KEY, name VARCHAR(100), email VARCHAR(100), country VARCHAR(40), created_at DATE",
+    "orders": "id INTEGER PRIMARY KEY, customer_id INT, status VARCHAR(20), total_amount DECIMAL(10,2), order_date DATE",
+    "order_items": "id INTEGER PRIMARY KEY, order_id INT, product_id INT, quantity INT, unit_price DECIMAL(10,2)",
+    "products": "id INTEGER PRIMARY KEY, title VARCHAR(100), category VARCHAR(40), price DECIMAL(10,2), stock INT",
+    "employees": "id INTEGER PRIMARY KEY, department_id INT, name VARCHAR(100), salary DECIMAL(10,2)",
+    "departments": "id INTEGER PRIMARY KEY, name VARCHAR(60)",
+    "payments": "id INTEGER PRIMARY KEY, order_id INT, method VARCHAR(20), amount DECIMAL(10,2)",
+}
+FOREIGN_KEYS = {
+    "orders": [("customer_id", "customers")],
+    "order_items": [("order_id", "orders"), ("product_id", "products")],
+    "employees": [("department_id", "departments")],
+    "payments": [("order_id", "orders")],
+}
+
+def build_database(path, customers=2000, seed=7):
+    """Creates (or replaces) the benchmark SQLite database at `path`; ~10 orders per customer."""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    for name, columns in TABLES.items():
+        conn.execute(f"CREATE TABLE {name} ({columns})")
+    for table, keys in FOREIGN_KEYS.items():
+        for column, _ in keys:
+            conn.execute(f"CREATE INDEX idx_{table}_{column} ON {table} ({column})")
+
+    countries = ["Germany", "France", "India", "Brazil", "Japan", "Canada", "Kenya", "Spain"]
+    conn.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?)", [
+        (i, f"Customer {i}", f"c{i}@example.com", rng.choice(countries), f"2024-{rng.randint(1, 12):02d}-01")
+        for i in range(1, customers + 1)
+    ])
+    products = max(50, customers // 10)
+    categories = ["books", "games", "garden", "kitchen", "music", "sports", "toys"]
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?)", [
+        (i, f"Product {i}", rng.choice(categories), round(rng.uniform(2, 500), 2), rng.choice([0, 0, 5, 20, 100]))
+        for i in range(1, products + 1)
+    ])
+    orders, items, payments = [], [], []
+    for order_id in range(1, customers * 10 + 1):
+        amount = 0.0
+        for _ in range(rng.randint(1, 3)):
+            quantity, price = rng.randint(1, 4), round(rng.uniform(2, 500), 2)
+            items.append((len(items) + 1, order_id, rng.randint(1, products - 5), quantity, price))
+            amount += quantity * price
+        orders.append((order_id, rng.randint(1, customers), rng.choice(["new", "paid", "shipped", "returned"]),
+                       round(amount, 2), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"))
+        payments.append((order_id, order_id, rng.choice(["card", "paypal", "transfer"]), round(amount, 2)))
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)", orders)
+    conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)", items)
+    conn.executemany("INSERT INTO payments VALUES (?, ?, ?, ?)", payments)
+    conn.executemany("INSERT INTO departments VALUES (?, ?)", [(i, f"Department {i}") for i in range(1, 11)])
+    conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?)", [
+        (i, rng.randint(1, 10), f"Employee {i}", round(rng.uniform(30000, 150000), 2)) for i in range(1, 301)
+    ])
+    conn.commit()
+    conn.close()
+
+def schema_model(path, database="bench"):
+    """SchemaModel of a SQLite database, shaped like db_helper's MySQL one."""
+    conn = sqlite3.connect(path)
+    try:
+        tables = {}
+        names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        for name in names:
+            info = conn.execute(f"PRAGMA table_info({name})").fetchall()
+            tables[name] = {
+                "comment": "",
+                "columns": [{"name": col[1], "type": col[2].lower(), "nullable": not col[3], "key": "",
+                             "default": None, "extra": "", "comment": ""} for col in info],
+                "primary_key": [col[1] for col in info if col[5]],
+                "foreign_keys": [{"column": column, "ref_table": ref, "ref_column": "id"}
+                                 for column, ref in FOREIGN_KEYS.get(name, [])],
+                "indexes": {},
+            }
+        return schema_helper.SchemaModel(database, tables, {name: "0|0" for name in names})
+    finally:
+        conn.close()
+
+class SqliteCursor:
+    """mysql-connector cursor surface over sqlite3, including the MySQL-only statements the pipeline issues."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = None
+        self._cursor = None
+
+    def execute(self, sql, params=()):
+        pool = self.connection.pool
+        if pool.db_latency:
+            time.sleep(pool.db_latency)  # Blocking, like mysql-connector
+        self._rows = None
+        if "information_schema.TABLES" in sql:
+            # Result-cache table versions: every requested table, unchanged
+            known = pool.row_counts
+            self.description = [("TABLE_NAME",), ("CREATE_TIME",), ("UPDATE_TIME",)]
+            self._rows = [(name, "0", pool.version) for name in params if name in known]
+            return
+        if sql.upper().startswith("EXPLAIN FORMAT=JSON"):
+            self.description = [("EXPLAIN",)]
+            self._rows = [(json.dumps(self._explain(sql[len("EXPLAIN FORMAT=JSON"):])),)]
+            return
+        sql = re.sub(r"%s", "?", sql)
+        self._cursor = self.connection.raw.execute(sql, params or ())
+        self.description = self._cursor.description
+
+    def _explain(self, sql):
+        """MySQL-shaped EXPLAIN document from SQLite's query plan (SCAN = full scan)."""
+        counts = self.connection.pool.row_counts
+        referenced = [t for t in sql_helper.referenced_tables(sql) if t in counts]
+        default = max((counts[t] for t in referenced), default=0)
+        steps = []
+        for row in self.connection.raw.execute(f"EXPLAIN QUERY PLAN {sql}"):
+            match = re.match(r"(SCAN|SEARCH) (\w+)", row[3])
+            if not match:
+                continue
+            table = match.group(2)
+            full = match.group(1) == "SCAN"
+            rows = counts.get(table, default) if full else 1
+            steps.append({"table": {"table_name": table, "access_type": "ALL" if full else "ref",
+                                    "rows_examined_per_scan": rows}})
+        cost = sum(step["table"]["rows_examined_per_scan"] for step in steps) * 0.1
+        return {"query_block": {"cost_info": {"query_cost": f"{cost:.2f}"}, "nested_loop": steps}}
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=1):
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return rows
+        return self._cursor.fetchmany(size) if self._cursor else []
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self._cursor.fetchall() if self._cursor else []
+
+    def close(self):
+        if self._cursor:
+            self._cursor.close()
+
+class SqliteConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.raw = sqlite3.connect(pool.path, check_same_thread=False)
+
+    def cursor(self, buffered=True):
+        return SqliteCursor(self)
+
+    def get_server_info(self):
+        return f"SQLite {sqlite3.sqlite_version}"
+
+    def is_connected(self):
+        return True
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+class SqlitePool:
+    """db_helper.ConnectionPool's surface (connection(), discard_on_release, kill_query, stats, close) over SQLite files."""
+
+    def __init__(self, path, size=5, db_latency=0.0):
+        self.path = path
+        self.size = size
+        self.db_latency = db_latency
+        self.version = "0"  # Bump to invalidate cached results
+        conn = sqlite3.connect(path)
+        names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.row_counts = {name: conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0] for name in names}
+        conn.close()
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(SqliteConnection(self))
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._waits = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._waits += 1
+            conn = self._idle.get()
+        with self._lock:
+            self._checkouts += 1
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            self._idle.put(conn)
+
+    def discard_on_release(self, conn):
+        pass  # Unread SQLite rows are dropped with the cursor
+
+    def kill_query(self, conn):
+        conn.raw.interrupt()  # SQLite's KILL QUERY
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "idle": self._idle.qsize(), "checkouts": self._checkouts, "waits": self._waits}
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+class FakeRateLimitError(Exception):
+    """What the SDK raises for a 429; model_helper recognises it by its text."""
+
+class _Usage:
+    def __init__(self, total_token_count):
+        self.total_token_count = total_token_count
+
+class _Reply:
+    def __init__(self, text, tokens=None):
+        self.text = text
+        self.usage_metadata = _Usage(tokens) if tokens is not None else None
+
+class FakeChat:
+    def __init__(self, client, model, config=None):
+        self.client = client
+        self.model = model
+        self.config = config
+        self.history = []
+
+    async def send_message(self, message, config=None):
+        await self.client.respond_delay(self.model, message)
+        self.history.append(message)
+        question = self.client.question_in(message)
+        sql = self.client.corpus.get(question, "SELECT 1 AS value")
+        tokens = schema_helper.estimate_tokens(message) + 40
+        if sql is None:
+            text = "This database holds customers, their orders and payments, products and employees."
+            if config is not None and getattr(config, "response_mime_type", None) == "application/json":
+                text = json.dumps({"intent": "chat", "reply": text})
+            return _Reply(text, tokens)
+        if config is not None and getattr(config, "response_mime_type", None) == "application/json":
+            tables = sql_helper.referenced_tables(sql)
+            return _Reply(json.dumps({"intent": "query", "sql": sql, "tables": tables}), tokens)
+        return _Reply(f"```sql\n{sql}\n```", tokens)
+
+    async def send_message_stream(self, message, config=None):
+        await self.client.respond_delay(self.model, message)
+        self.history.append(message)
+        parts = ["Based on the results, ", "here is what I found ", "in the data."]
+        chunk_delay = self.client.latency * 0.1
+
+        async def chunks():
+            for i, part in enumerate(parts):
+                await asyncio.sleep(chunk_delay)
+                last = i == len(parts) - 1
+                yield _Reply(part, schema_helper.estimate_tokens(message) + 30 if last else None)
+        return chunks()
+
+class FakeGenAIClient:
+    """
+    Deterministic stand-in for genai.Client's async surface (aio.chats, aio.caches).
+    Each call sleeps `latency` seconds +/- `jitter` (a fraction), derived from a hash
+    of the seed, model and prompt so runs repeat exactly; `error_rate` of calls (or
+    every call to a model in `failing_models`) raise a 429 after half the delay.
+    """
+
+    def __init__(self, corpus=None, latency=0.4, jitter=0.25, error_rate=0.0, seed=0, failing_models=()):
+        self.corpus = dict(CORPUS if corpus is None else corpus)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.failing_models = set(failing_models)
+        self.calls = 0
+        self.rate_limited = 0
+        self._counts = {}
+        self._lock = threading.Lock()
+        client = self
+
+        class Chats:
+            def create(self, model, config=None):
+                return FakeChat(client, model, config)
+
+        self.aio = type("Aio", (), {})()
+        self.aio.chats = Chats()
+        self.aio.caches = context_cache_helper.LocalCacheService()
+
+    @staticmethod
+    def question_in(message):
+        match = re.search(r"The user asks: '(.*?)'\.", message, re.DOTALL)
+        return match.group(1) if match else None
+
+    def _draw(self, model, message):
+        with self._lock:
+            self.calls += 1
+            key = (model, message)
+            n = self._counts[key] = self._counts.get(key, 0) + 1
+        digest = hashlib.sha256(f"{self.seed}|{model}|{n}|{message}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32, int.from_bytes(digest[4:8], "big") / 2 ** 32
+
+    async def respond_delay(self, model, message):
+        jitter_draw, error_draw = self._draw(model, message)
+        delay = self.latency * (1 + self.jitter * (2 * jitter_draw - 1))
+        if model in self.failing_models or error_draw < self.error_rate:
+            await asyncio.sleep(delay / 2)
+            with self._lock:
+                self.rate_limited += 1
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED: quota exceeded for this model, retry in 2s")
+        await asyncio.sleep(delay)
@@ -0,0 +1,248 @@
+"""
+End-to-end benchmark of the chat pipeline, fully offline.
+
+    python benchmark_pipeline.py                                  # 300 questions, concurrency 20
+    python benchmark_pipeline.py --error-rate 0.05                # inject 429s into 5% of model calls
+    python benchmark_pipeline.py --output bench.json              # save the report
+    python benchmark_pipeline.py --baseline bench.json            # exit 1 if p95 regressed
+    python benchmark_pipeline.py --snapshots                      # aggregations on DuckDB snapshots
+    python benchmark_pipeline.py --examples                       # few-shot examples in the SQL prompts
+
+Runs ai_helper.stream_response_async against a deterministic fake Gemini client
+(bench_helper.FakeGenAIClient: configurable latency, jitter and 429 injection) and
+a SQLite database behind the connection-pool interface, with the question corpus
+from bench_helper.CORPUS. Reports p50/p95/p99 latency per pipeline stage, throughput
+and, from a sequential tracemalloc pass, peak memory per stage.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ai_helper
+import async_helper
+import bench_helper
+import model_helper
+import session_helper
+
+STAGES = ["sql_generation", "execution", "answer", "first_answer_chunk", "total"]
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0]}
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98]}
+
+async def _run_question(question, session, memory=False):
+    """Runs one question; returns ({stage: seconds}, {stage: peak bytes} or None, success)."""
+    marks = {}
+    peaks = {}
+    started = time.perf_counter()
+    stage_start = started
+    result = {}
+
+    def close_stage(name):
+        nonlocal stage_start
+        now = time.perf_counter()
+        marks[name] = now - stage_start
+        stage_start = now
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peaks[name] = max(0, peak - stage_base[0])
+            tracemalloc.reset_peak()
+            stage_base[0] = current
+
+    stage_base = [tracemalloc.get_traced_memory()[0] if memory else 0]
+    if memory:
+        tracemalloc.reset_peak()
+
+    async for event, data in ai_helper.stream_response_async(question, session):
+        if event == "sql":
+            close_stage("sql_generation")
+        elif event == "rows":
+            close_stage("execution")
+        elif event == "answer" and "first_answer_chunk" not in marks:
+            marks["first_answer_chunk"] = time.perf_counter() - stage_start
+        elif event == "done":
+            result = data
+    if "sql_generation" not in marks:
+        close_stage("sql_generation")  # General question: no SQL was run
+    elif "execution" not in marks:
+        close_stage("execution")  # Query failed or was rejected
+    else:
+        close_stage("answer")
+    marks["total"] = time.perf_counter() - started
+    return marks, (peaks if memory else None), bool(result.get("success"))
+
+def _configure(args, db_path):
+    client = bench_helper.FakeGenAIClient(
+        latency=args.llm_latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed
+    )
+    ai_helper.client = client
+    ai_helper.model_name = "bench-primary"
+    ai_helper.dispatcher = model_helper.ModelDispatcher(
+        ["bench-primary", "bench-backup"], hedge_percentile=args.hedge_percentile, cooldown=2.0
+    )
+    ai_helper.rate_limiter = None  # Measure the pipeline, not the local quota
+    if not args.warm_caches:
+        ai_helper.sql_cache = None
+        ai_helper.result_cache = None
+    if not args.coalesce:
+        ai_helper.coalescer = None  # The corpus repeats; every question should run the pipeline
+    if not args.profiles:
+        ai_helper.profiler = None  # Its background sampling would share the pool with the timed queries
+    # First attempts are counted either way; examples reach the prompt only with --examples.
+    # They count as verified at once, so the warm-up already fills the store.
+    ai_helper.init_examples(prompt_tokens=400 if args.examples else 0, verify_seconds=0)
+    if args.context_cache:
+        ai_helper.init_context_cache(min_tokens=0)
+    pool = bench_helper.SqlitePool(db_path, size=args.pool_size, db_latency=args.db_latency)
+    params = {"host": "sqlite", "port": 0, "user": "bench", "password": "", "database": "bench"}
+    session = session_helper.Session("benchmark", params, bench_helper.schema_model(db_path), pool)
+    if args.snapshots:
+        manager = ai_helper.init_snapshots(
+            os.path.join(os.path.dirname(db_path), "snapshots"), {table: {} for table in bench_helper.TABLES}
+        )
+        engine = manager.engine_for(session)
+        while not all(table.ready or table.last_error for table in engine.tables.values()):
+            time.sleep(0.05)  # First refresh, before anything is timed
+    return client, session
+
+async def _benchmark(args, db_path):
+    client, session = _configure(args, db_path)
+    async_helper.set_pipeline_loop(asyncio.get_running_loop())
+    questions = [q for q, _ in bench_helper.CORPUS]
+
+    # Warm-up so first-call costs (imports, connections) are not counted
+    for question in questions[:3]:
+        await _run_question(question, session)
+
+    timings = {stage: [] for stage in STAGES}
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            marks, _, ok = await _run_question(questions[i % len(questions)], session)
+        failures += not ok
+        for stage, seconds in marks.items():
+            timings[stage].append(seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    memory = {}
+    if args.memory_samples:
+        tracemalloc.start()
+        peaks = {}
+        for i in range(args.memory_samples):
+            _, stage_peaks, _ = await _run_question(questions[i % len(questions)], session, memory=True)
+            for stage, peak in stage_peaks.items():
+                peaks.setdefault(stage, []).append(peak)
+        tracemalloc.stop()
+        memory = {stage: {"median_kb": statistics.median(v) / 1024, "max_kb": max(v) / 1024}
+                  for stage, v in peaks.items()}
+
+    session.close()
+    if ai_helper.snapshots:
+        ai_helper.snapshots.close()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "failed": failures,
+        "elapsed": elapsed,
+        "throughput": args.requests / elapsed,
+        "stages": {stage: _percentiles(values) for stage, values in timings.items()},
+        "memory": memory,
+        "model_calls": client.calls,
+        "injected_429s": client.rate_limited,
+        "dispatcher": {k: v for k, v in ai_helper.dispatcher.stats().items() if k != "models"},
+        "first_attempts": ai_helper.example_store.stats()["first_attempts"],
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "verbose")},
+    }
+
+def _print_report(report):
+    print(f"requests:    {report['requests']} ({report['failed']} failed), concurrency {report['concurrency']}")
+    print(f"elapsed:     {report['elapsed']:.2f}s, throughput {report['throughput']:.1f} req/s")
+    print(f"model calls: {report['model_calls']} ({report['injected_429s']} got a 429), "
+          f"fallbacks {report['dispatcher']['fallbacks']}, hedges {report['dispatcher']['hedges']}")
+    for group, counts in report["first_attempts"].items():
+        if counts["attempts"]:
+            print(f"first tries: {counts['attempts']} {group.replace('_', ' ')}, "
+                  f"{counts['success_rate']:.0%} returned rows, mean {counts['mean_seconds'] * 1000:.0f}ms")
+    print(f"\n{'stage':<20} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, p in report["stages"].items():
+        cells = ["-" if p[k] is None else f"{p[k] * 1000:.0f}ms" for k in ("p50", "p95", "p99")]
+        print(f"{stage:<20} {cells[0]:>9} {cells[1]:>9} {cells[2]:>9}")
+    if report["memory"]:
+        print(f"\n{'peak memory':<20} {'median':>9} {'max':>9}")
+        for stage, m in report["memory"].items():
+            print(f"{stage:<20} {m['median_kb']:>7.0f}KB {m['max_kb']:>7.0f}KB")
+
+def _regressions(report, baseline, tolerance):
+    """Stages whose p95 grew by more than `tolerance` (a fraction) over the baseline."""
+    found = []
+    for stage, p in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95")
+        if before and p["p95"] is not None and p["p95"] > before * (1 + tolerance):
+            found.append(f"{stage} p95 {before * 1000:.0f}ms -> {p['p95'] * 1000:.0f}ms")
+    if baseline.get("throughput") and report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        found.append(f"throughput {baseline['throughput']:.1f} -> {report['throughput']:.1f} req/s")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="mean seconds per fake Gemini call")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency spread, as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of model calls that get a 429")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="extra seconds per SQL statement")
+    parser.add_argument("--customers", type=int, default=2000, help="data size (about 10 orders per customer)")
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--hedge-percentile", type=float, default=95, help="dispatcher hedging (0 disables)")
+    parser.add_argument("--warm-caches", action="store_true", help="keep the question/result caches on")
+    parser.add_argument("--context-cache", action="store_true", help="serve the schema from the context cache")
+    parser.add_argument("--coalesce", action="store_true", help="let identical in-flight questions share a run")
+    parser.add_argument("--profiles", action="store_true", help="sample column values into the SQL prompts")
+    parser.add_argument("--examples", action="store_true", help="add verified few-shot examples to SQL prompts")
+    parser.add_argument("--snapshots", action="store_true", help="run aggregations on DuckDB/Parquet snapshots")
+    parser.add_argument("--memory-samples", type=int, default=20, help="sequential tracemalloc runs (0 skips)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's warnings (429s, fallbacks)")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="compare against a saved report; exit 1 on regression")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 growth for --baseline")
+    args = parser.parse_args()
+    args.hedge_percentile = args.hedge_percentile or None
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        bench_helper.build_database(db_path, args.customers, seed=args.seed + 7)
+        report = asyncio.run(_benchmark(args, db_path))
+
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = _regressions(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions against the baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Compares the full-schema prompt against the relevance-pruned one.
+
+    python benchmark_schema_pruning.py                 # synthetic 1500-table warehouse
+    python benchmark_schema_pruning.py --tables 300
+    python benchmark_schema_pruning.py --live          # also time real Gemini calls (needs config.json)
+
+Reports prompt size (chars / estimated tokens), index build and lookup time, and
+whether the tables each question needs made it into the pruned schema.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+import schema_helper
+
+CORE_TABLES = {
+    "customers": ["id", "name", "email", "status", "country", "created_at"],
+    "orders": ["id", "customer_id", "status", "total_amount", "order_date"],
+    "order_items": ["id", "order_id", "product_id", "quantity", "unit_price"],
+    "products": ["id", "category_id", "supplier_id", "title", "price", "stock"],
+    "categories": ["id", "name", "parent_id"],
+    "suppliers": ["id", "name", "country", "rating"],
+    "employees": ["id", "department_id", "first_name", "last_name", "salary", "hired_at"],
+    "departments": ["id", "name", "budget"],
+    "payments": ["id", "order_id", "method", "amount", "paid_at"],
+    "shipments": ["id", "order_id", "warehouse_id", "carrier", "shipped_at", "delivered_at"],
+    "warehouses": ["id", "city", "capacity"],
+    "invoices": ["id", "customer_id", "amount", "due_date", "paid"],
+}
+
+FOREIGN_KEYS = {
+    "orders": [("customer_id", "customers")],
+    "order_items": [("order_id", "orders"), ("product_id", "products")],
+    "products": [("category_id", "categories"), ("supplier_id", "suppliers")],
+    "employees": [("department_id", "departments")],
+    "payments": [("order_id", "orders")],
+    "shipments": [("order_id", "orders"), ("warehouse_id", "warehouses")],
+    "invoices": [("customer_id", "customers")],
+}
+
+# (question, tables the SQL needs)
+QUESTIONS = [
+    ("How many customers do we have?", {"customers"}),
+    ("What was the total revenue from orders last month?", {"orders"}),
+    ("Top 10 customers by total order amount", {"customers", "orders"}),
+    ("Which products are out of stock?", {"products"}),
+    ("Average salary per department", {"employees", "departments"}),
+    ("List suppliers with a rating above 4", {"suppliers"}),
+    ("How many shipments were delivered late from each warehouse?", {"shipments", "warehouses"}),
+    ("Total payments by payment method", {"payments"}),
+    ("Which categories have the most products?", {"categories", "products"}),
+    ("Unpaid invoices for customers in Germany", {"invoices", "customers"}),
+    ("Best selling products by quantity", {"order_items", "products"}),
+    ("Employees hired this year", {"employees"}),
+]
+
+FILLER_WORDS = [
+    "audit", "log", "staging", "snapshot", "metric", "event", "session", "campaign", "click",
+    "impression", "forecast", "budget", "ledger", "journal", "tax", "rate", "region", "zone",
+    "asset", "license", "ticket", "survey", "feedback", "alert", "job", "batch", "sync", "tmp",
+]
+
+def build_schema(table_count, seed=7):
+    """Returns a SchemaModel with the core tables plus generated filler tables."""
+    rng = random.Random(seed)
+    tables = {}
+    for name, columns in CORE_TABLES.items():
+        tables[name] = {
+            "comment": "",
+            "columns": [{"name": c, "type": "int" if c.endswith("id") else "varchar(255)", "comment": ""} for c in columns],
+            "primary_key": ["id"],
+            "foreign_keys": [
+                {"column": col, "ref_table": ref, "ref_column": "id"} for col, ref in FOREIGN_KEYS.get(name, [])
+            ],
+            "indexes": {},
+        }
+    i = 0
+    while len(tables) < table_count:
+        a, b = rng.sample(FILLER_WORDS, 2)
+        name = f"{a}_{b}_{i}"
+        i += 1
+        columns = ["id"] + [f"{w}_{rng.choice(['code', 'value', 'ts', 'flag'])}" for w in rng.sample(FILLER_WORDS, rng.randint(4, 14))]
+        tables[name] = {
+            "comment": "",
+            "columns": [{"name": c, "type": "varchar(64)", "comment": ""} for c in columns],
+            "primary_key": ["id"],
+            "foreign_keys": [],
+            "indexes": {},
+        }
+    return schema_helper.SchemaModel("bench", tables)
+
+def time_live_call(prompt_schema, question, model):
+    import ai_helper
+    prompt = f"You are a MySQL expert.\nDatabase Schema:\n{prompt_schema}\n\nThe user asks: '{question}'.\nProvide ONLY the SQL query."
+    start = time.perf_counter()
+    ai_helper.client.models.generate_content(model=model, contents=prompt)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=1500)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=4000, help="schema token budget")
+    parser.add_argument("--live", action="store_true", help="time real Gemini calls for both prompts")
+    args = parser.parse_args()
+
+    model = build_schema(args.tables)
+
+    start = time.perf_counter()
+    index = schema_helper.SchemaIndex(model)
+    build_time = time.perf_counter() - start
+
+    full_text = model.to_prompt()
+    full_tokens = schema_helper.estimate_tokens(full_text)
+
+    live_model = None
+    if args.live:
+        import ai_helper
+        with open("config.json", "r") as f:
+            config = json.load(f)
+        live_model = config.get("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+        ai_helper.init_client(config.get("GOOGLE_API_KEY"), live_model)
+
+    print(f"Schema: {len(model.tables)} tables, full prompt {len(full_text):,} chars (~{full_tokens:,} tokens)")
+    print(f"Index build: {build_time * 1000:.1f} ms\n")
+    print(f"{'question':<60} {'tables':>6} {'tokens':>7} {'lookup':>9} {'recall':>7}")
+
+    lookups, pruned_tokens, recalls, live_rows = [], [], [], []
+    for question, needed in QUESTIONS:
+        start = time.perf_counter()
+        text, selected = index.context_for(question, args.top_k, args.budget)
+        lookups.append(time.perf_counter() - start)
+        tokens = schema_helper.estimate_tokens(text)
+        pruned_tokens.append(tokens)
+        recall = len(needed & set(selected)) / len(needed)
+        recalls.append(recall)
+        print(f"{question[:60]:<60} {len(selected):>6} {tokens:>7} {lookups[-1] * 1000:>7.2f}ms {recall:>7.0%}")
+
+        if live_model:
+            live_rows.append((time_live_call(full_text, question, live_model), time_live_call(text, question, live_model)))
+
+    avg_tokens = statistics.mean(pruned_tokens)
+    print("\nSummary")
+    print(f"  avg prompt schema tokens: full ~{full_tokens:,}  pruned ~{avg_tokens:,.0f}  "
+          f"({(1 - avg_tokens / full_tokens):.1%} smaller)")
+    print(f"  avg lookup: {statistics.mean(lookups) * 1000:.2f} ms, table recall: {statistics.mean(recalls):.0%}")
+    if live_rows:
+        full_avg = statistics.mean(r[0] for r in live_rows)
+        pruned_avg = statistics.mean(r[1] for r in live_rows)
+        print(f"  avg Gemini latency ({live_model}): full {full_avg:.2f}s  pruned {pruned_avg:.2f}s  "
+              f"({(1 - pruned_avg / full_avg):.1%} faster)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import result_helper
+import sql_helper
+
+logger = logging.getLogger(__name__)
+
+def question_key(question):
+    """
+    The identity of a question for caching: every word kept, lowercased, without
+    punctuation or extra spaces. "How many customers are there?" and "how many
+    customers are there" match; "List all customers" does not.
+    """
+    return " ".join(re.findall(r"\w+(?:[.'-]\w+)*", (question or "").lower()))
+
+class QuestionCache:
+    """
+    Question -> SQL cache with LRU + TTL eviction.
+    Keys combine the schema fingerprint with the question_key of the question, so a schema
+    change never serves SQL written against the old structure.
+    If `path` is given, entries are written through to SQLite and reloaded on start.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400, path=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (sql, created_at)
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        if path:
+            self._open_store()
+
+    @staticmethod
+    def make_key(question, fingerprint):
+        """Returns the cache key, or None for questions with no words."""
+        normalized = question_key(question)
+        if not normalized:
+            return None
+        return f"{fingerprint}:{normalized}"
+
+    def _open_store(self):
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS question_cache ("
+                "key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            cutoff = time.time() - self.ttl if self.ttl else 0
+            self._db.execute("DELETE FROM question_cache WHERE created_at < ?", (cutoff,))
+            rows = self._db.execute(
+                "SELECT key, sql, created_at FROM question_cache ORDER BY created_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            self._db.commit()
+            # Oldest first so the most recent entries end up at the MRU end
+            for key, sql, created_at in reversed(rows):
+                self._entries[key] = (sql, created_at)
+            logger.info(f"Loaded {len(rows)} cached question(s) from {self.path}")
+        except Exception as e:
+            logger.warning(f"Question cache persistence disabled ({self.path}): {e}")
+            self._db = None
+
+    def _store(self, sql, params):
+        """Runs a write against the SQLite store. Caller must hold the lock."""
+        if not self._db:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"Question cache write failed: {e}")
+
+    def get(self, key):
+        """Returns the cached SQL for `key` or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            sql, created_at = entry
+            if self.ttl and time.time() - created_at > self.ttl:
+                del self._entries[key]
+                self._store("DELETE FROM question_cache WHERE key = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sql
+
+    def put(self, key, sql):
+        with self._lock:
+            created_at = time.time()
+            self._entries[key] = (sql, created_at)
+            self._entries.move_to_end(key)
+            self._store(
+                "INSERT OR REPLACE INTO question_cache (key, sql, created_at) VALUES (?, ?, ?)",
+                (key, sql, created_at)
+            )
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._store("DELETE FROM question_cache WHERE key = ?", (old_key,))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._store("DELETE FROM question_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._store("DELETE FROM question_cache", ())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "persistent": self._db is not None,
+            }
+
+def _estimate_bytes(columns, rows):
+    """Rough in-memory size of a result set; good enough for a memory budget."""
+    size = 64 + sum(len(str(c)) + 50 for c in columns)
+    return size + sum(result_helper.estimate_row_bytes(row) for row in rows)
+
+class ResultCache:
+    """
+    Result sets of generated SQL, keyed by normalized SQL text, bounded by total bytes.
+    Each entry remembers the version (CREATE_TIME/UPDATE_TIME) of every table the
+    SQL reads; a lookup with different current versions treats the entry as stale.
+    Table versions are polled from information_schema at most every `poll_interval`
+    seconds, and `ttl` caps entry age for changes UPDATE_TIME cannot see.
+    `scope` identifies the database and MySQL user (see session_helper.Session.scope),
+    so sessions on different databases, or with different grants, never share
+    entries or table versions.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=300, poll_interval=2.0):
+        self.max_bytes = int(max_bytes)
+        self.max_entry_bytes = self.max_bytes // 4
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._entries = OrderedDict()  # key -> entry dict
+        self._bytes = 0
+        self._versions = {}  # (scope, table) -> (version, polled_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.skipped = 0
+        self.polls = 0
+
+    def table_versions(self, tables, fetch, scope=""):
+        """
+        Returns {table: version} for `tables`, calling fetch(stale_tables) -> {table: version}
+        only for tables not polled within poll_interval. Unknown tables map to None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                t for t in tables
+                if (scope, t) not in self._versions or now - self._versions[scope, t][1] > self.poll_interval
+            ]
+        if stale:
+            fetched = fetch(stale)
+            with self._lock:
+                self.polls += 1
+                for table in stale:
+                    self._versions[scope, table] = (fetched.get(table), now)
+        with self._lock:
+            return {t: self._versions[scope, t][0] for t in tables}
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["bytes"]
+
+    def get(self, sql, versions, scope=""):
+        """Returns (columns, rows) if a fresh entry exists for `sql` at the given table versions."""
+        key = (scope, sql_helper.normalize_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expired = self.ttl and time.monotonic() - entry["created_at"] > self.ttl
+            if expired or any(versions.get(t) != v for t, v in entry["versions"].items()):
+                self._drop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["columns"], entry["rows"]
+
+    def put(self, sql, versions, columns, rows, scope=""):
+        """
+        Caches a result. Skips results that are too large, nondeterministic, or read a
+        table whose version cannot be tracked.
+        """
+        size = _estimate_bytes(columns, rows)
+        if (size > self.max_entry_bytes or not versions
+                or any(v is None for v in versions.values())
+                or not sql_helper.is_deterministic(sql)):
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        key = (scope, sql_helper.normalize_sql(sql))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                "columns": list(columns),
+                "rows": list(rows),
+                "versions": dict(versions),
+                "bytes": size,
+                "created_at": time.monotonic(),
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+        return True
+
+    def invalidate_tables(self, tables, scope=""):
+        """Drops every entry of `scope` that reads any of `tables`."""
+        tables = set(tables)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if k[0] == scope and tables & set(e["versions"])]:
+                self._drop(key)
+                self.invalidations += 1
+            for table in tables:
+                self._versions.pop((scope, table), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+                "version_polls": self.polls,
+            }
@@ -0,0 +1,105 @@
+import logging
+import threading
+
+import metrics_helper
+
+logger = logging.getLogger(__name__)
+
+# Cooperative cancellation of chat pipelines. A pipeline is cancelled when its client
+# disconnects or its deadline passes (see ai_helper.stream_response_async): pending
+# Gemini calls are cancelled with the task awaiting them, and a statement still
+# running on MySQL is stopped with KILL QUERY through its RunningQuery. Cancellations
+# tracks what was stopped, for /api/cancellations/stats and /metrics.
+
+REASONS = ("disconnect", "deadline")
+
+CANCELLED = metrics_helper.REGISTRY.counter(
+    "talk2db_cancelled_requests_total", "Questions cancelled before their answer was complete.", ("reason",)
+)
+CANCELLED_WORK = metrics_helper.REGISTRY.counter(
+    "talk2db_cancelled_work_total",
+    "Work stopped by cancellations: in-flight Gemini calls aborted, MySQL statements killed.", ("kind",)
+)
+
+class QueryCancelledError(Exception):
+    """The request was cancelled before its statement started."""
+
+class RunningQuery:
+    """
+    The statement one pipeline has on a pooled connection. _execute_sql attaches
+    the connection while the statement runs; cancel() (from any thread) marks the
+    query cancelled and, if it is running, asks the pool to KILL QUERY it.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.killed = False
+        self._pool = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, pool, conn):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("The request was cancelled.")
+            self._pool, self._conn = pool, conn
+
+    def detach(self):
+        with self._lock:
+            self._pool = self._conn = None
+
+    def cancel(self):
+        """Blocking (opens a connection for KILL QUERY); run it off the event loop."""
+        with self._lock:
+            self.cancelled = True
+            pool, conn = self._pool, self._conn
+        kill = getattr(pool, "kill_query", None)
+        if conn is None or kill is None:
+            return False
+        try:
+            kill(conn)
+        except Exception as e:
+            logger.warning(f"KILL QUERY failed: {e}")
+            return False
+        self.killed = True
+        cancellations.record_work("killed_queries")
+        logger.info("Killed the query of a cancelled request.")
+        return True
+
+class Cancellations:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {reason: 0 for reason in REASONS}
+        self.aborted_model_calls = 0
+        self.killed_queries = 0
+
+    def record(self, reason):
+        with self._lock:
+            self.requests[reason] = self.requests.get(reason, 0) + 1
+        CANCELLED.inc(reason=reason)
+
+    def record_work(self, kind, count=1):
+        if not count:
+            return
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + count)
+        CANCELLED_WORK.inc(count, kind=kind)
+
+    def record_trace(self, trace):
+        """Counts the Gemini calls a cancelled run's `trace` (metrics_helper.Trace) had in flight."""
+        aborted = sum(
+            1 for span in trace.spans
+            if span.name in ("generate", "synthesize") and span.outcome == "cancelled"
+            and span.attributes.get("source") != "template"
+        )
+        self.record_work("aborted_model_calls", aborted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "aborted_model_calls": self.aborted_model_calls,
+                "killed_queries": self.killed_queries,
+            }
+
+cancellations = Cancellations()
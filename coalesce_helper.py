@@ -0,0 +1,146 @@
+import asyncio
+import logging
+
+import metrics_helper
+
+logger = logging.getLogger(__name__)
+
+# Request coalescing for the chat pipeline. Identical questions that arrive while
+# one is still being answered (a dashboard refresh, a team opening the same report)
+# subscribe to that run instead of starting their own: each subscriber replays the
+# events produced so far and then follows the live ones. The run is a task of its
+# own, so it continues when the client that started it disconnects, and is
+# cancelled only when every subscriber has gone.
+
+COALESCED = metrics_helper.REGISTRY.counter(
+    "talk2db_coalesced_requests_total", "Questions answered by joining an identical one in flight."
+)
+SAVED_CALLS = metrics_helper.REGISTRY.counter(
+    "talk2db_coalesced_saved_calls_total", "Gemini calls and SQL queries saved by coalescing.", ("kind",)
+)
+
+def calls_made(result):
+    """(model_calls, queries) a finished pipeline run made, from its result's trace."""
+    model_calls = queries = 0
+    for span in (result.get("trace") or {}).get("spans", []):
+        attributes = span.get("attributes", {})
+        if span["name"] == "generate" and not attributes.get("cache_hit"):
+            model_calls += 1
+        elif span["name"] == "synthesize" and attributes.get("source") == "model":
+            model_calls += 1
+        elif span["name"] == "execute" and not attributes.get("cache_hit"):
+            queries += 1
+    return model_calls, queries
+
+class _Flight:
+    """One pipeline run and the events it has produced so far."""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.subscribers = 0
+        self.joined = 0
+        self.task = None
+        self._updated = asyncio.Event()
+
+    def push(self, item):
+        self.events.append(item)
+        self._wake()
+
+    def finish(self):
+        self.finished = True
+        self._wake()
+
+    def _wake(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def wait(self):
+        await self._updated.wait()
+
+class Coalescer:
+    """In-flight pipeline runs by key; see subscribe()."""
+
+    def __init__(self):
+        self._flights = {}
+
+        self.runs = 0
+        self.coalesced = 0
+        self.saved_model_calls = 0
+        self.saved_queries = 0
+
+    async def _pump(self, key, flight, events):
+        try:
+            async for item in events:
+                flight.push(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Coalesced pipeline failed: {e}")
+            flight.push(("done", {"success": False, "error": str(e)}))
+        finally:
+            flight.finish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            try:
+                await events.aclose()
+            except Exception:
+                pass
+        followers = flight.joined
+        done = next((data for event, data in reversed(flight.events) if event == "done"), None)
+        if followers and done is not None:
+            model_calls, queries = calls_made(done)
+            self.saved_model_calls += followers * model_calls
+            self.saved_queries += followers * queries
+            SAVED_CALLS.inc(followers * model_calls, kind="model")
+            SAVED_CALLS.inc(followers * queries, kind="query")
+
+    async def subscribe(self, key, start):
+        """
+        Yields the (event, data) pairs of the run for `key`, starting it with
+        `start()` (an async generator) when none is in flight. Subscribers that
+        joined a run get a "Joined..." step first and "coalesced": True on "done".
+        """
+        flight = self._flights.get(key)
+        joined = flight is not None
+        if joined:
+            flight.joined += 1
+            self.coalesced += 1
+            COALESCED.inc()
+        else:
+            flight = _Flight()
+            self._flights[key] = flight
+            self.runs += 1
+            flight.task = asyncio.ensure_future(self._pump(key, flight, start()))
+        flight.subscribers += 1
+
+        position = 0
+        try:
+            if joined:
+                yield "step", "Joined an identical question that is already being answered."
+            while True:
+                while position < len(flight.events):
+                    event, data = flight.events[position]
+                    position += 1
+                    if joined and event == "done":
+                        data = dict(data, coalesced=True)
+                    yield event, data
+                if flight.finished:
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                # Nobody is waiting for this answer any more; later askers start afresh
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+            "saved_model_calls": self.saved_model_calls,
+            "saved_queries": self.saved_queries,
+        }
@@ -0,0 +1,2 @@
+# Manual scripts that call the live Gemini API, not pytest tests
+collect_ignore = ["test_generation.py"]
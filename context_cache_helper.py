@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import re
+import threading
+import time
+
+from google.genai import types
+
+import schema_helper
+
+logger = logging.getLogger(__name__)
+
+# Gemini context caching for the schema preamble. The full schema text is uploaded
+# once per (model, database) as cached content, and SQL-generation chats refer to it
+# by name instead of re-sending thousands of schema tokens with every question.
+# An entry is replaced when the schema fingerprint changes and its TTL is extended
+# while it is in use. Models or schemas the API refuses to cache are remembered and
+# fall back to the regular pruned prompt; after a transient failure (rate limit,
+# 5xx, network) creating is retried once RETRY_SECONDS have passed.
+
+# Seconds to use the regular prompt after a cache could not be created for a transient reason
+RETRY_SECONDS = 60
+
+def is_missing_cache_error(error):
+    """The provider no longer knows a cached content we referenced (expired or deleted)."""
+    text = str(error)
+    return bool(re.search(r"cached.?content", text, re.IGNORECASE)) and (
+        "404" in text or "NOT_FOUND" in text or "not found" in text.lower() or "expired" in text.lower()
+    )
+
+def is_permanent_error(error):
+    """A 4xx from the API (too small, invalid) that retrying the same preamble will not fix."""
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        match = re.search(r"\b([45]\d\d)\b", str(error))
+        code = int(match.group(1)) if match else None
+    if code is None:
+        return bool(re.search(r"INVALID_ARGUMENT|FAILED_PRECONDITION", str(error)))
+    return 400 <= code < 500 and code not in (408, 429)
+
+class _Entry:
+    def __init__(self, name, fingerprint, expires_at, tokens):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.tokens = tokens
+
+class ContextCache:
+    """
+    Cached-content names by (model, scope). `min_tokens` / `max_tokens` bound the
+    schemas worth caching (the API rejects small ones); `ttl` is requested from the
+    provider and extended when less than `refresh_margin` seconds remain.
+    """
+
+    def __init__(self, ttl=3600, min_tokens=4096, max_tokens=500000, refresh_margin=300):
+        self.ttl = int(ttl)
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.refresh_margin = refresh_margin
+        self._entries = {}  # (model, scope) -> _Entry
+        self._refused = {}  # (model, scope) -> fingerprint the API would not cache
+        self._retry_at = {}  # (model, scope) -> when to try creating again after a transient failure
+        self._unsupported = set()  # models without context caching
+        self._locks = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.invalidations = 0
+        self.failures = 0
+
+    def applies_to(self, schema_tokens):
+        return self.min_tokens <= schema_tokens <= self.max_tokens
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, asyncio.Lock())
+
+    async def get(self, client, model, scope, fingerprint, preamble):
+        """The cached-content name holding `preamble` for `model`, creating it if needed; None to skip."""
+        key = (model, scope)
+        if model in self._unsupported or self._refused.get(key) == fingerprint:
+            return None
+        if time.monotonic() < self._retry_at.get(key, 0.0):
+            return None
+        entry = self._entries.get(key)
+        if entry and entry.fingerprint == fingerprint and entry.expires_at - time.time() > self.refresh_margin:
+            self.hits += 1
+            return entry.name
+
+        async with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry and entry.fingerprint == fingerprint:
+                if entry.expires_at - time.time() > self.refresh_margin:
+                    self.hits += 1
+                    return entry.name
+                if await self._extend(client, entry):
+                    self.hits += 1
+                    return entry.name
+            elif entry:
+                # Schema changed since the preamble was uploaded
+                self.invalidations += 1
+                await self._delete(client, entry.name)
+            self._entries.pop(key, None)
+            return await self._create(client, model, scope, fingerprint, preamble)
+
+    async def _create(self, client, model, scope, fingerprint, preamble):
+        key = (model, scope)
+        try:
+            cached = await client.aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=preamble)])],
+                display_name=f"talk2db-schema-{fingerprint}",
+                ttl=f"{self.ttl}s",
+            ))
+        except Exception as e:
+            self.failures += 1
+            text = str(e)
+            if re.search(r"not supported|unsupported|does not support", text, re.IGNORECASE):
+                logger.warning(f"Model {model} does not support context caching: {e}")
+                self._unsupported.add(model)
+            elif is_permanent_error(e):
+                logger.warning(f"Context cache for {model} refused: {e}")
+                self._refused[key] = fingerprint
+            else:
+                logger.info(f"Context cache for {model} not created, retrying in {RETRY_SECONDS}s: {e}")
+                self._retry_at[key] = time.monotonic() + RETRY_SECONDS
+            return None
+        self._retry_at.pop(key, None)
+        usage = getattr(cached, "usage_metadata", None)
+        tokens = getattr(usage, "total_token_count", None) or schema_helper.estimate_tokens(preamble)
+        self._entries[key] = _Entry(cached.name, fingerprint, self._expiry(cached), tokens)
+        self.creates += 1
+        logger.info(f"Cached {tokens} schema tokens for {model} as {cached.name}")
+        return cached.name
+
+    async def _extend(self, client, entry):
+        try:
+            cached = await client.aio.caches.update(
+                name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+            )
+        except Exception as e:
+            logger.info(f"Extending context cache {entry.name} failed, recreating: {e}")
+            return False
+        entry.expires_at = self._expiry(cached)
+        self.refreshes += 1
+        return True
+
+    def _expiry(self, cached):
+        expire_time = getattr(cached, "expire_time", None)
+        if isinstance(expire_time, datetime.datetime):
+            return expire_time.timestamp()
+        return time.time() + self.ttl
+
+    async def _delete(self, client, name):
+        try:
+            await client.aio.caches.delete(name=name)
+        except Exception as e:
+            logger.debug(f"Deleting context cache {name} failed: {e}")
+
+    def forget(self, model, scope):
+        """Drops an entry the provider reported missing; the next call recreates it."""
+        if self._entries.pop((model, scope), None):
+            self.invalidations += 1
+
+    def stats(self):
+        entries = list(self._entries.values())
+        return {
+            "entries": len(entries),
+            "cached_tokens": sum(e.tokens for e in entries),
+            "hits": self.hits,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "invalidations": self.invalidations,
+            "failures": self.failures,
+            "unsupported_models": sorted(self._unsupported),
+            "ttl": self.ttl,
+            "min_tokens": self.min_tokens,
+        }
+
+class LocalCacheService:
+    """
+    Offline stand-in for client.aio.caches (create/get/update/delete), for fake
+    clients in load tests and benchmarks. `contents(name)` returns the cached text,
+    so a fake chat can see what the real model would.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._caches = {}
+        self._ids = itertools.count(1)
+
+    async def create(self, model, config):
+        await asyncio.sleep(self.latency)
+        name = f"cachedContents/local-{next(self._ids)}"
+        text = "".join(part.text for content in config.contents for part in content.parts)
+        ttl = float(str(config.ttl or "3600s").rstrip("s"))
+        self._caches[name] = {"model": model, "text": text, "ttl": ttl}
+        return self._describe(name)
+
+    async def get(self, name):
+        if name not in self._caches:
+            raise KeyError(f"404 NOT_FOUND: CachedContent {name} not found")
+        return self._describe(name)
+
+    async def update(self, name, config):
+        cache = self._caches.get(name)
+        if cache is None:
+            raise KeyError(f"404 NOT_FOUND: CachedContent {name} not found")
+        cache["ttl"] = float(str(config.ttl or "3600s").rstrip("s"))
+        return self._describe(name)
+
+    async def delete(self, name):
+        self._caches.pop(name, None)
+
+    def contents(self, name):
+        cache = self._caches.get(name)
+        return cache["text"] if cache else None
+
+    def _describe(self, name):
+        cache = self._caches[name]
+        return types.CachedContent(
+            name=name,
+            model=cache["model"],
+            expire_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=cache["ttl"]),
+            usage_metadata=types.CachedContentUsageMetadata(
+                total_token_count=schema_helper.estimate_tokens(cache["text"])
+            ),
+        )
@@ -1,6 +1,14 @@
 import mysql.connector
 import socket
 import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+import metrics_helper
+import router_helper
+import schema_helper
 
 # Configure Logging (re-use same logger setup or simple print for now)
 logger = logging.getLogger(__name__)
@@ -13,46 +21,460 @@ def is_port_open(host, port):
     except:
         return False
 
-def get_schema_info_from_conn(conn):
-    """Extracts table and column info from a live connection."""
-    cursor = conn.cursor()
-    cursor.execute("SHOW TABLES")
-    tables = [table[0] for table in cursor.fetchall()]
-    
-    schema_info = []
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+    - Connections are opened lazily up to `size`.
+    - Each checkout pings the connection and reconnects stale sockets.
+    - Connections idle longer than `max_idle` seconds are closed on checkout.
+    """
+
+    def __init__(self, db_config, size=5, max_idle=300, checkout_timeout=10, init_statements=None):
+        self.db_config = dict(db_config)
+        self.init_statements = list(init_statements or [])
+        self.size = max(1, int(size))
+        self.max_idle = max_idle
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._doomed = set()  # ids of checked-out connections to close on release
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Counters for stats()
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._evicted = 0
+        self._reconnects = 0
+
+    def _new_connection(self):
+        conn = mysql.connector.connect(**self.db_config)
+        self._init_session(conn)
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _init_session(self, conn):
+        """Runs init_statements on a fresh session; unsupported ones are skipped."""
+        for statement in self.init_statements:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(statement)
+                cursor.close()
+            except Exception as e:
+                logger.debug(f"Session init statement skipped ({statement}): {e}")
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        """Closes idle connections past max_idle. Caller must hold the lock."""
+        if not self.max_idle:
+            return
+        cutoff = time.monotonic() - self.max_idle
+        # Oldest entries sit on the left
+        while self._idle and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.popleft()
+            self._open -= 1
+            self._evicted += 1
+            self._discard(conn)
+
+    def _health_check(self, conn):
+        """Returns a usable connection, reconnecting if the socket went stale."""
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            logger.info("Pooled connection is stale, reconnecting...")
+            with self._cond:
+                self._reconnects += 1
+            try:
+                conn.reconnect(attempts=1)
+                self._init_session(conn)
+                return conn
+            except Exception:
+                self._discard(conn)
+                return self._new_connection()
+
+    def acquire(self):
+        """Checks out a healthy connection, waiting up to checkout_timeout if the pool is exhausted."""
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                self._evict_idle()
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    # Reserve the slot, open outside the lock
+                    self._open += 1
+                    conn = None
+                    break
+                remaining = self.checkout_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.checkout_timeout}s "
+                        f"(pool size {self.size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += time.monotonic() - start
+
+        try:
+            if conn is None:
+                conn = self._new_connection()
+            else:
+                conn = self._health_check(conn)
+            return conn
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def discard_on_release(self, conn):
+        """
+        Marks a checked-out connection to be closed instead of reused, e.g. when rows
+        are left unread on it. Closing the socket is far cheaper than draining them.
+        """
+        with self._cond:
+            self._doomed.add(id(conn))
+
+    def release(self, conn, broken=False):
+        """Returns a connection to the pool. Broken connections are closed instead."""
+        with self._cond:
+            if id(conn) in self._doomed:
+                self._doomed.discard(id(conn))
+                broken = True
+        if not broken:
+            try:
+                # Drop any unread result / open transaction before reuse
+                conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._open -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager wrapper around acquire()/release()."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except mysql.connector.errors.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def kill_query(self, conn):
+        """
+        Stops the statement running on checked-out `conn` with KILL QUERY, sent over
+        a separate short-lived connection. `conn` is closed on release afterwards.
+        """
+        thread_id = conn.connection_id
+        killer = mysql.connector.connect(**self.db_config)
+        try:
+            cursor = killer.cursor()
+            cursor.execute(f"KILL QUERY {int(thread_id)}")
+            cursor.close()
+        finally:
+            killer.close()
+        self.discard_on_release(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time, 4),
+                "wait_time_avg": round(self._wait_time / self._waits, 4) if self._waits else 0.0,
+                "created": self._created,
+                "evicted": self._evicted,
+                "reconnects": self._reconnects,
+            }
+
+    def close(self):
+        """Closes all idle connections; checked-out ones are closed on release."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._open -= 1
+                self._discard(conn)
+            self._cond.notify_all()
+
+def _text(value):
+    """information_schema text columns can come back as bytes on some server/connector combos."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+def _in_clause(values):
+    return ", ".join(["%s"] * len(values))
+
+def _fetch_table_versions(cursor, database):
+    """One query for every table's change signature (DDL via CREATE_TIME, DML via UPDATE_TIME)."""
+    cursor.execute(
+        "SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME, TABLE_COMMENT "
+        "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s",
+        (database,)
+    )
+    versions, comments = {}, {}
+    for name, created, updated, comment in cursor.fetchall():
+        name = _text(name)
+        versions[name] = f"{created}|{updated}"
+        comments[name] = _text(comment) or ""
+    return versions, comments
+
+def _fetch_table_details(cursor, database, tables):
+    """Bulk-reads columns, keys and indexes for `tables` (None = all) in three queries."""
+    filter_sql, params = "", (database,)
+    if tables is not None:
+        filter_sql = f" AND TABLE_NAME IN ({_in_clause(tables)})"
+        params = (database, *tables)
+
+    details = {}
+
+    def table_entry(name):
+        return details.setdefault(name, {
+            "comment": "", "columns": [], "primary_key": [], "foreign_keys": [], "indexes": {}
+        })
+
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, "
+        "COLUMN_DEFAULT, EXTRA, COLUMN_COMMENT "
+        "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s" + filter_sql +
+        " ORDER BY TABLE_NAME, ORDINAL_POSITION",
+        params
+    )
+    for row in cursor.fetchall():
+        table, name, col_type, nullable, key, default, extra, comment = map(_text, row)
+        table_entry(table)["columns"].append({
+            "name": name,
+            "type": col_type,
+            "nullable": nullable == "YES",
+            "key": key or "",
+            "default": None if default is None else str(default),
+            "extra": extra or "",
+            "comment": comment or "",
+        })
+
+    cursor.execute(
+        "SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+        "FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = %s" + filter_sql +
+        " ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION",
+        params
+    )
+    for row in cursor.fetchall():
+        table, constraint, column, ref_table, ref_column = map(_text, row)
+        entry = table_entry(table)
+        if constraint == "PRIMARY":
+            entry["primary_key"].append(column)
+        elif ref_table:
+            entry["foreign_keys"].append({"column": column, "ref_table": ref_table, "ref_column": ref_column})
+
+    cursor.execute(
+        "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME "
+        "FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = %s" + filter_sql +
+        " ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX",
+        params
+    )
+    for row in cursor.fetchall():
+        table, index, non_unique, column = map(_text, row)
+        index_entry = table_entry(table)["indexes"].setdefault(
+            index, {"unique": not int(non_unique), "columns": []}
+        )
+        index_entry["columns"].append(column)
+
+    return details
+
+def fetch_table_versions(conn, tables):
+    """
+    Returns {table: "CREATE_TIME|UPDATE_TIME"} for `tables` in the connection's current
+    database (or the schema given as a `db.table` prefix). Missing tables are omitted.
+    """
+    by_schema = {}
     for table in tables:
-        cursor.execute(f"DESCRIBE {table}")
-        columns = [f"{col[0]} ({col[1]})" for col in cursor.fetchall()]
-        schema_info.append(f"Table: {table}\nColumns: {', '.join(columns)}")
-    
-    cursor.close()
-    return "\n\n".join(schema_info)
-
-def try_connect_db(host, port, user, password, database):
-    """Attempts to connect and returns (success, result_or_error)."""
-    
+        schema, _, name = table.rpartition(".")
+        by_schema.setdefault(schema or None, []).append((table, name))
+
+    versions = {}
+    cursor = conn.cursor()
+    try:
+        for schema, names in by_schema.items():
+            schema_sql = "DATABASE()" if schema is None else "%s"
+            params = ((schema,) if schema else ()) + tuple(name for _, name in names)
+            cursor.execute(
+                "SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME FROM information_schema.TABLES "
+                f"WHERE TABLE_SCHEMA = {schema_sql} AND TABLE_NAME IN ({_in_clause(names)})",
+                params
+            )
+            found = {
+                _text(name).lower(): f"{created}|{updated}" for name, created, updated in cursor.fetchall()
+            }
+            for table, name in names:
+                if name.lower() in found:
+                    versions[table] = found[name.lower()]
+    finally:
+        cursor.close()
+    return versions
+
+def get_schema_info_from_conn(conn, database=None, cache_key=None, cache_dir=schema_helper.DEFAULT_CACHE_DIR):
+    """
+    Extracts table, column, key and index info from a live connection as a SchemaModel.
+    With a cache_key, the previous model is loaded from disk and only tables whose
+    CREATE_TIME/UPDATE_TIME changed since then are re-read.
+    """
+    cursor = conn.cursor()
+    try:
+        if database is None:
+            cursor.execute("SELECT DATABASE()")
+            database = cursor.fetchone()[0]
+
+        try:
+            # MySQL 8 caches TABLES statistics for a day by default; we need fresh UPDATE_TIMEs
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except Exception:
+            pass  # MySQL 5.7 / MariaDB have no such variable and never cache
+
+        versions, comments = _fetch_table_versions(cursor, database)
+
+        cached = schema_helper.load_cached_schema(cache_key, cache_dir) if cache_key else None
+        if cached is None:
+            changed = None  # Read everything
+        else:
+            changed = [name for name, version in versions.items() if cached.versions.get(name) != version]
+            removed = set(cached.tables) - set(versions)
+            if not changed and not removed:
+                metrics_helper.record_cache("schema", True)
+                logger.info(f"Schema cache hit for {database} ({len(versions)} tables unchanged).")
+                return cached
+            logger.info(f"Schema cache: re-reading {len(changed)} changed table(s), dropping {len(removed)}.")
+        if cache_key:
+            metrics_helper.record_cache("schema", False)
+
+        details = _fetch_table_details(cursor, database, changed) if changed != [] else {}
+    finally:
+        cursor.close()
+
+    tables = {} if cached is None else {
+        name: table for name, table in cached.tables.items() if name in versions
+    }
+    if changed is not None:
+        for name in changed:
+            tables.pop(name, None)
+    tables.update(details)
+    for name, table in tables.items():
+        table["comment"] = comments.get(name, "")
+
+    model = schema_helper.SchemaModel(database, tables, versions)
+    if cache_key:
+        schema_helper.save_cached_schema(cache_key, model, cache_dir)
+    return model
+
+def _replica_pools(replicas, db_config, pool_size, pool_max_idle):
+    """
+    {name: ConnectionPool} for `replicas`, a list of {"name", "host", "port", "user",
+    "password"} dicts; missing fields are taken from the primary's `db_config`.
+    Pools connect lazily, so an unreachable replica is only routed around.
+    """
+    pools = {}
+    for i, replica in enumerate(replicas):
+        config = dict(db_config)
+        config.update({key: replica[key] for key in ("host", "port", "user", "password") if replica.get(key)})
+        config['port'] = int(config['port'])
+        name = replica.get("name") or f"replica{i + 1}"
+        pools[name] = ConnectionPool(
+            config, size=pool_size, max_idle=pool_max_idle,
+            init_statements=["SET SESSION information_schema_stats_expiry = 0"]
+        )
+    return pools
+
+def try_connect_db(host, port, user, password, database, pool_size=5, pool_max_idle=300,
+                   schema_cache_dir=schema_helper.DEFAULT_CACHE_DIR, replicas=None, max_replica_lag=30,
+                   replica_lag_check_interval=5, replica_failure_cooldown=30, read_from_primary=True):
+    """
+    Attempts to connect and returns (success, result_or_error).
+    On success result is a (SchemaModel, pool) tuple; the pool is owned by the caller.
+    With `replicas` the pool is a router_helper.QueryRouter that sends queries to
+    the replicas (see router_helper for the other settings); the schema is always
+    read from the primary.
+    """
+
     # 1. Port Check
     if not is_port_open(host, port):
         return False, f"Port {port} on {host} is unreachable."
 
     # 2. Connection
+    db_config = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database,
+        'connection_timeout': 5,
+        'use_pure': True
+    }
+    pool = ConnectionPool(
+        db_config, size=pool_size, max_idle=pool_max_idle,
+        # Fresh information_schema UPDATE_TIMEs on MySQL 8 (ignored elsewhere)
+        init_statements=["SET SESSION information_schema_stats_expiry = 0"]
+    )
     try:
-        conn = mysql.connector.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database,
-            connection_timeout=5,
-            use_pure=True
-        )
-        
-        if conn.is_connected():
-            schema = get_schema_info_from_conn(conn)
-            conn.close()
-            return True, schema
-        else:
-            return False, "Failed to establish connection."
-            
+        with ExitStack() as stack:
+            with metrics_helper.span("connect", database=database):
+                conn = stack.enter_context(pool.connection())
+            if not conn.is_connected():
+                pool.close()
+                return False, "Failed to establish connection."
+            with metrics_helper.span("introspect", database=database) as span:
+                schema = get_schema_info_from_conn(
+                    conn, database,
+                    cache_key=schema_helper.cache_key(host, port, database),
+                    cache_dir=schema_cache_dir
+                )
+                span.set(tables=len(schema.tables))
+        if replicas:
+            pool = router_helper.QueryRouter(
+                pool, _replica_pools(replicas, db_config, pool_size, pool_max_idle),
+                max_lag=max_replica_lag, lag_check_interval=replica_lag_check_interval,
+                failure_cooldown=replica_failure_cooldown, read_from_primary=read_from_primary
+            )
+        return True, (schema, pool)
+
     except Exception as e:
+        pool.close()
         return False, str(e)
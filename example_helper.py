@@ -0,0 +1,391 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import cache_helper
+import metrics_helper
+import schema_helper
+import sql_helper
+
+logger = logging.getLogger(__name__)
+
+# Verified few-shot examples for SQL generation. A question whose generated SQL ran
+# and returned rows becomes a candidate example for its database. It is shown to the
+# model once it has gone `verify_seconds` without the user marking the answer wrong
+# (POST /api/feedback), or straight away when marked right; marked wrong, it is
+# dropped. Before SQL is generated, the examples nearest to the question by TF-IDF
+# cosine similarity are added to the prompt within a token budget.
+# ExampleStore also counts first-attempt outcomes of generated SQL, with and without
+# examples in the prompt, so their effect on accuracy and latency can be compared.
+
+OUTCOMES = ("ok", "empty", "error", "rejected")
+
+FIRST_ATTEMPTS = metrics_helper.REGISTRY.counter(
+    "talk2db_sql_first_attempts_total",
+    "Generated SQL by first-attempt outcome, with or without few-shot examples in the prompt.",
+    ("examples", "outcome")
+)
+FEEDBACK = metrics_helper.REGISTRY.counter(
+    "talk2db_answer_feedback_total", "Answers users marked right or wrong.", ("verdict",)
+)
+FIRST_ATTEMPT_SECONDS = metrics_helper.REGISTRY.histogram(
+    "talk2db_sql_first_attempt_seconds",
+    "End-to-end seconds of questions answered with generated SQL, with or without few-shot examples.",
+    ("examples",)
+)
+
+def run_outcome(trace, result):
+    """
+    (outcome, examples_used, rows) of a finished run whose SQL was generated by the
+    model, from its metrics_helper.Trace and result dict; None for chat replies,
+    cached SQL and runs that failed before a query was written.
+    """
+    spans = {span.name: span for span in trace.spans}
+    generate = spans.get("generate")
+    if generate is None or generate.attributes.get("cache_hit") or not result.get("is_sql_query"):
+        return None
+    examples_used = bool(generate.attributes.get("examples"))
+    if result.get("rejected"):
+        return "rejected", examples_used, 0
+    if any(span.name in ("execute", "fetch") and span.outcome == "error" for span in trace.spans):
+        return "error", examples_used, 0
+    fetch = spans.get("fetch")
+    execute = spans.get("execute")
+    if fetch is not None:
+        rows = fetch.attributes.get("rows", 0)
+    elif execute is not None:
+        rows = execute.attributes.get("cached_rows", 0)
+    else:
+        return "error", examples_used, 0
+    return ("ok" if rows else "empty"), examples_used, rows
+
+class _Example:
+    __slots__ = ("key", "scope", "question", "sql", "tables", "terms", "created_at", "verified")
+
+    def __init__(self, key, scope, question, sql, created_at, verified=False):
+        self.key = key
+        self.scope = scope
+        self.question = question
+        self.sql = sql
+        self.tables = {table.split(".")[-1].lower() for table in sql_helper.referenced_tables(sql)}
+        self.terms = Counter(schema_helper.tokenize(question))
+        self.created_at = created_at
+        self.verified = verified
+
+class ExampleStore:
+    """
+    Question -> SQL examples per database scope, with a TF-IDF index over the
+    questions. `top_k` examples with similarity of at least `min_similarity` go into
+    a prompt, within `prompt_tokens`. At most `max_examples` are kept (oldest
+    dropped first). If `path` is given, examples are written through to SQLite and
+    reloaded on start.
+    """
+
+    def __init__(self, path=None, max_examples=5000, top_k=3, prompt_tokens=400, min_similarity=0.3,
+                 verify_seconds=300):
+        self.path = path
+        self.max_examples = max(1, int(max_examples))
+        self.top_k = max(1, int(top_k))
+        self.prompt_tokens = int(prompt_tokens)
+        self.min_similarity = float(min_similarity)
+        self.verify_seconds = float(verify_seconds)
+        self._examples = OrderedDict()  # key -> _Example, oldest first
+        self._postings = {}  # scope -> {term: set(keys)}
+        self._counts = {}  # scope -> examples in it
+        self._answers = OrderedDict()  # query_id -> (key, question, sql, examples_used, outcome)
+        self._rejected = OrderedDict()  # (key, sql) marked wrong; never captured again
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.lookups = 0
+        self.prompts_with_examples = 0
+        self.verdicts = {"right": 0, "wrong": 0}
+        self.evictions = 0
+        self.attempts = {
+            used: dict({outcome: 0 for outcome in OUTCOMES}, corrected=0, seconds=0.0)
+            for used in (True, False)
+        }
+
+        if path:
+            self._open_store()
+
+    @staticmethod
+    def make_key(scope, question):
+        """Returns the example key, or None for questions with no words."""
+        normalized = cache_helper.question_key(question)
+        if not normalized:
+            return None
+        return f"{scope}:{normalized}"
+
+    def _open_store(self):
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sql_examples ("
+                "key TEXT PRIMARY KEY, scope TEXT NOT NULL, question TEXT NOT NULL, sql TEXT NOT NULL, "
+                "created_at REAL NOT NULL, verified INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rejected_sql_examples ("
+                "key TEXT NOT NULL, sql TEXT NOT NULL, rejected_at REAL NOT NULL, PRIMARY KEY (key, sql))"
+            )
+            rows = self._db.execute(
+                "SELECT key, scope, question, sql, created_at, verified FROM sql_examples "
+                "ORDER BY created_at DESC LIMIT ?", (self.max_examples,)
+            ).fetchall()
+            for key, scope, question, sql, created_at, verified in reversed(rows):
+                self._add(_Example(key, scope, question, sql, created_at, bool(verified)))
+            for key, sql in self._db.execute(
+                "SELECT key, sql FROM rejected_sql_examples ORDER BY rejected_at DESC LIMIT ?", (self.max_examples,)
+            ).fetchall()[::-1]:
+                self._rejected[(key, sql)] = None
+            logger.info(f"Loaded {len(rows)} SQL example(s) from {self.path}")
+        except Exception as e:
+            logger.warning(f"SQL example persistence disabled ({self.path}): {e}")
+            self._db = None
+
+    def _store(self, sql, params):
+        """Runs a write against the SQLite store. Caller must hold the lock."""
+        if not self._db:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"SQL example write failed: {e}")
+
+    def _add(self, example):
+        """Indexes `example`, replacing any with the same key. Caller must hold the lock."""
+        self._remove(example.key)
+        self._examples[example.key] = example
+        self._counts[example.scope] = self._counts.get(example.scope, 0) + 1
+        postings = self._postings.setdefault(example.scope, {})
+        for term in example.terms:
+            postings.setdefault(term, set()).add(example.key)
+
+    def _remove(self, key):
+        """Caller must hold the lock."""
+        example = self._examples.pop(key, None)
+        if example is None:
+            return None
+        self._counts[example.scope] -= 1
+        postings = self._postings[example.scope]
+        for term in example.terms:
+            keys = postings.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del postings[term]
+        if not self._counts[example.scope]:
+            del self._counts[example.scope]
+            del self._postings[example.scope]
+        return example
+
+    def _usable(self, example, now):
+        return example.verified or now - example.created_at >= self.verify_seconds
+
+    def _weights(self, terms, scope):
+        """TF-IDF weights of `terms` against the examples of `scope`. Caller must hold the lock."""
+        postings = self._postings.get(scope, {})
+        n = self._counts.get(scope, 0)
+        return {
+            term: (1 + math.log(tf)) * (math.log((1 + n) / (1 + len(postings.get(term, ())))) + 1)
+            for term, tf in terms.items()
+        }
+
+    def nearest(self, scope, question, tables=None):
+        """
+        [(similarity, example), ...] of the usable examples of `scope` most similar to
+        `question`, best first, at most top_k. With `tables` (the schema's table
+        names), examples reading any other table are skipped.
+        """
+        terms = Counter(schema_helper.tokenize(question))
+        now = time.time()
+        with self._lock:
+            postings = self._postings.get(scope)
+            if not terms or not postings:
+                return []
+            query = self._weights(terms, scope)
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+            candidates = set()
+            for term in terms:
+                candidates |= postings.get(term, set())
+            scored = []
+            for key in candidates:
+                example = self._examples[key]
+                if not self._usable(example, now) or (tables is not None and not example.tables <= tables):
+                    continue
+                weights = self._weights(example.terms, scope)
+                norm = math.sqrt(sum(w * w for w in weights.values()))
+                dot = sum(w * query[term] for term, w in weights.items() if term in query)
+                similarity = dot / (norm * query_norm) if norm and query_norm else 0.0
+                if similarity >= self.min_similarity:
+                    scored.append((similarity, example))
+        scored.sort(key=lambda item: (-item[0], item[1].question))
+        return scored[:self.top_k]
+
+    def prompt_for(self, session, question):
+        """
+        (prompt_text, count): the examples nearest to `question` on `session`'s
+        database, as a prompt section within prompt_tokens; ("", 0) if none qualify.
+        """
+        self.lookups += 1
+        nearest = self.nearest(session.scope, question, {table.lower() for table in session.schema_model.tables})
+        lines, used = [], 0
+        for _, example in nearest:
+            entry = f"Q: {example.question}\n    SQL: {example.sql}"
+            cost = schema_helper.estimate_tokens(entry)
+            if used + cost > self.prompt_tokens:
+                continue
+            lines.append(entry)
+            used += cost
+        if not lines:
+            return "", 0
+        self.prompts_with_examples += 1
+        header = "Earlier questions on this database and SQL that answered them correctly:"
+        return header + "\n    " + "\n    ".join(lines), len(lines)
+
+    def record_run(self, session, question, trace, result):
+        """
+        Counts a finished run's first-attempt outcome (see run_outcome) and keeps
+        SQL that returned rows as a candidate example. The query_id of any answer
+        from SQL can then be given to feedback().
+        """
+        outcome = run_outcome(trace, result)
+        sql = result.get("sql_query")
+        if outcome is not None:
+            outcome, examples_used, _ = outcome
+            with self._lock:
+                counts = self.attempts[examples_used]
+                counts[outcome] += 1
+                counts["seconds"] += trace.duration or 0.0
+            labels = "yes" if examples_used else "no"
+            FIRST_ATTEMPTS.inc(examples=labels, outcome=outcome)
+            if trace.duration is not None:
+                FIRST_ATTEMPT_SECONDS.observe(trace.duration, examples=labels)
+
+            key = self.make_key(session.scope, question) if outcome == "ok" else None
+            # SQL the query guard had to cut down with a LIMIT is no example to follow
+            if any(span.name == "execute" and span.attributes.get("rewritten") for span in trace.spans):
+                key = None
+            if key is not None and (key, sql) not in self._rejected:
+                example = _Example(key, session.scope, question.strip(), sql, time.time())
+                with self._lock:
+                    previous = self._examples.get(key)
+                    if previous is not None and previous.sql == example.sql:
+                        example.created_at, example.verified = previous.created_at, previous.verified
+                    self._add(example)
+                    self._store(
+                        "INSERT OR REPLACE INTO sql_examples (key, scope, question, sql, created_at, verified) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, example.scope, example.question, example.sql, example.created_at, int(example.verified))
+                    )
+                    while len(self._examples) > self.max_examples:
+                        old_key = next(iter(self._examples))
+                        self._remove(old_key)
+                        self._store("DELETE FROM sql_examples WHERE key = ?", (old_key,))
+                        self.evictions += 1
+        elif result.get("success") and result.get("is_sql_query"):
+            # SQL from the question cache: not a first attempt, but it can still be marked wrong
+            outcome, examples_used, key = "cached", False, self.make_key(session.scope, question)
+        else:
+            return
+        query_id = result.get("query_id")
+        if query_id:
+            with self._lock:
+                self._answers[query_id] = (key, question, sql, examples_used, outcome)
+                while len(self._answers) > self.max_examples:
+                    self._answers.popitem(last=False)
+
+    def share(self, query_id, other_id):
+        """Lets feedback() take `other_id` for the answer with `query_id` (a coalesced request's own handle)."""
+        with self._lock:
+            answer = self._answers.get(query_id)
+            if answer is not None and other_id != query_id:
+                self._answers[other_id] = answer
+                while len(self._answers) > self.max_examples:
+                    self._answers.popitem(last=False)
+
+    def feedback(self, query_id, correct):
+        """
+        Records the user's verdict on the answer with `query_id`: right verifies its
+        example, wrong drops it and keeps that SQL from being captured for the question
+        again. Returns the answer's question, or raises KeyError for unknown answers.
+        """
+        verdict = "right" if correct else "wrong"
+        with self._lock:
+            key, question, sql, examples_used, outcome = self._answers[query_id]
+            self.verdicts[verdict] += 1
+            example = self._examples.get(key) if key is not None else None
+            if example is not None and example.sql != sql:
+                example = None  # The question has since been answered with other SQL
+            if not correct:
+                if outcome == "ok":
+                    self.attempts[examples_used]["corrected"] += 1
+                    # Counted once, however often the answer is marked wrong
+                    self._answers[query_id] = (key, question, sql, examples_used, "corrected")
+                if example is not None:
+                    self._remove(key)
+                    self._store("DELETE FROM sql_examples WHERE key = ?", (key,))
+                if key is not None and (key, sql) not in self._rejected:
+                    self._rejected[(key, sql)] = None
+                    self._store(
+                        "INSERT OR REPLACE INTO rejected_sql_examples (key, sql, rejected_at) VALUES (?, ?, ?)",
+                        (key, sql, time.time())
+                    )
+                    while len(self._rejected) > self.max_examples:
+                        old_key, old_sql = self._rejected.popitem(last=False)[0]
+                        self._store(
+                            "DELETE FROM rejected_sql_examples WHERE key = ? AND sql = ?", (old_key, old_sql)
+                        )
+            elif example is not None:
+                example.verified = True
+                self._store("UPDATE sql_examples SET verified = 1 WHERE key = ?", (key,))
+        FEEDBACK.inc(verdict=verdict)
+        return question
+
+    def clear(self, scope=None):
+        with self._lock:
+            keys = [key for key, example in self._examples.items() if scope is None or example.scope == scope]
+            for key in keys:
+                self._remove(key)
+            if scope is None:
+                self._rejected.clear()
+                self._store("DELETE FROM rejected_sql_examples", ())
+                self._store("DELETE FROM sql_examples", ())
+            else:
+                self._store("DELETE FROM sql_examples WHERE scope = ?", (scope,))
+        return len(keys)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            verified = sum(1 for example in self._examples.values() if self._usable(example, now))
+            first_attempts = {}
+            for used, counts in self.attempts.items():
+                attempts = sum(counts[outcome] for outcome in OUTCOMES)
+                first_attempts["with_examples" if used else "without_examples"] = {
+                    "attempts": attempts,
+                    **{outcome: counts[outcome] for outcome in OUTCOMES},
+                    "corrected": counts["corrected"],
+                    # Returned rows and was not marked wrong
+                    "success_rate": round((counts["ok"] - counts["corrected"]) / attempts, 4) if attempts else None,
+                    "mean_seconds": round(counts["seconds"] / attempts, 3) if attempts else None,
+                }
+            return {
+                "examples": len(self._examples),
+                "verified": verified,
+                "pending": len(self._examples) - verified,
+                "databases": len(self._counts),
+                "max_examples": self.max_examples,
+                "lookups": self.lookups,
+                "prompts_with_examples": self.prompts_with_examples,
+                "feedback": dict(self.verdicts),
+                "rejected": len(self._rejected),
+                "evictions": self.evictions,
+                "first_attempts": first_attempts,
+                "persistent": self._db is not None,
+            }
@@ -0,0 +1,119 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow export is optional
+    pa = None
+
+from mysql.connector.constants import FieldType
+
+# Streaming writers for full query exports. Each takes the (description, rows_page)
+# pairs produced by result_helper.iter_result_pages and yields encoded chunks, one
+# per page, so the whole result is never held in memory.
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+BINARY_CHARSET = 63
+
+def _text(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+def to_json_value(value):
+    """JSON-safe form of a MySQL value: exact decimals and ISO dates as strings."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return str(value)  # Keep exact digits
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return _text(value)
+    return str(value)
+
+def export_csv(pages):
+    header_written = False
+    for description, page in pages:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow([d[0] for d in description])
+            header_written = True
+        for row in page:
+            writer.writerow([_text(v) for v in row])
+        yield buffer.getvalue()
+
+def export_ndjson(pages):
+    for description, page in pages:
+        columns = [d[0] for d in description]
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), default=to_json_value) + "\n" for row in page
+        )
+
+def _arrow_type(field):
+    """
+    Maps a cursor.description entry to an Arrow type; DECIMAL stays exact as text,
+    and BINARY, VARBINARY and BLOB columns (binary charset) stay bytes.
+    """
+    type_code = field[1]
+    charset = field[8] if len(field) > 8 else None
+    if type_code in (FieldType.TINY, FieldType.SHORT, FieldType.LONG, FieldType.INT24,
+                     FieldType.LONGLONG, FieldType.YEAR):
+        return pa.int64()
+    if type_code in (FieldType.FLOAT, FieldType.DOUBLE):
+        return pa.float64()
+    if type_code in (FieldType.DATE, FieldType.NEWDATE):
+        return pa.date32()
+    if type_code in (FieldType.DATETIME, FieldType.TIMESTAMP):
+        return pa.timestamp("us")
+    if type_code == FieldType.TIME:
+        return pa.duration("us")
+    if type_code in (FieldType.BLOB, FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB,
+                     FieldType.BIT, FieldType.GEOMETRY, FieldType.STRING, FieldType.VAR_STRING,
+                     FieldType.VARCHAR) and charset == BINARY_CHARSET:
+        return pa.binary()
+    return pa.string()
+
+def _arrow_column(values, arrow_type):
+    if pa.types.is_string(arrow_type):
+        values = [None if v is None else str(_text(v)) for v in values]
+    elif pa.types.is_binary(arrow_type):
+        values = [None if v is None else bytes(v) for v in values]
+    return pa.array(values, type=arrow_type)
+
+def export_arrow(pages):
+    """Arrow IPC stream: the schema, then one record batch per page."""
+    if pa is None:
+        raise RuntimeError("Arrow export requires pyarrow")
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+    for description, page in pages:
+        if writer is None:
+            schema = pa.schema([pa.field(d[0], _arrow_type(d)) for d in description])
+            writer = pa.ipc.new_stream(sink, schema)
+        columns = list(zip(*page)) if page else [()] * len(schema)
+        batch = pa.record_batch(
+            [_arrow_column(list(col), field.type) for col, field in zip(columns, schema)],
+            schema=schema
+        )
+        writer.write_batch(batch)
+        yield _drain(sink)
+    if writer is not None:
+        writer.close()
+        yield _drain(sink)
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
@@ -0,0 +1,272 @@
+import json
+import logging
+import re
+import threading
+
+import sql_helper
+
+logger = logging.getLogger(__name__)
+
+# Pre-execution checks for generated SQL: only a single read-only statement may run,
+# EXPLAIN FORMAT=JSON estimates its cost first, and every query carries a server-side
+# time limit. Queries estimated over the cost limits are refused, capped with a LIMIT
+# or given a tighter time limit, depending on the guard's `action`.
+
+READ_ONLY_STATEMENTS = {"SELECT", "WITH", "SHOW", "DESCRIBE", "DESC", "EXPLAIN"}
+# Reserved words that only appear in statements that write, lock or call out
+WRITE_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "ALTER", "DROP", "RENAME", "GRANT", "REVOKE",
+    "CALL", "LOCK", "UNLOCK", "KILL", "INTO", "OUTFILE", "DUMPFILE", "HANDLER", "LOAD_FILE",
+}
+# Of those, names that are also harmless string functions when followed by "("
+# (LOAD_FILE is only ever a function, and reads files on the server)
+_WRITE_FUNCTIONS = {"INSERT", "REPLACE"}
+ACTIONS = ("limit", "hint", "refuse")
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+class QueryRejectedError(Exception):
+    """The generated SQL was not run: not read-only, or estimated too expensive."""
+
+class GuardedQuery:
+    """
+    Outcome of QueryGuard.check: `sql` is what the result represents (possibly with
+    an added LIMIT), `execute_sql` the same with the server-side time limit, and
+    `notes` what was changed, for the thought process.
+    """
+
+    def __init__(self, sql, execute_sql, cost=None, rows=None, notes=None, rewritten=False):
+        self.sql = sql
+        self.rewritten = rewritten
+        self.execute_sql = execute_sql
+        self.cost = cost
+        self.rows = rows
+        self.notes = notes or []
+
+def validate(sql):
+    """Raises QueryRejectedError unless `sql` is a single read-only statement."""
+    tokens = sql_helper.tokenize(sql)
+    upper = [t.upper() for t in tokens]
+    while upper and upper[-1] == ";":
+        upper.pop()
+    if not upper:
+        raise QueryRejectedError("The query is empty.")
+    if ";" in upper:
+        raise QueryRejectedError("Only a single statement can be run.")
+    first = upper[0] if upper[0] != "(" else next((t for t in upper if t != "("), "")
+    if first not in READ_ONLY_STATEMENTS:
+        raise QueryRejectedError(f"Only read-only queries can be run, not {first}.")
+    for i, tok in enumerate(upper):
+        if tok in WRITE_KEYWORDS:
+            if tok in _WRITE_FUNCTIONS and i + 1 < len(upper) and upper[i + 1] == "(":
+                continue
+            raise QueryRejectedError(f"Only read-only queries can be run ({tok} is not allowed).")
+    return sql
+
+def _top_level_words(sql, nested=False):
+    """
+    Yields (position, WORD) for keywords outside parentheses, strings and comments;
+    with `nested`, also those inside parentheses.
+    """
+    masked = sql_helper.mask_comments_and_strings(sql)
+    depth = 0
+    i = 0
+    while i < len(masked):
+        char = masked[i]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 or nested:
+            match = _WORD_RE.match(masked, i)
+            if match and (i == 0 or not (masked[i - 1].isalnum() or masked[i - 1] in "_$")):
+                yield i, match.group(0).upper()
+                i = match.end()
+                continue
+        i += 1
+
+def has_limit(sql):
+    return any(word == "LIMIT" for _, word in _top_level_words(sql))
+
+def add_limit(sql, rows):
+    """`sql` with LIMIT `rows` appended, unless it already has a top-level LIMIT."""
+    sql = sql_helper.statement_text(sql)
+    if has_limit(sql):
+        return sql
+    return f"{sql} LIMIT {int(rows)}"
+
+def with_timeout(sql, seconds, mariadb=False):
+    """
+    Adds a server-side execution time limit to a SELECT: the MAX_EXECUTION_TIME
+    optimizer hint on MySQL, SET STATEMENT max_statement_time on MariaDB.
+    Other statements (SHOW, DESCRIBE) are returned unchanged.
+    A query whose SELECTs are all parenthesized ("(SELECT 1) UNION (SELECT 2)")
+    gets the hint on its first SELECT, which MySQL applies to the whole statement.
+    Optimizer hints already on that SELECT are kept, after the time limit.
+    """
+    if not seconds:
+        return sql
+    sql = sql_helper.statement_text(sql)
+    if mariadb:
+        return f"SET STATEMENT max_statement_time={float(seconds):g} FOR {sql}"
+    hint = f"MAX_EXECUTION_TIME({int(seconds * 1000)})"
+    # The hint belongs on the outermost SELECT (after any WITH clause)
+    for nested in (False, True):
+        for position, word in _top_level_words(sql, nested):
+            if word == "SELECT":
+                end = position + len("SELECT")
+                # A query block takes one hint comment: join the user's, if there is one
+                existing = re.match(r"\s*/\*\+", sql[end:])
+                if existing:
+                    end += existing.end()
+                    return f"{sql[:end]} {hint}{sql[end:]}"
+                return f"{sql[:end]} /*+ {hint} */{sql[end:]}"
+    return sql
+
+def is_mariadb(conn):
+    try:
+        return "mariadb" in (conn.get_server_info() or "").lower()
+    except Exception:
+        return False
+
+def plan_estimate(plan):
+    """
+    (cost, rows_examined, full_scans) from an EXPLAIN FORMAT=JSON document. cost is
+    None on servers that do not report it (MariaDB); full_scans lists tables read
+    with access_type ALL.
+    """
+    cost = None
+    rows = 0
+    full_scans = []
+
+    def walk(node):
+        nonlocal cost, rows
+        if isinstance(node, dict):
+            if cost is None and isinstance(node.get("cost_info"), dict) and "query_cost" in node["cost_info"]:
+                cost = float(node["cost_info"]["query_cost"])
+            if "table_name" in node:
+                examined = node.get("rows_examined_per_scan", node.get("rows", 0))
+                rows += int(float(examined or 0))
+                if node.get("access_type") == "ALL":
+                    full_scans.append(node["table_name"])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    return cost, rows, full_scans
+
+class QueryGuard:
+    """
+    Checks each generated query before it runs. Over `max_cost` (EXPLAIN query_cost)
+    or `max_rows` (rows examined), `action` decides: "refuse" raises, "limit" adds
+    LIMIT `limit_rows` (when there is none) and the tighter `over_cost_timeout`,
+    "hint" only applies the tighter timeout. Every query gets `timeout` seconds.
+    None disables a limit.
+    """
+
+    def __init__(self, max_cost=1000000, max_rows=5000000, action="limit", limit_rows=1000,
+                 timeout=30, over_cost_timeout=5, explain=True):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.action = action if action in ACTIONS else "limit"
+        self.limit_rows = limit_rows
+        self.timeout = timeout
+        self.over_cost_timeout = over_cost_timeout
+        self.explain = explain
+        self._lock = threading.Lock()
+
+        self.checked = 0
+        self.rejected = 0
+        self.refused = 0
+        self.limited = 0
+        self.hinted = 0
+        self.explain_failures = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def validate(self, sql):
+        try:
+            return validate(sql)
+        except QueryRejectedError:
+            self._count("rejected")
+            raise
+
+    def _explain(self, conn, sql):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN FORMAT=JSON {sql_helper.statement_text(sql)}")
+            row = cursor.fetchone()
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        document = row[0] if row else "{}"
+        if isinstance(document, (bytes, bytearray)):
+            document = document.decode("utf-8", errors="replace")
+        return plan_estimate(json.loads(document))
+
+    def check(self, conn, sql):
+        """Validates `sql`, estimates its cost on `conn` and returns a GuardedQuery."""
+        self.validate(sql)
+        self._count("checked")
+        mariadb = is_mariadb(conn)
+        # What runs is the query as written; only checks look past its comments and strings
+        sql = sql_helper.statement_text(sql)
+        cost, rows, full_scans, notes = None, None, [], []
+        rewritten = False
+
+        is_select = any(word == "SELECT" for _, word in _top_level_words(sql))
+        if self.explain and is_select:
+            try:
+                cost, rows, full_scans = self._explain(conn, sql)
+            except Exception as e:
+                # An unexplainable query still runs, under the time limit
+                self._count("explain_failures")
+                logger.info(f"EXPLAIN skipped: {e}")
+
+        over = []
+        if cost is not None and self.max_cost is not None and cost > self.max_cost:
+            over.append(f"cost {cost:,.0f} > {self.max_cost:,.0f}")
+        if rows is not None and self.max_rows is not None and rows > self.max_rows:
+            over.append(f"~{rows:,} rows examined > {self.max_rows:,}")
+        timeout = self.timeout
+        if over:
+            scans = f"; full scan of {', '.join(full_scans)}" if full_scans else ""
+            reason = f"{' and '.join(over)}{scans}"
+            if self.action == "refuse":
+                self._count("refused")
+                raise QueryRejectedError(f"The query looks too expensive to run ({reason}).")
+            if self.action == "limit" and not has_limit(sql):
+                sql = add_limit(sql, self.limit_rows)
+                rewritten = True
+                self._count("limited")
+                notes.append(f"Query looks expensive ({reason}); limited to {self.limit_rows} rows.")
+            else:
+                notes.append(f"Query looks expensive ({reason}).")
+            if self.over_cost_timeout and (not timeout or self.over_cost_timeout < timeout):
+                timeout = self.over_cost_timeout
+                self._count("hinted")
+                notes.append(f"Running it with a {timeout:g}s time limit.")
+        elif cost is not None:
+            notes.append(f"Estimated cost {cost:,.0f} (~{rows:,} rows examined).")
+
+        return GuardedQuery(sql, with_timeout(sql, timeout, mariadb), cost, rows, notes, rewritten)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "refused_over_cost": self.refused,
+                "limited": self.limited,
+                "time_limited": self.hinted,
+                "explain_failures": self.explain_failures,
+                "action": self.action,
+                "max_cost": self.max_cost,
+                "max_rows": self.max_rows,
+                "timeout": self.timeout,
+            }
@@ -0,0 +1,171 @@
+"""
+Load test for the chat endpoints.
+
+    python loadtest.py --url http://127.0.0.1:5000 --session-id ID --requests 500 --concurrency 100
+    python loadtest.py --simulate                  # in-process, fake Gemini and MySQL
+    python loadtest.py --simulate --target flask   # same, through the threaded Flask views
+
+--url drives a running server (connect a database first and pass the session_id
+from the /api/connect response; the questions cost real Gemini calls). --simulate
+serves asgi.application in-process with a fake Gemini client and connection pool
+that only sleep, so it measures how many slow requests the serving layer can keep
+in flight. Reports throughput and latency percentiles.
+"""
+import argparse
+import asyncio
+import contextlib
+import statistics
+import time
+
+import httpx
+
+import context_cache_helper
+
+QUESTIONS = [
+    "How many customers do we have?",
+    "Top 10 customers by total order amount",
+    "Which products are out of stock?",
+    "Average salary per department",
+    "Total payments by payment method",
+    "Employees hired this year",
+]
+
+class _FakeReply:
+    def __init__(self, text):
+        self.text = text
+
+class _FakeChat:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def send_message(self, message, config=None):
+        await asyncio.sleep(self.latency)
+        if config is not None:  # Structured output (JSON mode)
+            return _FakeReply('{"intent": "query", "sql": "SELECT id, name FROM customers", "tables": ["customers"]}')
+        return _FakeReply("```sql\nSELECT id, name FROM customers\n```")
+
+    async def send_message_stream(self, message, config=None):
+        latency = self.latency
+
+        async def chunks():
+            for part in ("There are ", "3 customers."):
+                await asyncio.sleep(latency / 2)
+                yield _FakeReply(part)
+        return chunks()
+
+class _FakeClient:
+    """Stands in for genai.Client: client.aio.chats.create(model=...) -> chat, plus a local context cache."""
+
+    def __init__(self, latency):
+        chats = type("Chats", (), {"create": lambda _self, model, config=None: _FakeChat(latency)})()
+        self.aio = type("Aio", (), {"chats": chats, "caches": context_cache_helper.LocalCacheService()})()
+
+class _FakeCursor:
+    def __init__(self, latency):
+        self.latency = latency
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql):
+        time.sleep(self.latency)  # Blocking, like mysql-connector
+        self.description = [("id", 3), ("name", 253)]
+        self._rows = [(1, "Ada"), (2, "Grace"), (3, "Linus")]
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+class _FakePool:
+    def __init__(self, latency):
+        self.latency = latency
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield type("Conn", (), {"cursor": lambda _self, buffered=True: _FakeCursor(self.latency)})()
+
+    def discard_on_release(self, conn):
+        pass
+
+    def close(self):
+        pass
+
+def _simulated_app(target, llm_latency, db_latency):
+    import ai_helper
+    import app as server
+    import asgi
+    import async_helper
+    import schema_helper
+
+    ai_helper.client = _FakeClient(llm_latency)
+    ai_helper.sql_cache = None  # Every request does the full round trip
+    ai_helper.result_cache = None
+    ai_helper.rate_limiter = None  # Measure the serving layer, not the quota
+    ai_helper.query_guard = None  # The fake cursor cannot EXPLAIN
+    ai_helper.coalescer = None  # Identical questions would share one run
+    model = schema_helper.SchemaModel("shop", {
+        "customers": {"columns": [{"name": "id", "type": "int"}, {"name": "name", "type": "varchar(100)"}],
+                      "primary_key": ["id"], "foreign_keys": []},
+    })
+    params = {"host": "simulated", "port": 3306, "user": "loadtest", "password": "", "database": "shop"}
+    session = server.sessions.create(params, model, _FakePool(db_latency))
+    async_helper.set_pipeline_loop(asyncio.get_running_loop())
+    return (asgi.application if target == "asgi" else asgi.wsgi_app), session.id
+
+async def _run(args):
+    if args.simulate:
+        app, session_id = _simulated_app(args.target, args.llm_latency, args.db_latency)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest",
+                                   headers={"X-Session-ID": session_id}, timeout=args.timeout)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, headers={"X-Session-ID": args.session_id or ""},
+                                   timeout=args.timeout)
+
+    latencies, errors, shed = [], 0, 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        nonlocal errors, shed
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/api/chat", json={"query": QUESTIONS[i % len(QUESTIONS)]})
+                ok = response.status_code == 200 and response.json().get("success")
+                shed += response.status_code == 503
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    async with client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    print(f"requests:    {args.requests} ({errors} failed, {shed} of them shed with 503), concurrency {args.concurrency}")
+    print(f"elapsed:     {elapsed:.2f}s")
+    print(f"throughput:  {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        print(f"latency:     p50 {q[49] * 1000:.0f} ms, p95 {q[94] * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--session-id", help="session_id returned by /api/connect (for --url)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--simulate", action="store_true", help="serve in-process with fake Gemini and MySQL")
+    parser.add_argument("--target", choices=["asgi", "flask"], default="asgi",
+                        help="with --simulate: native async views or the threaded Flask views")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake Gemini call")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="seconds per fake query")
+    asyncio.run(_run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
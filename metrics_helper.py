@@ -0,0 +1,289 @@
+import logging
+import threading
+import time
+import uuid
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Only needed for OTEL_TRACES_ENABLED
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+# Per-stage instrumentation. Each pipeline stage (connect, introspect, schema,
+# generate, execute, fetch, synthesize) runs inside a Span that records its duration
+# and attributes (rows, prompt/response tokens, cache hits). Spans of one question
+# are collected in a Trace, returned with the answer and optionally exported to
+# OpenTelemetry. Every span also feeds the process-wide Prometheus metrics served at
+# /metrics (REGISTRY.render()).
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', '+Inf')])} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {entry[-1]}")
+        return lines
+
+class Gauge:
+    """Read at scrape time from `read()`: a number, or {label value(s): number}."""
+
+    def __init__(self, name, help_text, read, labels=()):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} unavailable: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {float(value or 0):g}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read, labels=()):
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, read, labels)  # Re-registering replaces the reader
+            return self._metrics[name]
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "talk2db_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage", "outcome")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "talk2db_request_duration_seconds", "End-to-end time per question.", ("outcome",)
+)
+ROWS = REGISTRY.counter("talk2db_rows_total", "Rows read from the database, by stage.", ("stage",))
+TOKENS = REGISTRY.counter(
+    "talk2db_llm_tokens_total", "Tokens reported by Gemini, by model and kind (prompt/response/cached).",
+    ("model", "kind")
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "talk2db_cache_lookups_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result")
+)
+
+_tracer = None
+
+def init_tracing(enabled=False, service_name="talk2db"):
+    """Exports finished traces through OpenTelemetry when `enabled` and the package is installed."""
+    global _tracer
+    _tracer = None
+    if not enabled:
+        return
+    if otel_trace is None:
+        logger.warning("OTEL_TRACES_ENABLED is set but opentelemetry is not installed; traces stay local.")
+        return
+    try:
+        # With the SDK and OTLP exporter installed, export to OTEL_EXPORTER_OTLP_ENDPOINT;
+        # otherwise use whatever provider is configured (e.g. opentelemetry-instrument)
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        otel_trace.set_tracer_provider(provider)
+    except ImportError:
+        pass
+    _tracer = otel_trace.get_tracer("talk2db")
+
+def usage_counts(response):
+    """(prompt_tokens, response_tokens, cached_tokens) from a Gemini response or final stream chunk."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, None
+    return (getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None),
+            getattr(usage, "cached_content_token_count", None))
+
+def record_tokens(model, response):
+    prompt, reply, cached = usage_counts(response)
+    for kind, count in (("prompt", prompt), ("response", reply), ("cached", cached)):
+        if count:
+            TOKENS.inc(count, model=model, kind=kind)
+    return prompt, reply
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+class Span:
+    """Times one stage. Use as a context manager; set() adds attributes while it runs."""
+
+    def __init__(self, name, trace=None, **attributes):
+        self.name = name
+        self.trace = trace
+        self.attributes = dict(attributes)
+        self.started_at = None
+        self.duration = None
+        self.outcome = None
+        self._start = None
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+        return self
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc_type is None:
+            self.outcome = self.attributes.pop("outcome", "ok")
+        elif exc_type in (GeneratorExit,) or exc_type.__name__ == "CancelledError":
+            self.outcome = "cancelled"
+        else:
+            self.outcome = "error"
+            self.attributes.setdefault("error", str(exc)[:200])
+        STAGE_SECONDS.observe(self.duration, stage=self.name, outcome=self.outcome)
+        if isinstance(self.attributes.get("rows"), int):
+            ROWS.inc(self.attributes["rows"], stage=self.name)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+        return False
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "start_ms": round((self.started_at - origin) * 1000, 1),
+            "duration_ms": round((self.duration or 0) * 1000, 1),
+            "outcome": self.outcome,
+            "attributes": self.attributes,
+        }
+
+class Trace:
+    """The spans of one question, in the order they finished."""
+
+    def __init__(self, name="chat", **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.outcome = None
+
+    def span(self, name, **attributes):
+        return Span(name, self, **attributes)
+
+    def finish(self, outcome="ok"):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        self.outcome = outcome
+        REQUEST_SECONDS.observe(self.duration, outcome=outcome)
+        if _tracer is not None:
+            try:
+                self._export()
+            except Exception as e:
+                logger.warning(f"Trace export failed: {e}")
+
+    def _export(self):
+        ns = lambda seconds: int(seconds * 1e9)
+        root = _tracer.start_span(self.name, start_time=ns(self.started_at),
+                                  attributes={"talk2db.trace_id": self.trace_id, "talk2db.outcome": self.outcome})
+        context = otel_trace.set_span_in_context(root)
+        for span in self.spans:
+            attributes = {f"talk2db.{k}": v if isinstance(v, (bool, int, float, str)) else str(v)
+                          for k, v in span.attributes.items()}
+            attributes["talk2db.outcome"] = span.outcome
+            child = _tracer.start_span(span.name, context=context, start_time=ns(span.started_at),
+                                       attributes=attributes)
+            child.end(end_time=ns(span.started_at + (span.duration or 0)))
+        root.end(end_time=ns(self.started_at + self.duration))
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": round((self.duration or time.perf_counter() - self._start) * 1000, 1),
+            "spans": [span.to_dict(self.started_at) for span in self.spans],
+        }
+
+def span(name, **attributes):
+    """A span outside any question's trace (connect, introspect); still recorded in the metrics."""
+    return Span(name, None, **attributes)
@@ -0,0 +1,340 @@
+import asyncio
+import bisect
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Model dispatch for Gemini calls: per-model latency histograms, circuit breakers
+# that skip rate-limited models, and hedged requests - when the preferred model has
+# not answered by its usual latency (a percentile of its histogram), the next model
+# is started too; the first good answer wins and the other request is cancelled.
+
+# Histogram bucket upper bounds in seconds, roughly 25% apart from 50 ms to 2 min
+BUCKETS = [round(0.05 * 1.25 ** i, 3) for i in range(36)]
+# Counts are halved when a histogram reaches this many samples, so it tracks recent latency
+DECAY_AT = 2000
+
+def is_rate_limit_error(error):
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+def retry_delay(error):
+    """Seconds the provider asked us to wait (from 'retryDelay': '12s' / 'retry in 12.3s'), or None."""
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s|retry in (\d+(?:\.\d+)?)\s*s", str(error))
+    if not match:
+        return None
+    return float(match.group(1) or match.group(2))
+
+class LatencyHistogram:
+    """Bucketed latency distribution with exponential decay."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last bucket: slower than BUCKETS[-1]
+        self.total = 0
+        self.samples = 0  # lifetime count, for stats
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.samples += 1
+            if self.total >= DECAY_AT:
+                self.counts = [c // 2 for c in self.counts]
+                self.total = sum(self.counts)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0-100), or None if empty."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = self.total * p / 100.0
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1] * 1.25
+        return BUCKETS[-1]
+
+    def snapshot(self):
+        return {
+            "samples": self.samples,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. A rate-limit error (or `failure_threshold` consecutive
+    failures) opens it for `cooldown` seconds, or the provider's retry delay. After
+    that one probe call is let through (half-open); success closes it, failure
+    reopens it with twice the cooldown, up to `max_cooldown`.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, max_cooldown=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.open_until:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allow(self):
+        """False while open; True when closed; "probe" for the one call let through half-open."""
+        with self._lock:
+            if not self.open_until:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return "probe"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = False
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            rate_limited = is_rate_limit_error(error)
+            if not (rate_limited or self.failures >= self.failure_threshold or self.probing):
+                return
+            if self.probing:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            wait = (retry_delay(error) if rate_limited else None) or self.cooldown
+            self.open_until = time.monotonic() + wait
+            self.probing = False
+            self.trips += 1
+
+    def release_probe(self):
+        """A probe call was cancelled before it finished; let the next caller probe."""
+        with self._lock:
+            self.probing = False
+
+    def retry_in(self):
+        return max(0.0, self.open_until - time.monotonic()) if self.open_until else 0.0
+
+class ModelsUnavailableError(Exception):
+    """Every model is rate-limited or failing; `retry_after` is when the first one reopens."""
+
+    shed = True
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Dispatched:
+    """Outcome of a dispatch: the winning model, its value and notes for the thought process."""
+
+    def __init__(self, model, value, notes):
+        self.model = model
+        self.value = value
+        self.notes = notes
+
+class ModelDispatcher:
+    """
+    Sends each call to the first available model in `models` (preference order),
+    hedging to the next one after `hedge_percentile` of the model's observed latency
+    (clamped to [hedge_min_delay, hedge_max_delay]; `hedge_default_delay` until
+    `min_samples` calls have been measured). hedge_percentile=None disables hedging;
+    a failed call still falls through to the next model.
+    """
+
+    def __init__(self, models, hedge_percentile=95, hedge_min_delay=0.5, hedge_max_delay=15.0,
+                 hedge_default_delay=4.0, min_samples=20, failure_threshold=3, cooldown=30.0):
+        self.models = list(dict.fromkeys(models))  # Drop duplicates, keep order
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.min_samples = min_samples
+        self.breakers = {m: CircuitBreaker(failure_threshold, cooldown) for m in self.models}
+        self.latency = {}  # (model, kind) -> LatencyHistogram
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def histogram(self, model, kind):
+        with self._lock:
+            return self.latency.setdefault((model, kind), LatencyHistogram())
+
+    def hedge_delay(self, model, kind):
+        if self.hedge_percentile is None:
+            return None
+        histogram = self.histogram(model, kind)
+        if histogram.samples < self.min_samples:
+            return self.hedge_default_delay
+        delay = histogram.percentile(self.hedge_percentile)
+        return min(max(delay, self.hedge_min_delay), self.hedge_max_delay)
+
+    def record_failure(self, model, error):
+        """For failures the caller sees after dispatch (e.g. a stream breaking mid-way)."""
+        self.breakers[model].record_failure(error)
+
+    async def call(self, start):
+        """
+        Runs `await start(model)` with hedging and fallback; returns Dispatched(model, value, notes).
+        Latency is measured to completion.
+        """
+        return await self._dispatch(start, "call")
+
+    async def stream(self, start):
+        """
+        Like call(), for streaming responses: `await start(model)` returns an async iterator,
+        and the race is to its first chunk. Returns Dispatched(model, (first_chunk, iterator), notes).
+        """
+        async def first_chunk(model):
+            iterator = await start(model)
+            try:
+                return await iterator.__anext__(), iterator
+            except StopAsyncIteration:
+                return None, iterator
+            except BaseException:
+                await close_iterator(iterator)
+                raise
+        return await self._dispatch(first_chunk, "stream")
+
+    async def _dispatch(self, start, kind):
+        with self._lock:
+            self.calls += 1
+        notes = []
+        candidates = []
+        probes = set()  # Models whose half-open probe this call holds
+        for model in self.models:
+            allowed = self.breakers[model].allow()
+            if allowed:
+                candidates.append(model)
+                if allowed == "probe":
+                    probes.add(model)
+            elif not candidates:  # Only worth mentioning when a preferred model is skipped
+                notes.append(f"Skipping {model} (rate-limited, retry in {self.breakers[model].retry_in():.0f}s).")
+        if not candidates:
+            retry_after = min(b.retry_in() for b in self.breakers.values())
+            raise ModelsUnavailableError(
+                f"All models are rate-limited; retry in {retry_after:.0f}s", retry_after=retry_after
+            )
+
+        pending = {}  # task -> (model, started_at)
+        last_error = None
+        first_model = candidates[0]
+        hedged = False
+
+        def launch(model):
+            task = asyncio.ensure_future(start(model))
+            pending[task] = (model, time.monotonic())
+
+        launch(candidates.pop(0))
+        try:
+            while pending:
+                # Hedge on the most recently started request's usual latency
+                newest_model, newest_start = max(pending.values(), key=lambda v: v[1])
+                timeout = None
+                if candidates:
+                    delay = self.hedge_delay(newest_model, kind)
+                    if delay is not None:
+                        timeout = max(0.0, newest_start + delay - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    model = candidates.pop(0)
+                    hedged = True
+                    with self._lock:
+                        self.hedges += 1
+                    notes.append(f"{newest_model} is slower than usual; also asking {model}.")
+                    launch(model)
+                    continue
+
+                for task in done:
+                    model, started = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self.histogram(model, kind).record(time.monotonic() - started)
+                        self.breakers[model].record_success()
+                        with self._lock:
+                            if model != self.models[0]:
+                                self.fallbacks += 1
+                            if hedged and model != first_model:
+                                self.hedge_wins += 1
+                        return Dispatched(model, task.result(), notes)
+                    last_error = error
+                    if getattr(error, "shed", False):
+                        # Turned away by our own rate limiter; the model itself is fine
+                        notes.append(f"{model} is at its request quota; trying the next model.")
+                        if model in probes:
+                            # The probe never reached the model; let a later call make it
+                            self.breakers[model].release_probe()
+                        if candidates and not pending:
+                            launch(candidates.pop(0))
+                        continue
+                    self.breakers[model].record_failure(error)
+                    logger.warning(f"Model {model} failed: {error}")
+                    if is_rate_limit_error(error):
+                        notes.append(f"Rate limit hit for {model}. Switching backup model...")
+                    else:
+                        notes.append(f"{model} failed; trying the next model.")
+                    if candidates and not pending:
+                        launch(candidates.pop(0))
+            raise last_error
+        finally:
+            for task, (model, _) in pending.items():
+                # Losers of the race (or leftovers after an error) are cancelled
+                task.cancel()
+                if model in probes:
+                    self.breakers[model].release_probe()
+            for model in candidates:
+                if model in probes:  # Never started
+                    self.breakers[model].release_probe()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                for task in pending:
+                    if not task.cancelled() and task.exception() is None and kind == "stream":
+                        await close_iterator(task.result()[1])
+
+    def stats(self):
+        models = {}
+        for model in self.models:
+            breaker = self.breakers[model]
+            models[model] = {
+                "breaker": breaker.state,
+                "retry_in": round(breaker.retry_in(), 1),
+                "trips": breaker.trips,
+                "latency": {kind: h.snapshot() for (m, kind), h in list(self.latency.items()) if m == model},
+            }
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "fallbacks": self.fallbacks,
+                "hedge_percentile": self.hedge_percentile,
+                "models": models,
+            }
+
+async def close_iterator(iterator):
+    """Closes an async iterator (e.g. an abandoned response stream), ignoring errors."""
+    close = getattr(iterator, "aclose", None)
+    if close:
+        try:
+            await close()
+        except Exception:
+            pass
@@ -0,0 +1,321 @@
+import datetime
+import decimal
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics_helper
+import result_helper
+import schema_helper
+
+logger = logging.getLogger(__name__)
+
+# Column value profiles that ground SQL generation. A background thread samples each
+# table of a connected database and keeps a compact profile per column: the values
+# of low-cardinality columns, ranges of numbers and dates, null rates, and foreign
+# keys inferred from column names and checked against the data. Before SQL is
+# generated, the profile lines relevant to the question are added to the prompt, so
+# the model filters on 'shipped' rather than guessing 'Shipped' or 'SHIPPED'.
+# Profiles are keyed by the schema fingerprint, so a schema change re-profiles.
+
+# Columns never sampled: their values should not reach a prompt
+SENSITIVE_COLUMNS = re.compile(
+    r"pass(word|wd)?|secret|token|hash|salt|ssn|social_security|credit_?card|card_?number|cvv|iban|api_?key",
+    re.IGNORECASE
+)
+# Long or binary types are not worth sampling
+_SKIPPED_TYPES = {
+    "tinytext", "text", "mediumtext", "longtext", "tinyblob", "blob", "mediumblob", "longblob",
+    "binary", "varbinary", "json", "geometry", "point", "linestring", "polygon", "bit",
+}
+_RANGE_TYPES = {
+    "tinyint", "smallint", "mediumint", "int", "integer", "bigint", "decimal", "numeric", "float", "double",
+    "real", "date", "datetime", "timestamp", "time", "year",
+}
+# Distinct sample values checked against a candidate referenced table
+REFERENCE_PROBE_VALUES = 50
+# Share of those values that must exist there to infer a foreign key
+REFERENCE_MATCH = 0.9
+# Consecutive table failures that end a profiling run (the pool has probably gone)
+MAX_FAILURES = 3
+RETRY_SECONDS = 60
+VALUE_CHARS = 40
+
+PROFILED_TABLES = metrics_helper.REGISTRY.counter(
+    "talk2db_profiled_tables_total", "Tables sampled by the column profiler.", ("outcome",)
+)
+
+def _base_type(column_type):
+    return re.match(r"[a-z]*", (column_type or "").lower()).group(0)
+
+def _kind(column):
+    """"range" (numbers, dates), "text" (short strings, enums) or None (not profiled)."""
+    base = _base_type(column["type"])
+    if base in _SKIPPED_TYPES or SENSITIVE_COLUMNS.search(column["name"]):
+        return None
+    return "range" if base in _RANGE_TYPES else "text"
+
+def _short(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time, datetime.timedelta, decimal.Decimal)):
+        value = str(value)
+    if isinstance(value, str) and len(value) > VALUE_CHARS:
+        value = value[:VALUE_CHARS - 3] + "..."
+    return value
+
+def reference_candidates(table, column, schema_model):
+    """Tables `column` of `table` may point at by name (customer_id -> customers), minus declared foreign keys."""
+    declared = {fk["column"] for fk in schema_model.tables[table].get("foreign_keys", [])}
+    match = re.match(r"(.+?)_?id$", column, re.IGNORECASE)
+    if column in declared or not match or column in schema_model.tables[table].get("primary_key", []):
+        return []
+    base = match.group(1).lower().rstrip("_")
+    names = {base, base + "s", base + "es"}
+    if base.endswith("y"):
+        names.add(base[:-1] + "ies")
+    found = []
+    for name, other in schema_model.tables.items():
+        if name.lower() in names and len(other.get("primary_key", [])) == 1:
+            found.append((name, other["primary_key"][0]))
+    return found
+
+def profile_table(conn, table, schema_model, sample_rows=5000, max_values=20):
+    """
+    Profile of `table` from its first `sample_rows` rows read over `conn`:
+    {"sampled_rows", "complete", "columns": {name: {"kind", "nulls", "distinct",
+    "values" | "min"/"max", "references"}}}. "complete" is True when the sample
+    covered the whole table, so listed values are all the values there are.
+    """
+    columns = [c for c in schema_model.tables[table]["columns"] if _kind(c)]
+    if not columns:
+        return {"sampled_rows": 0, "complete": True, "columns": {}}
+    stats = [result_helper.ColumnStats(c["name"]) for c in columns]
+    candidates = {i: reference_candidates(table, c["name"], schema_model) for i, c in enumerate(columns)}
+    probes = {i: set() for i, found in candidates.items() if found}
+    select = ", ".join(f"`{c['name']}`" for c in columns)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {select} FROM `{table}` LIMIT {int(sample_rows)}")
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            rows += len(batch)
+            for row in batch:
+                for stat, value in zip(stats, row):
+                    stat.add(value)
+                for i, values in probes.items():
+                    if row[i] is not None and len(values) < REFERENCE_PROBE_VALUES:
+                        values.add(row[i])
+
+        references = {}
+        for i, values in probes.items():
+            for target, key in candidates[i]:
+                if not values:
+                    break
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM `{target}` WHERE `{key}` IN ({', '.join(['%s'] * len(values))})",
+                    tuple(values)
+                )
+                found = cursor.fetchone()[0]
+                if found >= REFERENCE_MATCH * len(values):
+                    references[i] = f"{target}.{key}"
+                    break
+    finally:
+        cursor.close()
+
+    primary_key = set(schema_model.tables[table].get("primary_key", []))
+    declared = {fk["column"] for fk in schema_model.tables[table].get("foreign_keys", [])}
+    profiles = {}
+    for i, (column, stat) in enumerate(zip(columns, stats)):
+        kind = _kind(column)
+        distinct = None if stat.high_cardinality else len(stat.values)
+        entry = {"kind": kind, "nulls": round(stat.nulls / stat.count, 3) if stat.count else 0.0, "distinct": distinct}
+        if i in references:
+            entry["references"] = references[i]
+        is_key = column["name"] in primary_key or column["name"] in declared or i in references
+        if not is_key:
+            # Few distinct values (in plenty of rows, for numbers): a code or category, worth listing
+            repeats = distinct and stat.count - stat.nulls >= 2 * distinct
+            if distinct and distinct <= max_values and (kind == "text" or (repeats and distinct <= 5)):
+                entry["values"] = [_short(v) for v, _ in stat.values.most_common()]
+            elif kind == "range" and stat.min is not None:
+                entry["min"], entry["max"] = _short(stat.min), _short(stat.max)
+        profiles[column["name"]] = entry
+    return {"sampled_rows": rows, "complete": rows < sample_rows, "columns": profiles}
+
+def column_hint(table, name, entry, complete=True):
+    """One prompt line for a column profile, or None when there is nothing to say."""
+    facts = []
+    if "values" in entry:
+        values = ", ".join(repr(v) if entry["kind"] == "text" else str(v) for v in entry["values"])
+        facts.append(values if complete else f"e.g. {values}")
+    elif "min" in entry:
+        facts.append(f"{entry['min']} to {entry['max']}")
+    if entry.get("references"):
+        facts.append(f"joins {entry['references']}")
+    if entry["nulls"] >= 0.05:
+        facts.append(f"{entry['nulls']:.0%} null")
+    return f"{table}.{name}: {'; '.join(facts)}" if facts else None
+
+class Profiler:
+    """
+    Column profiles by database (session scope + schema fingerprint), built on a
+    background thread and kept within `max_bytes` (least recently used databases
+    are dropped first). ensure() queues profiling; hints_for() renders the lines
+    for a question, most relevant first, within `prompt_tokens`.
+    """
+
+    def __init__(self, sample_rows=5000, max_values=20, ttl=86400, max_bytes=32 * 1024 * 1024, prompt_tokens=300):
+        self.sample_rows = sample_rows
+        self.max_values = max_values
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prompt_tokens = prompt_tokens
+        self._profiles = OrderedDict()  # (scope, fingerprint) -> {"tables", "sizes", "bytes", "profiled_at"}
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.tables_profiled = 0
+        self.failures = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(session):
+        return session.scope, session.schema_model.fingerprint
+
+    def ensure(self, session):
+        """Queues profiling of `session`'s database unless its profile is fresh or already queued."""
+        key = self._key(session)
+        with self._lock:
+            entry = self._profiles.get(key)
+            if entry is not None:
+                self._profiles.move_to_end(key)
+            if key in self._pending or (entry is not None and time.monotonic() - entry["profiled_at"] < self.ttl):
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="column-profiler", daemon=True)
+                self._thread.start()
+        self._queue.put((key, session.pool, session.schema_model))
+
+    def _run(self):
+        while True:
+            key, pool, schema_model = self._queue.get()
+            try:
+                self._profile(key, pool, schema_model)
+            except Exception as e:
+                logger.error(f"Column profiling failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _profile(self, key, pool, schema_model):
+        with self._lock:
+            # A schema change makes the old fingerprint's profiles obsolete
+            for other in [k for k in self._profiles if k[0] == key[0] and k != key]:
+                del self._profiles[other]
+            previous = self._profiles.get(key)
+            entry = {"tables": dict(previous["tables"]) if previous else {},
+                     "sizes": dict(previous["sizes"]) if previous else {},
+                     "bytes": previous["bytes"] if previous else 0, "profiled_at": time.monotonic()}
+            self._profiles[key] = entry
+        started = time.perf_counter()
+        failures = 0
+        for table in schema_model.table_names():
+            try:
+                with pool.connection() as conn:
+                    try:
+                        profile = profile_table(conn, table, schema_model, self.sample_rows, self.max_values)
+                    except Exception:
+                        # Sampled rows may still be on the wire
+                        pool.discard_on_release(conn)
+                        raise
+            except Exception as e:
+                failures += 1
+                self.failures += 1
+                PROFILED_TABLES.inc(outcome="error")
+                logger.warning(f"Could not profile {table}: {e}")
+                if failures >= MAX_FAILURES:
+                    # Try the rest again soon rather than after the full TTL
+                    entry["profiled_at"] = time.monotonic() - self.ttl + RETRY_SECONDS
+                    break
+                continue
+            failures = 0
+            size = len(json.dumps(profile, default=str))
+            with self._lock:
+                entry["tables"][table] = profile
+                entry["sizes"][table] = size
+                entry["bytes"] = sum(entry["sizes"].values())
+                self.tables_profiled += 1
+                self._enforce_limit(key)
+                full = entry["bytes"] > self.max_bytes
+                if full:
+                    # This database alone is over the limit: keep the tables that fit
+                    del entry["tables"][table]
+                    entry["bytes"] -= entry["sizes"].pop(table)
+            PROFILED_TABLES.inc(outcome="ok")
+            if full:
+                logger.warning(f"Column profiles of {key[0]} exceed the memory limit; stopped profiling.")
+                break
+        logger.info(f"Profiled {len(entry['tables'])} tables of {key[0]} in {time.perf_counter() - started:.1f}s")
+
+    def _enforce_limit(self, keep):
+        """Drops the least recently used databases other than `keep` until the total fits."""
+        total = sum(entry["bytes"] for entry in self._profiles.values())
+        for victim in [k for k in self._profiles if k != keep]:
+            if total <= self.max_bytes:
+                break
+            total -= self._profiles.pop(victim)["bytes"]
+            self.evictions += 1
+
+    def hints_for(self, session, question, tables):
+        """Prompt text with the profile lines of `tables`, those matching the question first; "" if none."""
+        with self._lock:
+            entry = self._profiles.get(self._key(session))
+            profiles = {t: entry["tables"][t] for t in tables if t in entry["tables"]} if entry else {}
+        if not profiles:
+            return ""
+        terms = set(schema_helper.tokenize(question))
+        lines = []
+        for order, table in enumerate(tables):
+            profile = profiles.get(table)
+            if not profile:
+                continue
+            for name, column in profile["columns"].items():
+                line = column_hint(table, name, column, profile["complete"])
+                if line:
+                    # Named in the question (column, table or one of the values): most useful
+                    words = set(schema_helper.tokenize(f"{table} {name} {' '.join(map(str, column.get('values', [])))}"))
+                    lines.append((-len(terms & words), order, line))
+        lines.sort(key=lambda item: item[:2])
+
+        header = "Column values seen in the data (use these exact spellings and formats in filters):"
+        used = schema_helper.estimate_tokens(header)
+        chosen = []
+        for _, _, line in lines:
+            cost = schema_helper.estimate_tokens(line)
+            if used + cost > self.prompt_tokens:
+                continue
+            chosen.append(line)
+            used += cost
+        return "\n".join([header] + chosen) if chosen else ""
+
+    def stats(self):
+        with self._lock:
+            return {
+                "databases": len(self._profiles),
+                "tables": sum(len(entry["tables"]) for entry in self._profiles.values()),
+                "bytes": sum(entry["bytes"] for entry in self._profiles.values()),
+                "max_bytes": self.max_bytes,
+                "queued": len(self._pending),
+                "tables_profiled": self.tables_profiled,
+                "failures": self.failures,
+                "evictions": self.evictions,
+            }
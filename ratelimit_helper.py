@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Client-side quota scheduling for Gemini calls. Each model gets a requests-per-minute
+# and a tokens-per-minute token bucket; callers wait in a priority queue until both
+# have room, so bursts are smoothed out locally instead of bouncing off a 429. When
+# the queue is full or the expected wait is too long the request is shed right away
+# with OverloadedError, which the endpoints turn into a 503 with Retry-After.
+# All waiting happens on the pipeline event loop (see async_helper).
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+class OverloadedError(Exception):
+    """Shed locally before reaching the provider; `retry_after` is a hint in seconds."""
+
+    shed = True  # model_helper: not the model's fault, don't trip its breaker
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()  # Admission checks read buckets from request threads
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount):
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount):
+        """Removes `amount` tokens; may go negative (debt) when settling actual usage."""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+class ModelLimiter:
+    """
+    RPM/TPM buckets and the wait queue for one model. Buckets refill at `headroom`
+    times the quota and hold at most `burst` of a minute's quota, so we stay a
+    little under what the provider enforces.
+    """
+
+    def __init__(self, rpm, tpm, headroom=0.9, burst=0.25, max_queue=100, max_wait=10.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm * headroom / 60.0, max(1.0, rpm * burst))
+        self.tokens = TokenBucket(tpm * headroom / 60.0, max(1.0, tpm * burst))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._queue = []  # heap of [priority, seq, tokens]
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+        self.admitted = 0
+        self.shed = 0
+        self.wait_time = 0.0
+
+    def estimated_wait(self, tokens, priority=1):
+        """Seconds a new request would wait behind the queue entries it cannot overtake."""
+        ahead = [entry for entry in self._queue if entry[0] <= priority]
+        return max(
+            self.requests.time_until(1 + len(ahead)),
+            self.tokens.time_until(tokens + sum(entry[2] for entry in ahead)),
+        )
+
+    async def acquire(self, tokens, priority=1):
+        tokens = min(tokens, self.tokens.capacity)  # A huge prompt must still fit eventually
+        wait = self.estimated_wait(tokens, priority)
+        if len(self._queue) >= self.max_queue or wait > self.max_wait:
+            self.shed += 1
+            raise OverloadedError(f"Request queue for this model is full (~{wait:.0f}s wait)", retry_after=wait)
+
+        started = time.monotonic()
+        entry = [priority, next(self._seq), tokens]
+        # Join the queue before the first await so the next caller's estimate counts us
+        heapq.heappush(self._queue, entry)
+        try:
+            async with self._cond:
+                while True:
+                    timeout = None
+                    if self._queue[0] is entry:
+                        timeout = max(self.requests.time_until(1), self.tokens.time_until(tokens))
+                        if timeout <= 0:
+                            heapq.heappop(self._queue)
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.admitted += 1
+                            self.wait_time += time.monotonic() - started
+                            self._cond.notify_all()  # Next in line becomes the head
+                            return
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+        except BaseException:
+            # Cancelled (e.g. a hedge lost the race) or failed: leave the queue
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                if self._cond.locked():
+                    self._cond.notify_all()
+                else:
+                    asyncio.ensure_future(self._wake_waiters())
+            raise
+
+    async def _wake_waiters(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def settle(self, estimated, actual):
+        """Charges the difference once the provider reports real token usage."""
+        if actual is not None:
+            self.tokens.take(actual - estimated)
+
+    def stats(self):
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_wait": round(self.wait_time / self.admitted, 3) if self.admitted else 0.0,
+            "requests_available": round(self.requests.tokens, 1),
+            "tokens_available": int(self.tokens.tokens),
+        }
+
+class RateLimiter:
+    """
+    Per-model limiters. `quotas` maps model -> {"rpm": n, "tpm": n}; models not
+    listed get `default_rpm` / `default_tpm`.
+    """
+
+    def __init__(self, quotas=None, default_rpm=15, default_tpm=1000000, headroom=0.9,
+                 max_queue=100, max_wait=10.0):
+        self.quotas = quotas or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.headroom = headroom
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model):
+        with self._lock:
+            if model not in self._limiters:
+                quota = self.quotas.get(model, {})
+                self._limiters[model] = ModelLimiter(
+                    quota.get("rpm", self.default_rpm), quota.get("tpm", self.default_tpm),
+                    headroom=self.headroom, max_queue=self.max_queue, max_wait=self.max_wait
+                )
+            return self._limiters[model]
+
+    async def acquire(self, model, tokens, priority=1):
+        await self.limiter(model).acquire(tokens, priority)
+
+    def settle(self, model, estimated, actual):
+        self.limiter(model).settle(estimated, actual)
+
+    def retry_after(self, models, tokens, priority=1):
+        """None if some model in `models` can take a request now, else the shortest expected wait."""
+        waits = []
+        for model in models:
+            limiter = self.limiter(model)
+            if len(limiter._queue) >= limiter.max_queue:
+                continue
+            wait = limiter.estimated_wait(tokens, priority)
+            if wait <= limiter.max_wait:
+                return None
+            waits.append(wait)
+        return min(waits) if waits else self.max_wait
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {model: limiter.stats() for model, limiter in limiters.items()}
+
+def usage_tokens(response):
+    """Total tokens the provider reports for a response (or final stream chunk), or None."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
@@ -0,0 +1,271 @@
+import datetime
+import decimal
+import logging
+import random
+import time
+import uuid
+from collections import Counter
+
+import guard_helper
+import sql_helper
+import store_helper
+
+logger = logging.getLogger(__name__)
+
+# Distinct values tracked per column before it is treated as high-cardinality
+MAX_TRACKED_VALUES = 1000
+
+def estimate_row_bytes(row):
+    """Rough in-memory size of one result row."""
+    size = 56 + 8 * len(row)
+    for value in row:
+        size += 24 + (len(value) if isinstance(value, (str, bytes, bytearray)) else 8)
+    return size
+
+def _is_comparable(value):
+    return isinstance(value, (int, float, decimal.Decimal, str, datetime.date, datetime.datetime,
+                              datetime.time, datetime.timedelta)) and not isinstance(value, bool)
+
+def _fmt(value, limit=60):
+    text = repr(value) if isinstance(value, str) else str(value)
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+class ColumnStats:
+    """Incremental statistics for one result column."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.numeric_sum = 0.0
+        self.numeric_count = 0
+        self.values = Counter()
+        self.high_cardinality = False
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            self.nulls += 1
+            return
+        if isinstance(value, (bytes, bytearray)):
+            value = f"<{len(value)} bytes>"
+        if _is_comparable(value):
+            try:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+            except TypeError:
+                pass  # Mixed types in one column; keep what we have
+        if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+            self.numeric_sum += float(value)
+            self.numeric_count += 1
+        if not self.high_cardinality:
+            self.values[value] += 1
+            if len(self.values) > MAX_TRACKED_VALUES:
+                self.high_cardinality = True
+                self.values.clear()
+
+    def describe(self, top_n=5):
+        parts = [f"{self.count - self.nulls} values", f"{self.nulls} nulls"]
+        if self.min is not None:
+            parts.append(f"min {_fmt(self.min)}, max {_fmt(self.max)}")
+        if self.numeric_count:
+            parts.append(f"mean {self.numeric_sum / self.numeric_count:.4g}")
+        if self.high_cardinality:
+            parts.append(f"over {MAX_TRACKED_VALUES} distinct")
+        elif self.values:
+            parts.append(f"{len(self.values)} distinct")
+            # Top values only say something when values repeat
+            if len(self.values) < self.count - self.nulls:
+                top = ", ".join(f"{_fmt(v, 30)} ({n})" for v, n in self.values.most_common(top_n))
+                parts.append(f"top: {top}")
+        return f"- {self.name}: " + ", ".join(parts)
+
+class ResultSummary:
+    """
+    Compact description of a result set for the LLM: row count, per-column stats
+    and a uniform sample of rows (reservoir sampling, so it covers the whole result).
+    """
+
+    def __init__(self, columns, sample_size=20, seed=0):
+        self.columns = list(columns)
+        self.stats = [ColumnStats(c) for c in self.columns]
+        self.row_count = 0
+        self.sample_size = sample_size
+        self.sample = []
+        self.truncated = False
+        self._random = random.Random(seed)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.row_count += 1
+            for stat, value in zip(self.stats, row):
+                stat.add(value)
+            if len(self.sample) < self.sample_size:
+                self.sample.append(row)
+            else:
+                slot = self._random.randrange(self.row_count)
+                if slot < self.sample_size:
+                    self.sample[slot] = row
+
+    def to_prompt(self):
+        lines = [f"Columns: {self.columns}"]
+        count_note = " (stopped at the row limit; the full result is larger)" if self.truncated else ""
+        lines.append(f"Rows returned: {self.row_count}{count_note}")
+        lines.append("Column statistics:")
+        lines.extend(stat.describe() for stat in self.stats)
+        lines.append(f"Sample rows ({len(self.sample)} of {self.row_count}):")
+        lines.extend(str(tuple(row)) for row in self.sample)
+        return "\n".join(lines)
+
+def fetch_bounded(cursor, max_rows=10000, max_bytes=16 * 1024 * 1024, batch_size=500):
+    """
+    Reads an executed (unbuffered) cursor with fetchmany until it is exhausted or a
+    row/byte cap is hit. Returns (rows, summary, exhausted); when exhausted is False
+    unread rows remain on the connection and the caller must not reuse it as-is.
+    """
+    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+    summary = ResultSummary(columns)
+    rows = []
+    if not cursor.description:
+        return rows, summary, True  # Statement without a result set
+    used_bytes = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return rows, summary, True
+        for row in batch:
+            if len(rows) >= max_rows or used_bytes >= max_bytes:
+                summary.truncated = True
+                # Anything still in this batch or on the wire is dropped
+                return rows, summary, False
+            used_bytes += estimate_row_bytes(row)
+            rows.append(row)
+            summary.add_rows((row,))
+
+def summarize_rows(columns, rows):
+    """Builds a ResultSummary for rows that are already in memory."""
+    summary = ResultSummary(columns)
+    summary.add_rows(rows)
+    return summary
+
+def iter_result_pages(db_pool, sql_query, page_size=1000, timeout=None):
+    """
+    Runs `sql_query` on its own pooled connection and yields (cursor.description, rows_page)
+    until the result is exhausted, holding at most one page in memory. A result set always
+    yields at least one (possibly empty) page. For full exports that must not go through
+    the row caps used for prompts. `timeout` (seconds) caps the query's execution time
+    on the server.
+    """
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(buffered=False)
+        finished = False
+        try:
+            cursor.execute(guard_helper.with_timeout(sql_query, timeout, guard_helper.is_mariadb(conn)))
+            if not cursor.description:
+                finished = True
+                return
+            description = cursor.description
+            first = True
+            while True:
+                page = cursor.fetchmany(page_size)
+                if not page:
+                    finished = True
+                    if first:
+                        yield description, []
+                    return
+                first = False
+                yield description, page
+        finally:
+            if not finished:
+                # Consumer stopped early; don't hand a connection with unread rows back
+                db_pool.discard_on_release(conn)
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+def fetch_page(db_pool, sql_query, page=1, page_size=100, timeout=None):
+    """
+    Returns (columns, rows, has_more) for one 1-based page of a SELECT. The query is
+    wrapped in LIMIT/OFFSET so MySQL only sends that page; queries MySQL cannot wrap
+    (e.g. duplicate column names) fall back to streaming past the skipped rows.
+    `timeout` (seconds) caps the query's execution time on the server either way.
+    """
+    offset = (page - 1) * page_size
+    # Inline the (integer) bounds: binding parameters would misread '%s' inside LIKE patterns
+    wrapped = (
+        f"SELECT * FROM ({sql_helper.statement_text(sql_query)}) AS _page "
+        f"LIMIT {int(page_size) + 1} OFFSET {int(offset)}"
+    )
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(guard_helper.with_timeout(wrapped, timeout, guard_helper.is_mariadb(conn)))
+            columns = [desc[0] for desc in cursor.description]
+            rows = cursor.fetchall()
+            cursor.close()
+        return columns, rows[:page_size], len(rows) > page_size
+    except Exception as e:
+        logger.info(f"Paging by LIMIT/OFFSET failed ({e}); streaming instead.")
+
+    columns, collected, seen = [], [], 0
+    pages = iter_result_pages(db_pool, sql_query, page_size=max(page_size, 500), timeout=timeout)
+    try:
+        for description, chunk in pages:
+            columns = [d[0] for d in description]
+            for row in chunk:
+                if seen >= offset + page_size:
+                    return columns, collected, True
+                if seen >= offset:
+                    collected.append(row)
+                seen += 1
+        return columns, collected, False
+    finally:
+        pages.close()
+
+class QueryStore:
+    """
+    Handles for executed queries, so clients can page through or export the full
+    result after the chat answer. Stores only the SQL and which session ran it, in
+    a store_helper store (shared across workers when the store is), with a TTL.
+    """
+
+    def __init__(self, store=None, ttl=3600):
+        self.store = store or store_helper.MemoryStore(max_entries=500)
+        self.ttl = ttl
+
+    def register(self, sql_query, columns, row_count, truncated, session_id=None):
+        query_id = uuid.uuid4().hex
+        self.store.set(f"query:{query_id}", {
+            "sql": sql_query,
+            "columns": list(columns),
+            "row_count": row_count,
+            "truncated": truncated,
+            "session_id": session_id,
+            "created_at": time.time(),
+        }, ttl=self.ttl)
+        return query_id
+
+    def adopt(self, query_id, session_id):
+        """
+        A handle on `query_id`'s result for `session_id` (a session that shared the
+        run, see coalesce_helper): the same ID if it already owns it, otherwise a copy.
+        None if the handle is unknown or expired.
+        """
+        entry = self.store.get(f"query:{query_id}")
+        if entry is None:
+            return None
+        if entry.get("session_id") == session_id:
+            return query_id
+        return self.register(entry["sql"], entry["columns"], entry["row_count"], entry["truncated"], session_id)
+
+    def get(self, query_id, session_id=None):
+        """Returns the handle, or None if it is unknown, expired or owned by another session."""
+        entry = self.store.get(f"query:{query_id}")
+        if entry is None or entry.get("session_id") != session_id:
+            return None
+        return entry
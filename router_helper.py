@@ -0,0 +1,281 @@
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Read routing across a session's named connections. A primary can be paired with
+# read replicas; QueryRouter then stands in for the session's connection pool, so
+# generated SQL, result pages and exports run on the least-loaded healthy replica
+# within the lag limit. Replicas that fail to connect are skipped for a cooldown;
+# the primary is the last resort unless `read_from_primary` is off. After a write
+# the session reads from the primary for a while so it sees its own changes.
+# Schema introspection on Connect still reads the primary directly.
+
+# MySQL 8.0.22+ first; older MySQL and MariaDB only know the SLAVE spelling
+LAG_STATEMENTS = ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS")
+_LAG_COLUMNS = ("Seconds_Behind_Source", "Seconds_Behind_Master")
+
+class NoRouteError(Exception):
+    """No connection may serve the query (every replica is down or lagging, primary reads disabled)."""
+
+def replica_lag(conn):
+    """
+    Seconds the server behind `conn` is behind its source: 0.0 when it is not a
+    replica, None when replication is stopped. With several replication channels
+    the largest lag counts. Raises when the status can't be read (the user needs
+    the REPLICATION CLIENT privilege).
+    """
+    cursor = conn.cursor()
+    try:
+        error = None
+        for statement in LAG_STATEMENTS:
+            try:
+                cursor.execute(statement)
+                error = None
+                break
+            except Exception as e:
+                error = e
+        if error is not None:
+            raise error
+        columns = [desc[0] for desc in cursor.description or []]
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    lags = []
+    for row in rows:
+        status = dict(zip(columns, row))
+        column = next((c for c in _LAG_COLUMNS if c in status), None)
+        if column is None or status[column] is None:
+            return None
+        lags.append(float(status[column]))
+    return max(lags) if lags else 0.0
+
+def _is_connected(conn):
+    try:
+        return conn.is_connected()
+    except Exception:
+        return False
+
+class Route:
+    """One named connection (the primary or a replica) and its health."""
+
+    def __init__(self, name, pool, role="replica"):
+        self.name = name
+        self.pool = pool
+        self.role = role
+        self.lag = None  # Seconds behind the source at the last check; None = unknown
+        self.replicating = True
+        self.lag_checked = 0.0
+        self.lag_error = None
+        self.down_until = 0.0
+        self.checkouts = 0
+        self.failures = 0
+        self.last_error = None
+
+    def load(self):
+        """Share of the pool in use."""
+        stats = self.pool.stats()
+        return stats.get("in_use", 0) / max(1, stats.get("size", 1))
+
+    def stats(self):
+        return {
+            "role": self.role,
+            "healthy": self.down_until <= time.monotonic(),
+            "lag": self.lag,
+            "replicating": self.replicating,
+            "checkouts": self.checkouts,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "pool": self.pool.stats(),
+        }
+
+class QueryRouter:
+    """
+    Connection-pool interface (connection(), discard_on_release(), stats(), close())
+    over a `primary` pool and `replicas` ({name: pool}). Each checkout goes to the
+    replica with the lowest pool load whose lag, measured at most every
+    `lag_check_interval` seconds, is within `max_lag` (None disables the limit).
+    A replica that can't be reached, or loses its connection mid-query, is skipped
+    for `failure_cooldown` seconds. Checkouts from write_connection() go to the
+    primary and keep reads there for `pin_after_write` seconds (default: `max_lag`,
+    by when a replica within the limit has the write).
+    """
+
+    def __init__(self, primary, replicas=None, max_lag=30, lag_check_interval=5, failure_cooldown=30,
+                 read_from_primary=True, pin_after_write=None):
+        self.primary = Route("primary", primary, "primary")
+        self.replicas = [Route(name, pool) for name, pool in (replicas or {}).items()]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.failure_cooldown = failure_cooldown
+        self.read_from_primary = read_from_primary
+        if pin_after_write is None:
+            pin_after_write = max_lag if max_lag is not None else 30
+        self.pin_after_write = pin_after_write
+        self._pinned_until = 0.0
+        self._checked_out = {}  # id(conn) -> Route
+        self._lock = threading.Lock()
+
+        self.primary_reads = 0
+        self.replica_reads = 0
+        self.failovers = 0
+        self.lag_skips = 0
+        self.pinned_reads = 0
+
+    @property
+    def routes(self):
+        return [self.primary] + self.replicas
+
+    @property
+    def size(self):
+        return sum(getattr(route.pool, "size", 1) for route in self.routes)
+
+    def _count(self, counter, route=None):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if route is not None:
+                route.checkouts += 1
+
+    def _stale(self, route):
+        return not route.replicating or (
+            self.max_lag is not None and route.lag is not None and route.lag > self.max_lag
+        )
+
+    def _candidates(self):
+        now = time.monotonic()
+        if self._pinned_until > now:
+            # A recent write may not have reached the replicas yet
+            self._count("pinned_reads")
+            return [self.primary]
+        replicas = []
+        for route in self.replicas:
+            if route.down_until > now:
+                continue
+            if self._stale(route) and now - route.lag_checked < self.lag_check_interval:
+                # Lagging at the last check; look again once the interval is up
+                self._count("lag_skips")
+                continue
+            replicas.append(route)
+        replicas.sort(key=lambda route: (route.load(), route.lag or 0.0))
+        if self.read_from_primary or not self.replicas:
+            replicas.append(self.primary)
+        return replicas
+
+    def _check_lag(self, route, conn):
+        """Refreshes `route`'s lag on `conn` when due; False if it is too far behind to use."""
+        now = time.monotonic()
+        if now - route.lag_checked >= self.lag_check_interval:
+            route.lag_checked = now
+            try:
+                lag = replica_lag(conn)
+                route.lag, route.replicating, route.lag_error = lag, lag is not None, None
+            except Exception as e:
+                if route.lag_error is None:
+                    logger.warning(f"Cannot read replication status of {route.name}, routing without lag checks: {e}")
+                route.lag, route.replicating, route.lag_error = None, True, str(e)[:200]
+        if self._stale(route):
+            self._count("lag_skips")
+            return False
+        return True
+
+    def _mark_down(self, route, error):
+        with self._lock:
+            route.failures += 1
+            route.last_error = str(error)[:200]
+            if route.role == "replica":
+                route.down_until = time.monotonic() + self.failure_cooldown
+        logger.warning(f"Connection {route.name} failed, routing around it for {self.failure_cooldown}s: {error}")
+
+    def _checkout(self, stack):
+        last_error = None
+        for route in self._candidates():
+            attempt = ExitStack()
+            try:
+                conn = attempt.enter_context(route.pool.connection())
+            except Exception as e:
+                self._mark_down(route, e)
+                self._count("failovers")
+                last_error = e
+                continue
+            if route.role == "replica" and not self._check_lag(route, conn):
+                attempt.close()
+                continue
+            stack.enter_context(attempt)
+            self._count("replica_reads" if route.role == "replica" else "primary_reads", route)
+            return route, conn
+        if last_error is not None and not self.read_from_primary:
+            raise NoRouteError(f"No replica could be reached: {last_error}")
+        if last_error is not None:
+            raise last_error
+        raise NoRouteError("Every replica is down or lagging and reads from the primary are disabled.")
+
+    @contextmanager
+    def connection(self):
+        with ExitStack() as stack:
+            route, conn = self._checkout(stack)
+            with self._checked_out_as(route, conn):
+                yield conn
+
+    @contextmanager
+    def write_connection(self):
+        """A primary connection for a statement that changes data; pins later reads to the primary."""
+        with self.primary.pool.connection() as conn:
+            try:
+                with self._checked_out_as(self.primary, conn):
+                    yield conn
+            finally:
+                with self._lock:
+                    self._pinned_until = time.monotonic() + self.pin_after_write
+
+    @contextmanager
+    def _checked_out_as(self, route, conn):
+        with self._lock:
+            self._checked_out[id(conn)] = route
+        try:
+            yield conn
+        except Exception as e:
+            # Query errors keep the route; a dropped server does not
+            if not _is_connected(conn):
+                self._mark_down(route, e)
+            raise
+        finally:
+            with self._lock:
+                self._checked_out.pop(id(conn), None)
+
+    def route_of(self, conn):
+        """Name of the connection a checked-out `conn` came from."""
+        route = self._checked_out.get(id(conn))
+        return route.name if route else None
+
+    def kill_query(self, conn):
+        route = self._checked_out.get(id(conn))
+        if route is not None:
+            route.pool.kill_query(conn)
+
+    def discard_on_release(self, conn):
+        route = self._checked_out.get(id(conn))
+        if route is not None:
+            route.pool.discard_on_release(conn)
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "primary_reads": self.primary_reads,
+                "replica_reads": self.replica_reads,
+                "failovers": self.failovers,
+                "lag_skips": self.lag_skips,
+                "pinned_reads": self.pinned_reads,
+            }
+        return dict(
+            counters, max_lag=self.max_lag, read_from_primary=self.read_from_primary,
+            routes={route.name: route.stats() for route in self.routes}
+        )
+
+    def close(self):
+        for route in self.routes:
+            try:
+                route.pool.close()
+            except Exception as e:
+                logger.warning(f"Closing pool for {route.name} failed: {e}")
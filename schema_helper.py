@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".schema_cache"
+
+class SchemaModel:
+    """
+    Structured, in-memory view of a database schema.
+    `tables` maps table name -> {
+        "comment", "columns": [{"name", "type", "nullable", "key", "default", "extra", "comment"}],
+        "primary_key": [col, ...], "foreign_keys": [{"column", "ref_table", "ref_column"}],
+        "indexes": {index_name: {"unique": bool, "columns": [col, ...]}}
+    }
+    `versions` maps table name -> the CREATE_TIME/UPDATE_TIME signature it was read at.
+    """
+
+    def __init__(self, database, tables=None, versions=None):
+        self.database = database
+        self.tables = tables or {}
+        self.versions = versions or {}
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """Short hash of the table/column/key structure (ignores data-only changes)."""
+        if self._fingerprint is None:
+            structure = {
+                name: {
+                    "columns": [(c["name"], c["type"]) for c in table["columns"]],
+                    "primary_key": table.get("primary_key", []),
+                    "foreign_keys": table.get("foreign_keys", []),
+                }
+                for name, table in self.tables.items()
+            }
+            payload = json.dumps(structure, sort_keys=True).encode("utf-8")
+            self._fingerprint = hashlib.sha256(payload).hexdigest()[:16]
+        return self._fingerprint
+
+    def table_names(self):
+        return sorted(self.tables)
+
+    def describe_table(self, name):
+        """Renders one table in the prompt format the model has always been given."""
+        table = self.tables[name]
+        columns = [f"{c['name']} ({c['type']})" for c in table["columns"]]
+        lines = [f"Table: {name}", f"Columns: {', '.join(columns)}"]
+        if table.get("primary_key"):
+            lines.append(f"Primary key: {', '.join(table['primary_key'])}")
+        if table.get("foreign_keys"):
+            refs = [f"{fk['column']} -> {fk['ref_table']}.{fk['ref_column']}" for fk in table["foreign_keys"]]
+            lines.append(f"Foreign keys: {', '.join(refs)}")
+        return "\n".join(lines)
+
+    def to_prompt(self, tables=None):
+        """Returns the schema text for a prompt, optionally limited to `tables`."""
+        names = self.table_names() if tables is None else [t for t in tables if t in self.tables]
+        return "\n\n".join(self.describe_table(name) for name in names)
+
+    def to_dict(self):
+        return {
+            "database": self.database,
+            "fingerprint": self.fingerprint,
+            "versions": self.versions,
+            "tables": self.tables,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("database"), data.get("tables", {}), data.get("versions", {}))
+
+# --- On-disk cache ---
+
+def cache_key(host, port, database):
+    return f"{host}:{port}/{database}"
+
+def _cache_path(key, cache_dir):
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{digest}.json")
+
+def load_cached_schema(key, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the cached SchemaModel for `key`, or None if missing/corrupt."""
+    path = _cache_path(key, cache_dir)
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable schema cache {path}: {e}")
+        return None
+
+    if data.get("key") != key:
+        return None
+    model = SchemaModel.from_dict(data)
+    if data.get("fingerprint") != model.fingerprint:
+        logger.warning(f"Schema cache {path} failed its fingerprint check, discarding.")
+        return None
+    return model
+
+def save_cached_schema(key, model, cache_dir=DEFAULT_CACHE_DIR):
+    """Persists `model` atomically (write + rename) so a crash never leaves half a file."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(key, cache_dir)
+        tmp_path = f"{path}.tmp"
+        data = model.to_dict()
+        data["key"] = key
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Could not write schema cache: {e}")
+
+# --- Relevance index for prompt pruning ---
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "and", "or", "with", "from", "at",
+    "is", "are", "was", "were", "be", "me", "my", "our", "show", "list", "give", "get", "find",
+    "what", "which", "who", "how", "many", "much", "all", "each", "per", "please", "tell", "i",
+    "do", "does", "did", "have", "has", "there", "that", "this", "these", "those", "it",
+}
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting."""
+    return len(text) // 4 + 1
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text):
+    """Splits prose and identifiers (snake_case, camelCase) into lowercase stemmed terms."""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    words = re.split(r"[^A-Za-z0-9]+", text.lower())
+    return [_stem(w) for w in words if w and w not in _STOPWORDS]
+
+class SchemaIndex:
+    """
+    BM25 index over tables, built once per connection.
+    A table's document is its name (weighted), column names, comments and the
+    names of tables it is linked to by foreign keys.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    NAME_WEIGHT = 3
+
+    def __init__(self, model):
+        self.model = model
+        self.neighbours = {name: set() for name in model.tables}
+        for name, table in model.tables.items():
+            for fk in table.get("foreign_keys", []):
+                if fk["ref_table"] in self.neighbours:
+                    self.neighbours[name].add(fk["ref_table"])
+                    self.neighbours[fk["ref_table"]].add(name)
+
+        self.doc_terms = {}
+        for name, table in model.tables.items():
+            terms = tokenize(name) * self.NAME_WEIGHT
+            terms += tokenize(table.get("comment", ""))
+            for col in table["columns"]:
+                terms += tokenize(col["name"]) + tokenize(col.get("comment", ""))
+            for other in self.neighbours[name]:
+                terms += tokenize(other)
+            self.doc_terms[name] = Counter(terms)
+
+        self.doc_len = {name: sum(terms.values()) for name, terms in self.doc_terms.items()}
+        self.avg_len = (sum(self.doc_len.values()) / len(self.doc_len)) if self.doc_len else 0.0
+
+        # Inverted index so a question only touches tables sharing one of its terms
+        self.postings = {}
+        for name, terms in self.doc_terms.items():
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((name, tf))
+        n = len(self.doc_terms)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+        self.table_tokens = {name: estimate_tokens(model.describe_table(name)) for name in model.tables}
+        self.total_tokens = sum(self.table_tokens.values())
+
+    def score(self, question):
+        """Returns [(table, score), ...] for tables matching any question term, best first."""
+        scores = Counter()
+        for term in set(tokenize(question)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for name, tf in self.postings[term]:
+                length_norm = self.K1 * (1 - self.B + self.B * self.doc_len[name] / (self.avg_len or 1))
+                scores[name] += idf * tf * (self.K1 + 1) / (tf + length_norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def select_tables(self, question, top_k=8, token_budget=4000):
+        """
+        Picks the tables to show the model: the top_k scored tables, then their
+        foreign-key neighbours (so joins stay possible), within token_budget.
+        Small schemas that fit the budget are sent whole.
+        """
+        if self.total_tokens <= token_budget:
+            return self.model.table_names()
+
+        ranked = [name for name, _ in self.score(question)[:top_k]]
+        if ranked:
+            candidates, seen = list(ranked), set(ranked)
+            for name in ranked:
+                for other in sorted(self.neighbours[name] - seen):
+                    candidates.append(other)
+                    seen.add(other)
+        else:
+            # Nothing matched; fall back to the schema in name order up to the budget
+            candidates = self.model.table_names()
+
+        selected, used = [], 0
+        for name in candidates:
+            cost = self.table_tokens[name]
+            if used + cost > token_budget:
+                continue
+            selected.append(name)
+            used += cost
+        return selected
+
+    def context_for(self, question, top_k=8, token_budget=4000):
+        """Returns (schema_text, selected_tables) for one question."""
+        tables = self.select_tables(question, top_k, token_budget)
+        return self.model.to_prompt(tables), tables
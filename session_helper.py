@@ -0,0 +1,280 @@
+import base64
+import hashlib
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+import schema_helper
+
+logger = logging.getLogger(__name__)
+
+# Rough per-connection footprint (socket buffers, protocol state) for the memory cap
+CONNECTION_BYTES = 256 * 1024
+
+class Session:
+    """
+    One user's live database state in this process: the connection parameters,
+    the schema model and its index, and the connection pool.
+    """
+
+    def __init__(self, session_id, params, schema_model, pool):
+        self.id = session_id
+        self.params = params
+        self.schema_model = schema_model
+        self.schema_index = schema_helper.SchemaIndex(schema_model)
+        self._schema_preamble = None
+        self.pool = pool
+        # Scopes shared caches (results, table versions, profiles, snapshots) to this
+        # database as seen by this MySQL user, so no one is served rows beyond their grants
+        self.scope = f"{params.get('user', '')}@" + schema_helper.cache_key(
+            params["host"], params["port"], params["database"]
+        )
+        self.last_used = time.monotonic()
+        self.estimated_bytes = self._estimate_bytes()
+
+    @property
+    def schema_preamble(self):
+        """The full schema as prompt text, built once per connection (see context_cache_helper)."""
+        if self._schema_preamble is None:
+            self._schema_preamble = self.schema_model.to_prompt()
+        return self._schema_preamble
+
+    def _estimate_bytes(self):
+        # Model + index are a small multiple of the schema's JSON size
+        schema_bytes = len(json.dumps(self.schema_model.to_dict(), default=str))
+        return 4 * schema_bytes + CONNECTION_BYTES * getattr(self.pool, "size", 1)
+
+    def close(self):
+        try:
+            self.pool.close()
+        except Exception as e:
+            logger.warning(f"Closing pool for session {self.id[:8]} failed: {e}")
+
+def split_secrets(params):
+    """
+    (params without passwords, the passwords): the primary's and each replica's,
+    kept apart so session records never hold them in clear.
+    """
+    public = {k: v for k, v in params.items() if k != "password"}
+    replicas = params.get("replicas") or []
+    if replicas:
+        public["replicas"] = [{k: v for k, v in replica.items() if k != "password"} for replica in replicas]
+    return public, {"password": params.get("password"), "replicas": [r.get("password") for r in replicas]}
+
+def join_secrets(public, passwords):
+    """The inverse of split_secrets. Replicas without a password keep using the primary's."""
+    params = dict(public, password=passwords.get("password"))
+    if public.get("replicas"):
+        params["replicas"] = [
+            dict(replica, password=password) if password is not None else dict(replica)
+            for replica, password in zip(public["replicas"], passwords.get("replicas", []))
+        ]
+    return params
+
+class SessionManager:
+    """
+    Maps session IDs to live Sessions. The connection parameters of every session
+    are kept in `store` (see store_helper) so any worker can serve it: a worker that
+    has never seen a session rebuilds it with `connect(params) -> (schema_model, pool)`,
+    which is cheap thanks to the on-disk schema cache.
+    Passwords are not stored in clear. With a `secret_key` (needs the cryptography
+    package) they are stored encrypted; without one they stay in this process's
+    memory, and other workers can only restore sessions of named connections
+    (params["connection"]), whose passwords `connect` looks up itself.
+    Live sessions are closed after `idle_timeout` seconds without use, and the least
+    recently used ones are closed first when more than `max_sessions` are open or
+    their estimated memory exceeds `max_bytes`. Closing a live session keeps its
+    stored record, so its next request reconnects transparently.
+    """
+
+    SWEEP_INTERVAL = 30  # seconds between idle sweeps
+
+    def __init__(self, store, connect, idle_timeout=1800, max_sessions=50, max_bytes=512 * 1024 * 1024,
+                 secret_key=None):
+        self.store = store
+        self.connect = connect
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_bytes = int(max_bytes)
+        self._live = OrderedDict()  # session id -> Session, LRU order
+        self._building = {}  # session id -> lock held while it is rebuilt
+        self._passwords = {}  # session id -> (passwords, expires_at), for records without sealed ones
+        self._cipher = None
+        if secret_key and Fernet is None:
+            logger.warning("SESSION_SECRET_KEY needs the cryptography package; passwords stay in memory only")
+        elif secret_key:
+            # Any passphrase works: Fernet wants 32 url-safe base64 bytes
+            digest = hashlib.sha256(str(secret_key).encode("utf-8")).digest()
+            self._cipher = Fernet(base64.urlsafe_b64encode(digest))
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+        self.created = 0
+        self.restored = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    @staticmethod
+    def _key(session_id):
+        return f"session:{session_id}"
+
+    def _record(self, session_id, params):
+        """The stored form of `params`: passwords sealed, or kept in memory here."""
+        public, passwords = split_secrets(params)
+        record = {"params": public}
+        if self._cipher:
+            record["sealed"] = self._cipher.encrypt(json.dumps(passwords).encode("utf-8")).decode("ascii")
+        else:
+            with self._lock:
+                self._passwords[session_id] = (passwords, time.monotonic() + self.idle_timeout)
+        return record
+
+    def _params(self, session_id, record):
+        """Connection parameters from a stored record, or None if its passwords are out of reach."""
+        if not isinstance(record, dict) or "params" not in record:
+            return None
+        public = record["params"]
+        if record.get("sealed") and self._cipher:
+            try:
+                return join_secrets(public, json.loads(self._cipher.decrypt(record["sealed"].encode("ascii"))))
+            except InvalidToken:
+                logger.warning(f"Session {session_id[:8]} was sealed with another SESSION_SECRET_KEY")
+        with self._lock:
+            kept = self._passwords.get(session_id)
+        if kept is not None:
+            return join_secrets(public, kept[0])
+        if public.get("connection"):
+            return dict(public)  # connect() fills in the named connection's credentials
+        logger.info(f"Session {session_id[:8]} cannot be restored here without its password")
+        return None
+
+    def create(self, params, schema_model, pool):
+        """Registers a new connection and returns its Session."""
+        session = Session(secrets.token_urlsafe(24), dict(params), schema_model, pool)
+        self.store.set(self._key(session.id), self._record(session.id, session.params), ttl=self.idle_timeout)
+        with self._lock:
+            self._live[session.id] = session
+            self.created += 1
+        self._enforce_limits(keep=session.id)
+        return session
+
+    def get(self, session_id):
+        """Returns the Session for `session_id` (rebuilding it if needed) or None."""
+        if not session_id:
+            return None
+        self._sweep()
+        with self._lock:
+            session = self._live.get(session_id)
+            if session:
+                self._live.move_to_end(session_id)
+        if session:
+            self._touch(session)
+            return session
+
+        params = self._params(session_id, self.store.get(self._key(session_id)))
+        if params is None:
+            return None
+        with self._lock:
+            build_lock = self._building.setdefault(session_id, threading.Lock())
+        with build_lock:
+            with self._lock:
+                session = self._live.get(session_id)
+            if session is None:
+                # First request for this session in this process (or it was evicted)
+                logger.info(f"Restoring session {session_id[:8]} for {params['database']}")
+                schema_model, pool = self.connect(params)
+                session = Session(session_id, params, schema_model, pool)
+                with self._lock:
+                    self._live[session_id] = session
+                    self.restored += 1
+        with self._lock:
+            self._building.pop(session_id, None)
+        self._enforce_limits(keep=session_id)
+        return session
+
+    def _touch(self, session):
+        now = time.monotonic()
+        # Refresh the shared TTL at most once a minute per session
+        if now - session.last_used > 60:
+            self.store.touch(self._key(session.id), self.idle_timeout)
+            with self._lock:
+                kept = self._passwords.get(session.id)
+                if kept is not None:
+                    self._passwords[session.id] = (kept[0], now + self.idle_timeout)
+        session.last_used = now
+
+    def drop(self, session_id):
+        """Forgets a session everywhere and closes its pool here."""
+        if not session_id:
+            return
+        self.store.delete(self._key(session_id))
+        with self._lock:
+            self._passwords.pop(session_id, None)
+            session = self._live.pop(session_id, None)
+        if session:
+            session.close()
+
+    def _sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+            idle = [s for s in self._live.values() if now - s.last_used > self.idle_timeout]
+            for session in idle:
+                del self._live[session.id]
+                self.evicted_idle += 1
+            # Their records have expired from the store too
+            for session_id in [k for k, (_, expires_at) in self._passwords.items() if expires_at < now]:
+                if session_id not in self._live:
+                    del self._passwords[session_id]
+        for session in idle:
+            logger.info(f"Closing idle session {session.id[:8]}")
+            session.close()
+
+    def _enforce_limits(self, keep=None):
+        closing = []
+        with self._lock:
+            used = sum(s.estimated_bytes for s in self._live.values())
+            for session in list(self._live.values()):
+                if len(self._live) <= self.max_sessions and used <= self.max_bytes:
+                    break
+                if session.id == keep:
+                    continue
+                del self._live[session.id]
+                used -= session.estimated_bytes
+                self.evicted_capacity += 1
+                closing.append(session)
+        for session in closing:
+            logger.info(f"Closing session {session.id[:8]} to stay within session limits")
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._live.values())
+            self._live.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live": len(self._live),
+                "max_sessions": self.max_sessions,
+                "estimated_bytes": sum(s.estimated_bytes for s in self._live.values()),
+                "max_bytes": self.max_bytes,
+                "created": self.created,
+                "restored": self.restored,
+                "passwords": "sealed" if self._cipher else "memory",
+                "evicted_idle": self.evicted_idle,
+                "evicted_capacity": self.evicted_capacity,
+                "store": self.store.stats(),
+            }
@@ -0,0 +1,609 @@
+import contextlib
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed with SNAPSHOT_ENABLED
+    duckdb = pa = pq = None
+
+import guard_helper
+import metrics_helper
+import sql_helper
+
+logger = logging.getLogger(__name__)
+
+# Local columnar snapshots for analytical questions. Selected tables are copied from
+# MySQL into Parquet files (in full, or incrementally by an ever-growing key or an
+# "updated at" column) and queried through an embedded DuckDB, so aggregations over
+# large tables stop competing with the application's own traffic. Each generated
+# query is routed by SnapshotEngine.route(): it runs on the snapshot only when every
+# table it reads is snapshotted and fresh enough, it aggregates (unless routing is
+# "all"), and it uses no MySQL syntax whose meaning differs in DuckDB. Anything else,
+# including a snapshot query that fails, runs on MySQL as before.
+
+ROUTES = ("analytical", "all")
+# Rows read from MySQL per Parquet row group while refreshing
+BATCH_ROWS = 50000
+# Incremental tables are rewritten in full once they have this many part files,
+# which also drops rows deleted on MySQL since the last full refresh
+MAX_PARTS = 24
+# Retry a failed refresh after this long, even when the refresh interval is longer
+RETRY_SECONDS = 60
+
+AGGREGATE_FUNCTIONS = {
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT", "STD", "STDDEV", "STDDEV_POP", "STDDEV_SAMP",
+    "VARIANCE", "VAR_POP", "VAR_SAMP", "BIT_AND", "BIT_OR",
+}
+# Functions DuckDB also has but with a different result (CONCAT skips NULLs, LENGTH
+# counts characters, weekdays are numbered from Sunday, FORMAT is printf-like)
+MYSQL_SEMANTICS = {"CONCAT", "LENGTH", "WEEKDAY", "DAYOFWEEK", "WEEK", "YEARWEEK", "FORMAT"}
+
+_SCAN_RE = re.compile(
+    r"""'(?:[^'\\]|''|\\.)*'|"(?:[^"\\]|""|\\.)*"|`(?:[^`]|``)*`|--[^\n]*|\#[^\n]*|/\*.*?\*/"""
+    r"""|\|\||&&|[A-Za-z_][A-Za-z0-9_$]*|\s+|.""",
+    re.DOTALL,
+)
+
+class SnapshotTimeoutError(Exception):
+    """A query ran past its time limit on the snapshot (see SnapshotEngine.deadline)."""
+
+SNAPSHOT_QUERIES = metrics_helper.REGISTRY.counter(
+    "talk2db_snapshot_queries_total",
+    "Generated queries by where they ran (snapshot or mysql) and why.", ("engine", "reason")
+)
+SNAPSHOT_REFRESHES = metrics_helper.REGISTRY.counter(
+    "talk2db_snapshot_refreshes_total", "Snapshot table refreshes.", ("kind", "outcome")
+)
+
+def translate(sql):
+    """
+    DuckDB form of a MySQL query, or None when it uses MySQL-only syntax whose
+    meaning would change: double-quoted strings, backslash escapes, || and &&,
+    and MYSQL_SEMANTICS functions. Backquoted names become double-quoted and LIKE
+    becomes ILIKE (MySQL compares strings case-insensitively).
+    """
+    tokens = _SCAN_RE.findall(sql)
+    words = [(i, tok.upper()) for i, tok in enumerate(tokens) if not tok.isspace()]
+    following = {i: words[n + 1][1] if n + 1 < len(words) else "" for n, (i, _) in enumerate(words)}
+    out = []
+    for i, tok in enumerate(tokens):
+        if tok.startswith("'"):
+            if "\\" in tok:
+                return None
+            out.append(tok)
+        elif tok.startswith('"') or tok in ("||", "&&"):
+            return None
+        elif tok.startswith("`"):
+            out.append('"' + tok[1:-1].replace("``", "`").replace('"', '""') + '"')
+        elif tok.startswith(("--", "#", "/*")):
+            out.append(" ")
+        elif tok.upper() in MYSQL_SEMANTICS and following[i] == "(":
+            return None
+        elif tok.upper() == "LIKE":
+            out.append("ILIKE")
+        else:
+            out.append(tok)
+    return "".join(out)
+
+def is_analytical(sql):
+    """True for queries that aggregate: GROUP BY, aggregate functions, DISTINCT or window functions."""
+    upper = [t.upper() for t in sql_helper.tokenize(sql_helper.strip_comments_and_strings(sql))]
+    for i, tok in enumerate(upper):
+        nxt = upper[i + 1] if i + 1 < len(upper) else ""
+        if (tok == "GROUP" and nxt == "BY") or tok in ("DISTINCT", "OVER") or (tok in AGGREGATE_FUNCTIONS and nxt == "("):
+            return True
+    return False
+
+def arrow_type(column_type):
+    """Arrow type for a MySQL column type as introspected ("int unsigned", "decimal(10,2)", ...)."""
+    column_type = (column_type or "").lower()
+    base = re.match(r"[a-z]*", column_type).group(0)
+    if base in ("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year", "bit", "bool", "boolean"):
+        return pa.uint64() if base == "bigint" and "unsigned" in column_type else pa.int64()
+    if base in ("decimal", "numeric", "dec", "fixed"):
+        match = re.search(r"\((\d+)(?:\s*,\s*(\d+))?\)", column_type)
+        precision, scale = (int(match.group(1)), int(match.group(2) or 0)) if match else (10, 0)
+        return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+    if base in ("float", "double", "real"):
+        return pa.float64()
+    if base == "date":
+        return pa.date32()
+    if base in ("datetime", "timestamp"):
+        return pa.timestamp("us")
+    if base == "time":
+        return pa.duration("us")
+    if base in ("binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob"):
+        return pa.binary()
+    return pa.string()
+
+def _arrow_value(value, arrow_type):
+    """Coerces a driver value to what pa.array expects for `arrow_type`."""
+    if value is None:
+        return None
+    if pa.types.is_integer(arrow_type):
+        return int.from_bytes(value, "big") if isinstance(value, (bytes, bytearray)) else int(value)
+    if pa.types.is_decimal(arrow_type):
+        return decimal.Decimal(str(value)).quantize(decimal.Decimal(1).scaleb(-arrow_type.scale))
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_date(arrow_type) and isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    if pa.types.is_timestamp(arrow_type) and isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    if pa.types.is_binary(arrow_type):
+        return bytes(value) if not isinstance(value, str) else value.encode("utf-8")
+    if pa.types.is_string(arrow_type):
+        if isinstance(value, (bytes, bytearray)):
+            return value.decode("utf-8", errors="replace")
+        if isinstance(value, (set, frozenset)):
+            return ",".join(sorted(value))  # SET columns
+        return str(value)
+    return value
+
+def _json_value(value):
+    return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else str(value)
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class TableSnapshot:
+    """
+    One table's Parquet files and manifest. `mode` is "full" (re-read every
+    refresh), "key" (append rows whose `column`, part of the primary key, is above
+    the last one seen) or "timestamp" (re-read rows whose `column` is at or after
+    the last one seen; the newest copy of each primary key wins).
+    """
+
+    def __init__(self, name, directory, mode="full", column=None, primary_key=None, columns=None,
+                 refresh_interval=600, max_staleness=900):
+        self.name = name
+        self.directory = directory
+        self.mode = mode
+        self.column = column
+        self.primary_key = primary_key or []
+        self.columns = columns or []  # [(name, type)] from the schema model
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.manifest = self._load_manifest()
+        self.last_attempt = 0.0
+        self.last_error = None
+        self.last_duration = None
+        self.full_requested = False
+        self.refresh_requested = False
+        if self.manifest.get("columns") != [list(c) for c in self.columns] or self.manifest.get("mode") != mode:
+            # Schema or refresh mode changed since these files were written
+            self.full_requested = True
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if all(os.path.exists(os.path.join(self.directory, part)) for part in manifest.get("parts", [])):
+                return manifest
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot manifest of {self.name}: {e}")
+        return {}
+
+    def _save_manifest(self):
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, default=_json_value)
+        os.replace(tmp, self._manifest_path)
+
+    @property
+    def ready(self):
+        return bool(self.manifest.get("parts"))
+
+    def age(self):
+        """Seconds since the data was read from MySQL; None before the first refresh."""
+        refreshed = self.manifest.get("refreshed_at")
+        return time.time() - refreshed if refreshed else None
+
+    def due(self, now):
+        if now - self.last_attempt < (RETRY_SECONDS if self.last_error else 0):
+            return False
+        age = self.age()
+        return self.full_requested or self.refresh_requested or age is None or age >= self.refresh_interval
+
+    def refresh(self, conn):
+        """Reads new rows from MySQL over `conn` into a part file. Returns the parts it replaced."""
+        full = self.full_requested or self.mode == "full" or not self.ready or (
+            len(self.manifest.get("parts", [])) >= MAX_PARTS
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.time()
+        watermark = None if full else self.manifest.get("watermark")
+        where, params = "", ()
+        if watermark is not None:
+            where = f" WHERE `{self.column}` {'>' if self.mode == 'key' else '>='} %s"
+            params = (watermark,)
+
+        sequence = self.manifest.get("next_part", 1)
+        part = f"part-{sequence:06d}.parquet"
+        path = os.path.join(self.directory, part)
+        types = dict(self.columns)
+        cursor = conn.cursor(buffered=False)
+        writer = None
+        rows = 0
+        newest = None
+        try:
+            cursor.execute(f"SELECT * FROM `{self.name}`{where}", params)
+            names = [desc[0] for desc in cursor.description]
+            schema = pa.schema([pa.field(name, arrow_type(types.get(name))) for name in names])
+            column_index = names.index(self.column) if self.column in names else None
+            writer = pq.ParquetWriter(path + ".tmp", schema)
+            while True:
+                batch = cursor.fetchmany(BATCH_ROWS)
+                if not batch:
+                    break
+                arrays = [
+                    pa.array([_arrow_value(row[i], field.type) for row in batch], type=field.type)
+                    for i, field in enumerate(schema)
+                ]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows += len(batch)
+                if column_index is not None:
+                    values = [row[column_index] for row in batch if row[column_index] is not None]
+                    if values and (newest is None or max(values) > newest):
+                        newest = max(values)
+            writer.close()
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            with contextlib.suppress(OSError):
+                os.remove(path + ".tmp")
+            raise
+        finally:
+            cursor.close()
+        if newest is not None:
+            watermark = newest
+
+        replaced = []
+        if full:
+            replaced = self.manifest.get("parts", [])
+            parts = [part]
+            total = rows
+        elif rows:
+            parts = self.manifest["parts"] + [part]
+            total = self.manifest.get("rows", 0) + rows
+        else:
+            parts, total = self.manifest["parts"], self.manifest.get("rows", 0)
+        if full or rows:
+            os.replace(path + ".tmp", path)
+            sequence += 1
+        else:
+            os.remove(path + ".tmp")
+        self.manifest = {
+            "table": self.name, "mode": self.mode, "column": self.column,
+            "columns": [list(c) for c in self.columns], "parts": parts, "next_part": sequence,
+            "rows": total, "watermark": watermark, "refreshed_at": started,
+        }
+        self._save_manifest()
+        self.full_requested = self.refresh_requested = False
+        self.last_error = None
+        self.last_duration = time.time() - started
+        SNAPSHOT_REFRESHES.inc(kind="full" if full else "incremental", outcome="ok")
+        logger.info(f"Snapshot of {self.name}: {'full' if full else 'incremental'} refresh read {rows} rows "
+                    f"in {self.last_duration:.1f}s")
+        return replaced
+
+    def view_sql(self):
+        files = ", ".join("'" + os.path.join(self.directory, p).replace("'", "''") + "'" for p in self.manifest["parts"])
+        if self.mode == "timestamp" and len(self.manifest["parts"]) > 1:
+            key = ", ".join(_quote(c) for c in self.primary_key)
+            return (f"SELECT * EXCLUDE (__snapshot_part) FROM read_parquet([{files}], union_by_name = true, "
+                    f"filename = '__snapshot_part') "
+                    f"QUALIFY row_number() OVER (PARTITION BY {key} ORDER BY __snapshot_part DESC) = 1")
+        return f"SELECT * FROM read_parquet([{files}], union_by_name = true)"
+
+    def stats(self):
+        age = self.age()
+        return {
+            "mode": self.mode,
+            "column": self.column,
+            "stored_rows": self.manifest.get("rows", 0),  # Includes superseded copies in timestamp mode
+            "parts": len(self.manifest.get("parts", [])),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "max_staleness_seconds": self.max_staleness,
+            "refresh_seconds": self.refresh_interval,
+            "last_refresh_duration": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_error": self.last_error,
+        }
+
+class SnapshotEngine:
+    """
+    The snapshots of one database and the DuckDB that reads them. Stands in for a
+    connection pool while a query runs (connection(), kill_query(), discard_on_release()),
+    so cancel_helper can interrupt it like a MySQL statement.
+    """
+
+    def __init__(self, directory, database, route="analytical"):
+        self.directory = directory
+        self.database = database
+        self.route_mode = route if route in ROUTES else "analytical"
+        self.tables = {}  # lower-case name -> TableSnapshot
+        self.source = None  # Connection pool refreshes read from
+        self.decisions = {}
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = duckdb.connect(":memory:")
+        # Generated SQL may read the snapshot files and nothing else on this host,
+        # may not change these settings back, and compares like MySQL's _ci collations
+        self._db.execute(f"SET allowed_directories = ['{os.path.abspath(directory)}']")
+        self._db.execute("SET enable_external_access = false")
+        self._db.execute("SET default_collation = 'nocase'")
+        self._db.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        self._db.execute("SET lock_configuration = true")
+
+    def configure(self, specs, schema_model, refresh_interval, max_staleness):
+        """Sets up a TableSnapshot for each entry of `specs` ({table: {...}}) present in `schema_model`."""
+        by_lower = {name.lower(): name for name in schema_model.tables}
+        for spec_name, spec in specs.items():
+            name = by_lower.get(spec_name.lower())
+            if name is None:
+                logger.warning(f"Snapshot table {spec_name} is not in {self.database}; skipping it.")
+                continue
+            if name.lower() in self.tables:
+                continue
+            table = schema_model.tables[name]
+            primary_key = table.get("primary_key", [])
+            column = (spec or {}).get("incremental_column")
+            if column and column not in [c["name"] for c in table["columns"]]:
+                logger.warning(f"Snapshot column {name}.{column} does not exist; refreshing {name} in full.")
+                column = None
+            mode = "full"
+            if column:
+                mode = "key" if column in primary_key else "timestamp"
+                if mode == "timestamp" and not primary_key:
+                    logger.warning(f"{name} has no primary key to merge updates on; refreshing it in full.")
+                    mode, column = "full", None
+            snapshot = TableSnapshot(
+                name, os.path.join(self.directory, re.sub(r"[^\w.-]", "_", name)), mode, column, primary_key,
+                [(c["name"], c["type"]) for c in table["columns"]],
+                (spec or {}).get("refresh_seconds", refresh_interval),
+                (spec or {}).get("max_staleness_seconds", max_staleness),
+            )
+            self.tables[name.lower()] = snapshot
+            if snapshot.ready and not snapshot.full_requested:
+                self._create_view(snapshot)
+
+    def _create_view(self, snapshot):
+        with self._lock:
+            self._db.execute(f"CREATE OR REPLACE VIEW {_quote(snapshot.name)} AS {snapshot.view_sql()}")
+
+    def refresh_due(self, now=None):
+        now = now or time.monotonic()
+        for snapshot in list(self.tables.values()):
+            if snapshot.due(now):
+                self.refresh(snapshot, now)
+
+    def refresh(self, snapshot, now=None):
+        snapshot.last_attempt = now or time.monotonic()
+        if self.source is None:
+            return
+        try:
+            with self.source.connection() as conn:
+                try:
+                    replaced = snapshot.refresh(conn)
+                except Exception:
+                    # Rows of the unbuffered SELECT may still be on the wire
+                    self.source.discard_on_release(conn)
+                    raise
+            self._create_view(snapshot)
+        except Exception as e:
+            snapshot.last_error = str(e)[:200]
+            SNAPSHOT_REFRESHES.inc(kind="full" if snapshot.full_requested else "incremental", outcome="error")
+            logger.warning(f"Refreshing the snapshot of {snapshot.name} failed: {e}")
+            return
+        for part in replaced:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(snapshot.directory, part))
+
+    def _decide(self, sql):
+        if self.route_mode == "analytical" and not is_analytical(sql):
+            return None, "not_analytical"
+        tables = sql_helper.referenced_tables(sql)
+        if not tables:
+            return None, "no_tables"
+        for name in tables:
+            snapshot = self.tables.get(name.lower())
+            if snapshot is None or not snapshot.ready:
+                return None, "not_snapshotted"
+            age = snapshot.age()
+            if snapshot.max_staleness is not None and (age is None or age > snapshot.max_staleness):
+                return None, "stale"
+        duck_sql = translate(sql)
+        if duck_sql is None:
+            return None, "mysql_syntax"
+        return duck_sql, "fresh"
+
+    def route(self, sql):
+        """(DuckDB SQL, reason) when `sql` should run on the snapshot, else (None, reason)."""
+        try:
+            guard_helper.validate(sql)
+            first = next((t.upper() for t in sql_helper.tokenize(sql) if t != "("), "")
+            if first not in ("SELECT", "WITH"):
+                duck_sql, reason = None, "not_select"
+            else:
+                duck_sql, reason = self._decide(sql)
+        except guard_helper.QueryRejectedError:
+            duck_sql, reason = None, "not_select"
+        self._count("snapshot" if duck_sql else "mysql", reason)
+        return duck_sql, reason
+
+    def _count(self, engine, reason):
+        with self._lock:
+            key = f"{engine}:{reason}"
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        SNAPSHOT_QUERIES.inc(engine=engine, reason=reason)
+
+    def record_fallback(self, error):
+        """A routed query failed on DuckDB and is re-run on MySQL."""
+        with self._lock:
+            self.fallbacks += 1
+        self._count("mysql", "snapshot_error")
+        logger.warning(f"Snapshot query failed, running it on MySQL: {error}")
+
+    def max_age(self, sql):
+        """Age in seconds of the oldest snapshot `sql` reads."""
+        ages = [self.tables[t.lower()].age() for t in sql_helper.referenced_tables(sql) if t.lower() in self.tables]
+        return max((a for a in ages if a is not None), default=0.0)
+
+    @contextlib.contextmanager
+    def connection(self):
+        # A DuckDB cursor is an independent connection to the same database
+        with self._lock:
+            conn = self._db.cursor()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def kill_query(self, conn):
+        conn.interrupt()
+
+    @contextlib.contextmanager
+    def deadline(self, conn, seconds):
+        """
+        Interrupts the query on `conn` once it has run for `seconds` (0 or None: no
+        limit), the snapshot's stand-in for MAX_EXECUTION_TIME. Raises
+        SnapshotTimeoutError from the block when it did.
+        """
+        if not seconds:
+            yield
+            return
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self.kill_query(conn)
+
+        timer = threading.Timer(seconds, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        except Exception as e:
+            if expired.is_set():
+                raise SnapshotTimeoutError(f"The query ran longer than its {seconds:g}s time limit.") from e
+            raise
+        finally:
+            timer.cancel()
+
+    def discard_on_release(self, conn):
+        pass  # The cursor is closed on release anyway
+
+    def stats(self):
+        with self._lock:
+            decisions = dict(self.decisions)
+        return {
+            "database": self.database,
+            "route": self.route_mode,
+            "decisions": decisions,
+            "fallbacks": self.fallbacks,
+            "tables": {snapshot.name: snapshot.stats() for snapshot in self.tables.values()},
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class SnapshotManager:
+    """
+    Snapshot engines by database and MySQL user (a session's scope, so nobody reads
+    a copy made with someone else's grants) and the background thread that
+    refreshes their tables. `tables` is {table: {"incremental_column",
+    "refresh_seconds", "max_staleness_seconds"}} (all optional); the same tables are
+    snapshotted for every database that has them. Refreshes read through the pool
+    of the latest session in that scope, so they use a replica when it has one.
+    """
+
+    def __init__(self, directory=".snapshots", tables=None, refresh_interval=600, max_staleness=900,
+                 route="analytical"):
+        if duckdb is None or pa is None:
+            raise RuntimeError("Snapshots need duckdb and pyarrow (pip install duckdb pyarrow)")
+        self.directory = directory
+        self.specs = tables or {}
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.route = route
+        self._engines = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            for engine in list(self._engines.values()):
+                try:
+                    engine.refresh_due()
+                except Exception as e:
+                    logger.error(f"Snapshot refresh loop error: {e}")
+            self._wake.wait(1.0)
+            self._wake.clear()
+
+    def engine_for(self, session):
+        """The engine for `session`'s database and user, created (and its first refresh queued) on first use."""
+        with self._lock:
+            engine = self._engines.get(session.scope)
+            if engine is None:
+                digest = hashlib.sha1(session.scope.encode("utf-8")).hexdigest()[:16]
+                engine = SnapshotEngine(
+                    os.path.join(self.directory, digest), session.schema_model.database, self.route
+                )
+                self._engines[session.scope] = engine
+            engine.configure(self.specs, session.schema_model, self.refresh_interval, self.max_staleness)
+            engine.source = session.pool
+            self._start()
+        self._wake.set()
+        return engine
+
+    def request_refresh(self, scope, tables=None, full=False):
+        """Queues a refresh of `tables` (all by default) of the database `scope`; returns their names."""
+        engine = self._engines.get(scope)
+        if engine is None:
+            return []
+        queued = []
+        for snapshot in engine.tables.values():
+            if tables and snapshot.name.lower() not in {t.lower() for t in tables}:
+                continue
+            snapshot.refresh_requested = True
+            snapshot.full_requested = snapshot.full_requested or full
+            snapshot.last_attempt = 0.0
+            snapshot.last_error = None
+            queued.append(snapshot.name)
+        self._wake.set()
+        return queued
+
+    def stats(self, scope=None):
+        engines = self._engines if scope is None else {k: v for k, v in self._engines.items() if k == scope}
+        return {key: engine.stats() for key, engine in engines.items()}
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        for engine in self._engines.values():
+            engine.close()
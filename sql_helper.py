@@ -0,0 +1,171 @@
+import re
+
+# Lightweight SQL inspection for generated queries. This is not a full parser:
+# it understands enough MySQL SELECT syntax to find the tables a query reads.
+
+# String literals, quoted names and comments in one left-to-right pass, so a '#' or
+# '--' inside a string is no comment and a quote inside a comment starts no string
+_LEXEME_RE = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`|/\*.*?\*/|(?:--|#)[^\n]*",
+    re.DOTALL,
+)
+_TOKEN_RE = re.compile(r"(?:`[^`]*`|[A-Za-z0-9_$])+(?:\.(?:`[^`]*`|[A-Za-z0-9_$]+))*|[(),;]|\S")
+
+# Keywords that end a FROM/JOIN table list
+_CLAUSE_END = {
+    "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "UNION", "ON", "USING", "JOIN", "INNER", "LEFT",
+    "RIGHT", "CROSS", "STRAIGHT_JOIN", "NATURAL", "FULL", "OUTER", "WINDOW", "FOR", "LOCK", "INTO",
+    "SET", "VALUES", "SELECT", "EXCEPT", "INTERSECT", "PARTITION",
+}
+
+NON_DETERMINISTIC_FUNCTIONS = {
+    "RAND", "UUID", "UUID_SHORT", "SLEEP", "CONNECTION_ID", "LAST_INSERT_ID",
+    # The clock: "last 7 days" means something else tomorrow
+    "NOW", "CURDATE", "CURTIME", "SYSDATE", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP", "UNIX_TIMESTAMP", "LOCALTIME", "LOCALTIMESTAMP",
+}
+# Of those, the ones MySQL also accepts without parentheses (WHERE d = CURRENT_DATE)
+_NILADIC_FUNCTIONS = {
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP",
+    "LOCALTIME", "LOCALTIMESTAMP",
+}
+
+def is_comment(lexeme):
+    """True for a _LEXEME_RE match that is a comment rather than a quoted string or name."""
+    return lexeme.startswith(("/*", "--", "#"))
+
+def strip_comments_and_strings(sql):
+    """Blanks out comments and replaces string literals with '?' so keywords inside them are ignored."""
+    def replace(match):
+        lexeme = match.group(0)
+        if is_comment(lexeme):
+            return " "
+        return lexeme if lexeme.startswith("`") else "'?'"
+    return _LEXEME_RE.sub(replace, sql)
+
+def mask_comments_and_strings(sql):
+    """
+    `sql` with comments and quoted names blanked and string literals emptied (their
+    quotes kept), character for character, so positions still match the original.
+    """
+    def blank(match):
+        lexeme = match.group(0)
+        if is_comment(lexeme) or lexeme.startswith("`"):
+            return " " * len(lexeme)
+        return lexeme[0] + " " * (len(lexeme) - 2) + lexeme[-1]
+    return _LEXEME_RE.sub(blank, sql)
+
+def statement_text(sql):
+    """
+    The statement as written, for sending to the server: only surrounding whitespace,
+    trailing comments and trailing ';' are removed, so hints and literals are kept.
+    """
+    masked = mask_comments_and_strings(sql)
+    start = len(masked) - len(masked.lstrip())
+    end = len(masked.rstrip(" \t\r\n;"))
+    return sql[start:end] if end > start else ""
+
+def normalize_sql(sql):
+    """Canonical text for cache keys: comments removed, whitespace collapsed, trailing ';' dropped."""
+    parts, plain = [], []
+    last = 0
+    # Collapse whitespace only outside string literals and quoted names
+    for match in _LEXEME_RE.finditer(sql):
+        plain.append(sql[last:match.start()])
+        last = match.end()
+        if is_comment(match.group(0)):
+            plain.append(" ")
+        else:
+            parts.append(re.sub(r"\s+", " ", "".join(plain)))
+            parts.append(match.group(0))
+            plain = []
+    plain.append(sql[last:])
+    parts.append(re.sub(r"\s+", " ", "".join(plain)))
+    return "".join(parts).strip().rstrip(";").strip()
+
+def tokenize(sql):
+    return _TOKEN_RE.findall(strip_comments_and_strings(sql))
+
+def _unquote(name):
+    return ".".join(part.strip("`") for part in re.findall(r"`[^`]*`|[^.]+", name))
+
+def referenced_tables(sql):
+    """
+    Returns the sorted set of table names read by `sql` (from FROM/JOIN clauses,
+    including subqueries). CTE names are excluded. Schema-qualified names keep
+    their `db.` prefix.
+    """
+    tokens = tokenize(sql)
+    upper = [t.upper() for t in tokens]
+
+    # Names defined by WITH ... AS ( are not real tables
+    cte_names = set()
+    for i, tok in enumerate(upper):
+        if tok == "AS" and i + 1 < len(tokens) and tokens[i + 1] == "(" and i > 0:
+            prev = upper[i - 1]
+            if prev == ")":
+                # WITH name (col, ...) AS (
+                depth, j = 0, i - 1
+                while j > 0:
+                    if tokens[j] == ")":
+                        depth += 1
+                    elif tokens[j] == "(":
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    j -= 1
+                if j > 0:
+                    cte_names.add(_unquote(tokens[j - 1]).lower())
+            elif prev not in ("SELECT", ","):
+                cte_names.add(_unquote(tokens[i - 1]).lower())
+
+    tables = set()
+    table_list_starts = ("FROM", "JOIN", "STRAIGHT_JOIN", "UPDATE", "INTO")
+    # One entry per open paren: True for subqueries and join groups, False for
+    # function calls such as EXTRACT(YEAR FROM d) whose FROM is not a table list
+    parens = []
+    i = 0
+    while i < len(tokens):
+        tok = upper[i]
+        starts_list = tok in table_list_starts and (not parens or parens[-1])
+        if tok == "(":
+            nxt = upper[i + 1] if i + 1 < len(tokens) else ""
+            prev = upper[i - 1] if i > 0 else ""
+            join_group = prev in table_list_starts or (prev in ("(", ",") and parens and parens[-1])
+            parens.append(nxt in ("SELECT", "WITH", "(") or join_group)
+            # "FROM (a JOIN b)" - the group opens a table list of its own
+            starts_list = join_group and nxt not in ("SELECT", "WITH", "(")
+        elif tok == ")":
+            if parens:
+                parens.pop()
+
+        if starts_list:
+            i += 1
+            expect_table = True
+            while i < len(tokens):
+                tok = upper[i]
+                if tok in _CLAUSE_END or tok in ("(", ")", ";"):
+                    # Subqueries and join groups are handled by the outer loop
+                    break
+                if tok == ",":
+                    expect_table = True
+                elif expect_table:
+                    name = _unquote(tokens[i])
+                    is_identifier = tokens[i][0] == "`" or re.match(r"[\w$]", tokens[i])
+                    if is_identifier and name.lower() not in cte_names and tok != "DUAL":
+                        tables.add(name)
+                    expect_table = False
+                i += 1
+            continue
+        i += 1
+    return sorted(tables)
+
+def is_deterministic(sql):
+    """False if the query calls functions whose result differs run to run (RAND(), NOW(), CURRENT_DATE, ...)."""
+    tokens = [t.upper() for t in tokenize(sql)]
+    for i, tok in enumerate(tokens):
+        if tok in _NILADIC_FUNCTIONS:
+            return False
+        if tok in NON_DETERMINISTIC_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1] == "(":
+            return False
+    return True
@@ -5,6 +5,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const chatContainer = document.getElementById('chatContainer');
     const connectionStatus = document.getElementById('connectionStatus');
     const statusText = connectionStatus.querySelector('.status-text');
+    // Returned by /api/connect; identifies this tab's database session to the server
+    let sessionId = null;
+    // Slightly over the server's REQUEST_TIMEOUT_SECONDS, which answers with a timeout first
+    const CHAT_TIMEOUT_MS = 150000;
 
     // --- Helper Functions ---
     function addMessage(text, type) {
@@ -60,13 +64,14 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const response = await fetch('http://127.0.0.1:5000/api/connect', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'X-Session-ID': sessionId || '' },
                 body: JSON.stringify(data)
             });
 
             const result = await response.json();
 
             if (result.success) {
+                sessionId = result.session_id;
                 setStatus(true, "Connected to " + data.database);
                 addMessage(`Successfully connected to database: ${data.database}`, 'system-message');
             } else {
@@ -83,6 +88,22 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // Send Chat Message
+    // Parses one Server-Sent Events frame ("event: x\ndata: {...}") into {event, data}
+    function parseSseFrame(frame) {
+        let event = 'message';
+        const dataLines = [];
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+        });
+        return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+    }
+
+    function escapeHtml(value) {
+        return String(value === null || value === undefined ? '' : value)
+            .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    }
+
     async function sendMessage() {
         const query = userQuery.value.trim();
         if (!query) return;
@@ -100,64 +121,189 @@ document.addEventListener('DOMContentLoaded', () => {
         chatContainer.insertAdjacentHTML('beforeend', thinkingHtml);
         chatContainer.scrollTop = chatContainer.scrollHeight;
 
-        try {
-            const response = await fetch('http://127.0.0.1:5000/api/chat', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ query: query })
-            });
-            const result = await response.json();
+        // Elements are created as their events arrive
+        let stepsList = null;
+        let answerEl = null;
+        let answerText = '';
 
-            // Remove thinking placeholder
+        function removeThinking() {
             const thinkingEl = document.getElementById(thinkingId);
             if (thinkingEl) thinkingEl.remove();
+        }
 
-            if (result.success) {
-                // 1. Show Thinking Process
-                if (result.thought_process && result.thought_process.length > 0) {
-                    let stepsHtml = '<div class="thought-process"><div class="process-title"><i class="fa-solid fa-brain"></i> AI Reasoning</div><ul class="process-steps">';
-                    result.thought_process.forEach(step => {
-                        stepsHtml += `<li><i class="fa-solid fa-check"></i> ${step}</li>`;
-                    });
-                    stepsHtml += '</ul></div>';
+        // Keeps the placeholder at the bottom while content streams in above it
+        function append(el) {
+            const thinkingEl = document.getElementById(thinkingId);
+            if (thinkingEl) chatContainer.insertBefore(el, thinkingEl);
+            else chatContainer.appendChild(el);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
 
-                    const processDiv = document.createElement('div');
-                    processDiv.className = 'message bot process-container';
-                    processDiv.innerHTML = stepsHtml;
-                    chatContainer.appendChild(processDiv);
-                }
+        // 1. Show Thinking Process (one step at a time)
+        function showStep(step) {
+            if (!stepsList) {
+                const processDiv = document.createElement('div');
+                processDiv.className = 'message bot process-container';
+                processDiv.innerHTML = '<div class="thought-process"><div class="process-title"><i class="fa-solid fa-brain"></i> AI Reasoning</div><ul class="process-steps"></ul></div>';
+                append(processDiv);
+                stepsList = processDiv.querySelector('.process-steps');
+            }
+            const li = document.createElement('li');
+            li.innerHTML = `<i class="fa-solid fa-check"></i> ${escapeHtml(step)}`;
+            stepsList.appendChild(li);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+
+        // 2. Show SQL Preview (Collapsible)
+        function showSql(sql) {
+            const sqlId = 'sql-' + Date.now();
+            const sqlDiv = document.createElement('div');
+            sqlDiv.className = 'message bot no-bg'; // Special class for non-bubble
+            sqlDiv.innerHTML = `
+                <div class="sql-container">
+                    <button class="sql-header" onclick="document.getElementById('${sqlId}').classList.toggle('visible')">
+                        <span><i class="fa-solid fa-code"></i> View Generated SQL</span>
+                        <i class="fa-solid fa-chevron-down"></i>
+                    </button>
+                    <div id="${sqlId}" class="sql-code-block">
+                        <pre><code class="language-sql">${escapeHtml(sql)}</code></pre>
+                    </div>
+                </div>`;
+            append(sqlDiv);
+        }
 
-                // 2. Show SQL Preview (Collapsible)
-                if (result.is_sql_query && result.sql_query) {
-                    const sqlId = 'sql-' + Date.now();
-                    const sqlHtml = `
-                        <div class="sql-container">
-                            <button class="sql-header" onclick="document.getElementById('${sqlId}').classList.toggle('visible')">
-                                <span><i class="fa-solid fa-code"></i> View Generated SQL</span>
-                                <i class="fa-solid fa-chevron-down"></i>
-                            </button>
-                            <div id="${sqlId}" class="sql-code-block">
-                                <pre><code class="language-sql">${result.sql_query}</code></pre>
-                            </div>
-                        </div>`;
-
-                    const sqlDiv = document.createElement('div');
-                    sqlDiv.className = 'message bot no-bg'; // Special class for non-bubble
-                    sqlDiv.innerHTML = sqlHtml;
-                    chatContainer.appendChild(sqlDiv);
+        // First rows of the result (Collapsible)
+        function showRows(result) {
+            if (!result.columns || result.columns.length === 0) return;
+            const rowsId = 'rows-' + Date.now();
+            const header = result.columns.map(c => `<th>${escapeHtml(c)}</th>`).join('');
+            const body = result.rows.map(row =>
+                `<tr>${row.map(v => `<td>${escapeHtml(v)}</td>`).join('')}</tr>`).join('');
+            const total = result.truncated ? `${result.row_count}+` : result.row_count;
+            const label = result.row_count > result.rows.length
+                ? `First ${result.rows.length} of ${total} rows`
+                : `${total} row${result.row_count === 1 ? '' : 's'}`;
+            // Full result downloads (streamed by the server, not limited to the preview)
+            const exportUrl = fmt => `http://127.0.0.1:5000/api/results/${result.query_id}/export?format=${fmt}&session_id=${encodeURIComponent(sessionId)}`;
+            const exportLinks = result.query_id ? `
+                <div class="export-links">
+                    <i class="fa-solid fa-download"></i> Full result:
+                    <a href="${exportUrl('csv')}">CSV</a>
+                    <a href="${exportUrl('ndjson')}">NDJSON</a>
+                    <a href="${exportUrl('arrow')}">Arrow</a>
+                </div>` : '';
+            const rowsDiv = document.createElement('div');
+            rowsDiv.className = 'message bot no-bg';
+            rowsDiv.innerHTML = `
+                <div class="sql-container">
+                    <button class="sql-header" onclick="document.getElementById('${rowsId}').classList.toggle('visible')">
+                        <span><i class="fa-solid fa-table"></i> ${label}</span>
+                        <i class="fa-solid fa-chevron-down"></i>
+                    </button>
+                    <div id="${rowsId}" class="sql-code-block result-preview">
+                        <table><thead><tr>${header}</tr></thead><tbody>${body}</tbody></table>
+                        ${exportLinks}
+                    </div>
+                </div>`;
+            append(rowsDiv);
+        }
+
+        // 3. Show Final Response (grows as tokens arrive)
+        function showAnswerChunk(text) {
+            removeThinking();
+            if (!answerEl) {
+                const div = document.createElement('div');
+                div.className = 'message bot';
+                div.innerHTML = '<div class="message-content"></div>';
+                append(div);
+                answerEl = div.querySelector('.message-content');
+            }
+            answerText += text;
+            answerEl.textContent = answerText;
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+
+        // Right/wrong buttons; verified answers become examples for similar questions
+        function showFeedback(queryId) {
+            const div = document.createElement('div');
+            div.className = 'message bot no-bg feedback-links';
+            div.innerHTML = `
+                Was this answer right?
+                <button data-correct="true"><i class="fa-solid fa-thumbs-up"></i></button>
+                <button data-correct="false"><i class="fa-solid fa-thumbs-down"></i></button>`;
+            div.querySelectorAll('button').forEach(button => button.addEventListener('click', async () => {
+                div.querySelectorAll('button').forEach(b => b.disabled = true);
+                try {
+                    const response = await fetch('http://127.0.0.1:5000/api/feedback', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json', 'X-Session-ID': sessionId || '' },
+                        body: JSON.stringify({ query_id: queryId, correct: button.dataset.correct === 'true' })
+                    });
+                    div.textContent = response.ok ? 'Thanks for the feedback.' : 'Feedback could not be saved.';
+                } catch (error) {
+                    div.textContent = 'Feedback could not be saved.';
                 }
+            }));
+            append(div);
+        }
 
-                // 3. Show Final Response
-                addMessage(result.response, 'bot');
+        function handleEvent({ event, data }) {
+            if (event === 'step') showStep(data);
+            else if (event === 'sql') showSql(data);
+            else if (event === 'rows') showRows(data);
+            else if (event === 'answer') showAnswerChunk(data);
+            else if (event === 'answer_reset') {
+                answerText = '';
+                if (answerEl) answerEl.textContent = '';
+            } else if (event === 'done') {
+                removeThinking();
+                if (!data.success) addMessage(`Error: ${data.error}`, 'bot');
+                else if (!answerEl) addMessage(data.response, 'bot');
+                if (data.success && data.query_id) showFeedback(data.query_id);
+            }
+        }
 
-            } else {
-                addMessage(`Error: ${result.error}`, 'bot');
+        // Give up a little after the server's own deadline; aborting cancels the question server-side
+        const controller = new AbortController();
+        const abortTimer = setTimeout(() => controller.abort(), CHAT_TIMEOUT_MS);
+
+        try {
+            const response = await fetch('http://127.0.0.1:5000/api/chat/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'X-Session-ID': sessionId || '' },
+                body: JSON.stringify({ query: query }),
+                signal: controller.signal
+            });
+
+            if (!response.ok || !response.body) {
+                const result = await response.json();
+                removeThinking();
+                const retryHint = result.retry_after ? ` (try again in ${result.retry_after}s)` : '';
+                addMessage(`Error: ${result.error}${retryHint}`, 'bot');
+                return;
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    if (frame.trim()) handleEvent(parseSseFrame(frame));
+                }
             }
         } catch (error) {
-            const thinkingEl = document.getElementById(thinkingId);
-            if (thinkingEl) thinkingEl.remove();
-            addMessage(`Communication Error: ${error.message}`, 'bot');
+            removeThinking();
+            if (error.name === 'AbortError') addMessage('No answer in time; the question was cancelled.', 'bot');
+            else addMessage(`Communication Error: ${error.message}`, 'bot');
         } finally {
+            clearTimeout(abortTimer);
+            removeThinking();
             sendBtn.disabled = false;
             userQuery.focus();
             chatContainer.scrollTop = chatContainer.scrollHeight;
@@ -0,0 +1,151 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Only needed for SESSION_STORE = "redis"
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Small key -> JSON value stores with per-key TTL, for state that every worker
+# process must see (sessions, query handles). All three share one interface:
+# get(key), set(key, value, ttl=None), touch(key, ttl), delete(key), stats().
+#   MemoryStore  - in-process LRU; one worker only
+#   SqliteStore  - a file shared by the worker processes on one host
+#   RedisStore   - shared by workers on any number of hosts
+
+class MemoryStore:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()  # key -> (json_text, expires_at or None)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.time() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        # Stored as JSON so callers get the same copy semantics as the shared stores
+        entry = (json.dumps(value), time.time() + ttl if ttl else None)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def touch(self, key, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], time.time() + ttl if ttl else None)
+                self._entries.move_to_end(key)  # In use, so last to be evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "evictions": self.evictions}
+
+class SqliteStore:
+    PURGE_EVERY = 500  # writes between sweeps of expired rows
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")  # Readers in other workers don't block writers
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv_store ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM kv_store WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._db.execute("DELETE FROM kv_store WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def set(self, key, value, ttl=None):
+        self._write(
+            "INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+
+    def touch(self, key, ttl):
+        self._write("UPDATE kv_store SET expires_at = ? WHERE key = ?", (time.time() + ttl if ttl else None, key))
+
+    def delete(self, key):
+        self._write("DELETE FROM kv_store WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            count = self._db.execute(
+                "SELECT COUNT(*) FROM kv_store WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": count}
+
+class RedisStore:
+    def __init__(self, url="redis://localhost:6379/0", prefix="talk2db:"):
+        if redis is None:
+            raise RuntimeError("SESSION_STORE 'redis' requires the redis package")
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def touch(self, key, ttl):
+        if ttl:
+            self._client.expire(self.prefix + key, int(ttl))
+        else:
+            self._client.persist(self.prefix + key)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def stats(self):
+        return {"backend": "redis", "url": self.url.split("@")[-1]}  # Never echo credentials
+
+def make_store(backend="memory", path="sessions.db", url=None, max_entries=10000):
+    """Builds the store named by `backend`: "memory", "sqlite" or "redis"."""
+    if backend == "memory":
+        return MemoryStore(max_entries)
+    if backend == "sqlite":
+        return SqliteStore(path)
+    if backend == "redis":
+        return RedisStore(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown store backend: {backend}")
@@ -0,0 +1,61 @@
+import decimal
+
+import pytest
+
+import answer_helper
+
+@pytest.mark.parametrize("column, text", [
+    ("total_amount", "total amount"),
+    ("orderCount", "order count"),
+    ("COUNT(*)", "count"),
+    ("SUM(o.total_amount)", "total total amount"),
+    ("count(DISTINCT customer_id)", "number of distinct customer id"),
+    ("`c`.`full_name`", "full name"),
+])
+def test_label(column, text):
+    assert answer_helper.label(column) == text
+
+@pytest.mark.parametrize("columns, rows, sql, kind", [
+    (["n"], [], "", "empty"),
+    (["n"], [(3,)], "", "single_value"),
+    (["id", "name"], [(1, "a")], "", "single_row"),
+    (["name"], [("a",), ("b",)], "", "list"),
+    (["status", "n"], [("paid", 3), ("open", 1)], "SELECT status, COUNT(*) n FROM o GROUP BY status", "group_by"),
+    (["name", "total"], [("a", 9), ("b", 4)], "SELECT name, total FROM t ORDER BY total DESC", "ranking"),
+    (["name", "total"], [("a", 9), ("b", 4)], "SELECT name, total FROM t", None),
+    (["name", "city"], [("a", "x"), ("b", "y")], "SELECT name, city FROM t ORDER BY name", None),
+    (["name"], [("a",)] * (answer_helper.MAX_LIST_ROWS + 1), "", None),
+])
+def test_shape(columns, rows, sql, kind):
+    assert answer_helper.shape(columns, rows, sql) == kind
+
+def test_synthesize_from_templates():
+    assert answer_helper.synthesize(["COUNT(*)"], [(1234,)]) == "The count is 1,234."
+    assert answer_helper.synthesize(["avg_total"], [(decimal.Decimal("2.5"),)]) == "The avg total is 2.50."
+    assert answer_helper.synthesize(["name"], [("a",), ("b",), ("c",)]) == "The 3 matching name values are a, b and c."
+    assert answer_helper.synthesize(["name"], [("a",), ("b",)], truncated=True) is None
+
+def test_render_template_needs_every_placeholder():
+    assert answer_helper.render_template("There are {total} orders.", ["total"], [(5,)]) == "There are 5 orders."
+    assert answer_helper.render_template("There are {count} orders.", ["COUNT(*)"], [(5,)]) == "There are 5 orders."
+    assert answer_helper.render_template("{total} orders by {name}", ["total"], [(5,)]) is None
+    assert answer_helper.render_template("{total}", ["total"], [(5,), (6,)]) is None
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf"), decimal.Decimal("NaN")])
+def test_non_finite_values_are_left_to_the_model(value):
+    assert answer_helper.format_value(value) is None
+    assert answer_helper.synthesize(["avg_total"], [(value,)]) is None
+    assert answer_helper.synthesize(["name", "total"], [("a", 1.0), ("b", value)], "SELECT * FROM t ORDER BY total DESC") is None
+    assert answer_helper.render_template("Average {avg_total}", ["avg_total"], [(value,)]) is None
+    assert answer_helper.synthesize(["avg_total"], [(value,)], force=True).startswith("The query returned 1 rows")
+
+@pytest.mark.parametrize("sql, wording", [
+    ("SELECT name, total FROM t ORDER BY total DESC LIMIT 2", "the top 2"),
+    ("SELECT name, total FROM t ORDER BY total LIMIT 2", "the lowest 2"),
+    ("SELECT name, total FROM t ORDER BY total ASC, name DESC", "the lowest 2"),
+    ("SELECT name, total FROM t ORDER BY SUM(total) DESC", "the top 2"),
+    ("SELECT * FROM (SELECT name, total FROM t ORDER BY total DESC) x ORDER BY total", "the lowest 2"),
+])
+def test_ranking_follows_the_sort_direction(sql, wording):
+    answer = answer_helper.synthesize(["name", "total"], [("a", 9), ("b", 4)], sql)
+    assert answer.startswith(f"Ranked by total, {wording} are")
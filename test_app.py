@@ -0,0 +1,49 @@
+import pytest
+
+import app
+
+CONNECTIONS = {
+    "prod": {"host": "db.internal", "port": 3307, "user": "reporter", "password": "s3cret", "database": "shop"},
+}
+
+@pytest.fixture
+def client(monkeypatch):
+    attempts = []
+
+    def try_connect(params):
+        attempts.append(params)
+        return False, "refused"
+
+    monkeypatch.setattr(app, "DB_CONNECTIONS", CONNECTIONS)
+    monkeypatch.setattr(app, "try_connect", try_connect)
+    test_client = app.app.test_client()
+    test_client.attempts = attempts
+    return test_client
+
+@pytest.mark.parametrize("override", [{"host": "attacker.example"}, {"port": 3306}, {"user": "root"}])
+def test_named_connection_rejects_server_overrides(client, override):
+    response = client.post("/api/connect", json=dict({"connection": "prod"}, **override))
+    assert response.status_code == 400
+    assert client.attempts == []
+
+def test_named_connection_may_pick_another_database(client):
+    client.post("/api/connect", json={"connection": "prod", "database": "archive", "host": ""})
+    params = client.attempts[0]
+    assert (params["host"], params["port"], params["user"], params["database"]) == (
+        "db.internal", 3307, "reporter", "archive"
+    )
+    assert params["password"] == "s3cret"
+
+def test_unknown_named_connection(client):
+    assert client.post("/api/connect", json={"connection": "nope"}).status_code == 400
+
+def test_restored_named_sessions_get_credentials_from_the_config(client):
+    with pytest.raises(ConnectionError):
+        app.open_connection({"connection": "prod", "host": "db.internal", "port": 3307, "user": "reporter",
+                             "database": "archive"})
+    assert client.attempts[0]["password"] == "s3cret"
+    assert client.attempts[0]["database"] == "archive"
+
+def test_query_handles_do_not_share_the_in_memory_session_lru():
+    assert app.SESSION_STORE != "memory" or app.query_handle_store is not app.session_store
+    assert app.ai_helper.query_store.store is app.query_handle_store
@@ -0,0 +1,12 @@
+import batch_helper
+
+def test_dedupe_keeps_questions_with_different_words_apart():
+    groups = batch_helper.dedupe(["How many customers are there?", "List all customers", "Show me the customers"])
+    assert [indexes for _, indexes in groups] == [[0], [1], [2]]
+
+def test_dedupe_merges_case_punctuation_and_spacing():
+    groups = batch_helper.dedupe(["Top 10 customers!", "top 10  customers", "  TOP 10 CUSTOMERS?"])
+    assert groups == [("Top 10 customers!", [0, 1, 2])]
+
+def test_dedupe_drops_blank_and_non_text_questions():
+    assert batch_helper.dedupe(["", "   ", None, 3, "Orders per status"]) == [("Orders per status", [4])]
@@ -0,0 +1,50 @@
+import cache_helper
+
+def test_question_key_ignores_case_punctuation_and_spacing():
+    assert cache_helper.question_key("How many customers are there?") == "how many customers are there"
+    assert cache_helper.question_key("  how many   Customers are there ") == "how many customers are there"
+
+def test_question_key_keeps_every_word():
+    keys = {
+        cache_helper.question_key(q)
+        for q in ("How many customers are there?", "List all customers", "Show me the customers")
+    }
+    assert len(keys) == 3
+
+def test_question_key_keeps_numbers_and_identifiers():
+    assert cache_helper.question_key("Orders over 3.5 in order_items!") == "orders over 3.5 in order_items"
+
+def test_make_key_separates_questions_and_schemas():
+    key = cache_helper.QuestionCache.make_key("List all customers", "f1")
+    assert key != cache_helper.QuestionCache.make_key("How many customers are there?", "f1")
+    assert key != cache_helper.QuestionCache.make_key("List all customers", "f2")
+    assert cache_helper.QuestionCache.make_key("?!", "f1") is None
+
+def test_question_cache_does_not_serve_a_count_for_a_list():
+    cache = cache_helper.QuestionCache()
+    cache.put(cache.make_key("How many customers are there?", "f"), "SELECT COUNT(*) FROM customers")
+    assert cache.get(cache.make_key("List all customers", "f")) is None
+    assert cache.get(cache.make_key("how many customers are there", "f")) == "SELECT COUNT(*) FROM customers"
+
+def test_result_cache_is_not_shared_across_scopes():
+    cache = cache_helper.ResultCache()
+    versions = {"customers": "v1"}
+    assert cache.put("SELECT name FROM customers", versions, ["name"], [("Ann",)], scope="admin@db:3306/shop")
+    assert cache.get("SELECT name FROM customers", versions, scope="analyst@db:3306/shop") is None
+    assert cache.get("SELECT name FROM customers", versions, scope="admin@db:3306/shop") == (["name"], [("Ann",)])
+
+def test_table_versions_are_polled_per_scope():
+    cache = cache_helper.ResultCache(poll_interval=60)
+    polled = []
+
+    def fetch(tables):
+        polled.append(tables)
+        return {t: "v1" for t in tables}
+
+    cache.table_versions(["customers"], fetch, scope="admin@db:3306/shop")
+    cache.table_versions(["customers"], fetch, scope="analyst@db:3306/shop")
+    assert len(polled) == 2
+
+def test_result_cache_skips_clock_dependent_sql():
+    cache = cache_helper.ResultCache()
+    assert not cache.put("SELECT * FROM orders WHERE d = CURDATE()", {"orders": "v1"}, ["d"], [(1,)])
@@ -0,0 +1,66 @@
+import mysql.connector
+import pytest
+
+import cancel_helper
+import db_helper
+
+class _Cursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql):
+        self.log.append(sql)
+
+    def close(self):
+        pass
+
+class _Conn:
+    def __init__(self, connection_id=None):
+        self.connection_id = connection_id
+        self.executed = []
+        self.closed = False
+
+    def cursor(self):
+        return _Cursor(self.executed)
+
+    def close(self):
+        self.closed = True
+
+def test_cancel_before_execution_stops_attach():
+    running = cancel_helper.RunningQuery()
+    assert running.cancel() is False
+    with pytest.raises(cancel_helper.QueryCancelledError):
+        running.attach(object(), _Conn())
+    assert running.killed is False
+
+def test_cancel_during_execution_kills_on_separate_connection(monkeypatch):
+    killers = []
+
+    def connect(**config):
+        killers.append(_Conn())
+        return killers[-1]
+
+    monkeypatch.setattr(mysql.connector, "connect", connect)
+    pool = db_helper.ConnectionPool({"host": "db"})
+    running_conn = _Conn(connection_id=42)
+    running = cancel_helper.RunningQuery()
+    running.attach(pool, running_conn)
+
+    assert running.cancel() is True
+    assert running.killed and running.cancelled
+    assert len(killers) == 1 and killers[0] is not running_conn
+    assert killers[0].executed == ["KILL QUERY 42"] and killers[0].closed
+    assert running_conn.executed == []
+    # The killed connection is closed on release rather than reused
+    assert id(running_conn) in pool._doomed
+
+def test_cancel_after_detach_kills_nothing():
+    class _Pool:
+        def kill_query(self, conn):
+            raise AssertionError("nothing is running")
+
+    running = cancel_helper.RunningQuery()
+    running.attach(_Pool(), _Conn())
+    running.detach()
+    assert running.cancel() is False
+    assert running.cancelled and not running.killed
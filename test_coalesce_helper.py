@@ -0,0 +1,82 @@
+import asyncio
+import types
+
+import ai_helper
+import coalesce_helper
+import result_helper
+
+async def _collect(events):
+    return [item async for item in events]
+
+def _run(started, release):
+    async def events():
+        started.append(1)
+        yield "step", "Generating SQL..."
+        await release.wait()
+        yield "done", {"success": True, "query_id": "leader"}
+    return events
+
+def test_identical_questions_share_one_run():
+    async def main():
+        coalescer = coalesce_helper.Coalescer()
+        started, release = [], asyncio.Event()
+        first = asyncio.ensure_future(_collect(coalescer.subscribe("key", _run(started, release))))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(_collect(coalescer.subscribe("key", _run(started, release))))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second, started, coalescer.stats()
+
+    first, second, started, stats = asyncio.run(main())
+    assert started == [1]
+    assert first[-1] == ("done", {"success": True, "query_id": "leader"})
+    assert second[0][0] == "step" and second[0][1].startswith("Joined")
+    assert second[-1] == ("done", {"success": True, "query_id": "leader", "coalesced": True})
+    assert stats["runs"] == 1 and stats["coalesced"] == 1 and stats["in_flight"] == 0
+
+def test_different_keys_run_separately():
+    async def main():
+        coalescer = coalesce_helper.Coalescer()
+        started, release = [], asyncio.Event()
+        release.set()
+        await _collect(coalescer.subscribe("a", _run(started, release)))
+        await _collect(coalescer.subscribe("b", _run(started, release)))
+        return started
+
+    assert asyncio.run(main()) == [1, 1]
+
+def test_run_is_cancelled_when_every_subscriber_leaves():
+    async def main():
+        coalescer = coalesce_helper.Coalescer()
+        started, release = [], asyncio.Event()
+        events = coalescer.subscribe("key", _run(started, release))
+        assert await events.__anext__() == ("step", "Generating SQL...")
+        flight = coalescer._flights["key"]
+        await events.aclose()
+        await asyncio.sleep(0)
+        return flight.task.cancelled(), coalescer.stats()["in_flight"]
+
+    assert asyncio.run(main()) == (True, 0)
+
+def test_followers_get_a_query_handle_of_their_own(monkeypatch):
+    store = result_helper.QueryStore()
+    monkeypatch.setattr(ai_helper, "query_store", store)
+    query_id = store.register("SELECT 1", ["1"], 1, False, "leader")
+
+    async def events():
+        yield "step", "Joined an identical question that is already being answered."
+        yield "rows", {"columns": ["1"], "rows": [[1]], "query_id": query_id}
+        yield "done", {"success": True, "query_id": query_id, "coalesced": True}
+
+    async def main(session_id):
+        session = types.SimpleNamespace(id=session_id)
+        return await _collect(ai_helper._own_query_ids(events(), session))
+
+    leader = asyncio.run(main("leader"))
+    assert leader[1][1]["query_id"] == leader[2][1]["query_id"] == query_id
+
+    follower = asyncio.run(main("follower"))
+    adopted = follower[1][1]["query_id"]
+    assert adopted != query_id and follower[2][1]["query_id"] == adopted
+    assert store.get(adopted, "follower")["sql"] == "SELECT 1"
+    assert store.get(query_id, "follower") is None
@@ -0,0 +1,77 @@
+import asyncio
+import types
+
+import pytest
+from google.genai import errors
+
+import context_cache_helper
+
+class _Service(context_cache_helper.LocalCacheService):
+    def __init__(self, failures=()):
+        super().__init__()
+        self.failures = list(failures)
+        self.created = 0
+
+    async def create(self, model, config):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.created += 1
+        return await super().create(model, config)
+
+def _client(service):
+    return types.SimpleNamespace(aio=types.SimpleNamespace(caches=service))
+
+def _get(cache, client, fingerprint="f1"):
+    return asyncio.run(cache.get(client, "gemini", "app@db", fingerprint, "schema text"))
+
+def test_creates_once_and_reuses_the_entry():
+    service = _Service()
+    cache = context_cache_helper.ContextCache()
+    name = _get(cache, _client(service))
+    assert service.contents(name) == "schema text"
+    assert _get(cache, _client(service)) == name
+    assert service.created == 1 and cache.stats()["hits"] == 1
+
+def test_schema_change_replaces_the_entry():
+    service = _Service()
+    cache = context_cache_helper.ContextCache()
+    first = _get(cache, _client(service), "f1")
+    second = _get(cache, _client(service), "f2")
+    assert first != second and service.contents(first) is None
+    assert cache.stats()["invalidations"] == 1
+
+@pytest.mark.parametrize("error", [
+    errors.APIError(400, {"error": {"message": "Cached content is too small", "status": "INVALID_ARGUMENT"}}),
+    RuntimeError("400 INVALID_ARGUMENT: content too small"),
+])
+def test_permanent_refusals_are_remembered_per_schema(error):
+    service = _Service([error])
+    cache = context_cache_helper.ContextCache()
+    assert _get(cache, _client(service)) is None
+    assert _get(cache, _client(service)) is None and service.created == 0
+    assert _get(cache, _client(service), "f2") is not None
+
+@pytest.mark.parametrize("error", [
+    errors.APIError(503, {"error": {"message": "The service is currently unavailable", "status": "UNAVAILABLE"}}),
+    RuntimeError("429 RESOURCE_EXHAUSTED"),
+    ConnectionError("Connection reset by peer"),
+])
+def test_transient_failures_are_retried_after_a_backoff(error):
+    service = _Service([error])
+    cache = context_cache_helper.ContextCache()
+    assert _get(cache, _client(service)) is None
+    assert _get(cache, _client(service)) is None and service.created == 0  # Backing off
+    key = ("gemini", "app@db")
+    cache._retry_at[key] -= context_cache_helper.RETRY_SECONDS
+    assert _get(cache, _client(service)) is not None
+    assert key not in cache._retry_at
+
+def test_models_without_caching_are_skipped():
+    service = _Service([RuntimeError("400 Model gemini-x does not support cached content")])
+    cache = context_cache_helper.ContextCache()
+    assert _get(cache, _client(service)) is None
+    assert cache.stats()["unsupported_models"] == ["gemini"]
+
+def test_missing_cache_errors():
+    assert context_cache_helper.is_missing_cache_error("404 NOT_FOUND: CachedContent cachedContents/x not found")
+    assert not context_cache_helper.is_missing_cache_error("404 model not found")
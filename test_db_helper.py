@@ -0,0 +1,74 @@
+import time
+
+import mysql.connector
+import pytest
+
+import db_helper
+
+class _Conn:
+    def __init__(self, rollback_error=None):
+        self.rollback_error = rollback_error
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        if self.rollback_error:
+            raise self.rollback_error
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def connect(**config):
+        conns.append(_Conn())
+        return conns[-1]
+
+    monkeypatch.setattr(mysql.connector, "connect", connect)
+    return conns
+
+def test_checkout_times_out_when_exhausted(opened):
+    pool = db_helper.ConnectionPool({}, size=1, checkout_timeout=0.05)
+    conn = pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(db_helper.PoolTimeoutError):
+        pool.acquire()
+    assert time.monotonic() - start >= 0.05
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()["waits"] == 0
+
+def test_idle_connections_evicted(opened):
+    pool = db_helper.ConnectionPool({}, size=2, max_idle=0.01)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.02)
+    second = pool.acquire()
+    assert second is not first and first.closed
+    stats = pool.stats()
+    assert stats["evicted"] == 1 and stats["created"] == 2 and stats["open"] == 1
+
+def test_broken_connection_not_reused(opened):
+    pool = db_helper.ConnectionPool({}, size=1)
+    with pytest.raises(mysql.connector.errors.OperationalError):
+        with pool.connection() as conn:
+            raise mysql.connector.errors.OperationalError("Lost connection")
+    assert conn.closed
+    assert pool.stats()["open"] == 0
+    with pool.connection() as fresh:
+        assert fresh is not conn
+
+def test_failed_rollback_and_discard_on_release_close_connection(opened):
+    pool = db_helper.ConnectionPool({}, size=2)
+    unreadable = pool.acquire()
+    unreadable.rollback_error = RuntimeError("Unread result found")
+    pool.release(unreadable)
+    doomed = pool.acquire()
+    pool.discard_on_release(doomed)
+    pool.release(doomed)
+    assert unreadable.closed and doomed.closed
+    assert pool.stats()["idle"] == 0 and pool.stats()["open"] == 0
@@ -0,0 +1,58 @@
+import types
+
+import example_helper
+import metrics_helper
+
+def _session(scope="app@127.0.0.1:3306/shop", tables=("orders", "customers")):
+    return types.SimpleNamespace(scope=scope, schema_model=types.SimpleNamespace(tables=list(tables)))
+
+def _record(store, session, question, sql, query_id, rows=5):
+    trace = metrics_helper.Trace("chat")
+    with trace.span("generate"):
+        pass
+    with trace.span("fetch", rows=rows):
+        pass
+    trace.finish()
+    store.record_run(session, question, trace, {
+        "success": True, "is_sql_query": True, "sql_query": sql, "query_id": query_id
+    })
+
+def test_make_key_keeps_questions_with_different_words_apart():
+    make_key = example_helper.ExampleStore.make_key
+    assert make_key("s", "Orders per customer") != make_key("s", "Orders for the customer")
+    assert make_key("s", "Top 10 customers?") == make_key("s", "top 10  CUSTOMERS")
+    assert make_key("a", "Top 10 customers") != make_key("b", "Top 10 customers")
+    assert make_key("s", "?!") is None
+
+def test_examples_are_used_once_marked_right():
+    store = example_helper.ExampleStore(verify_seconds=3600)
+    session = _session()
+    _record(store, session, "How many orders per customer?", "SELECT customer_id, COUNT(*) FROM orders GROUP BY 1", "q1")
+    assert store.nearest(session.scope, "orders per customer") == []  # not verified yet
+
+    assert store.feedback("q1", True) == "How many orders per customer?"
+    [(similarity, example)] = store.nearest(session.scope, "orders per customer")
+    assert example.sql.startswith("SELECT customer_id") and similarity > 0.3
+    assert store.nearest("other@127.0.0.1:3306/shop", "orders per customer") == []
+    assert store.nearest(session.scope, "orders per customer", {"customers"}) == []
+
+def test_wrong_answers_are_dropped_and_never_kept_again():
+    store = example_helper.ExampleStore(verify_seconds=0)
+    session = _session()
+    sql = "SELECT COUNT(*) FROM orders"
+    _record(store, session, "How many orders?", sql, "q1")
+    assert store.nearest(session.scope, "how many orders")
+
+    store.feedback("q1", False)
+    assert store.nearest(session.scope, "how many orders") == []
+    _record(store, session, "how many orders", sql, "q2")
+    assert store.nearest(session.scope, "how many orders") == []
+    assert store.stats()["first_attempts"]["without_examples"]["corrected"] == 1
+
+def test_shared_answers_take_feedback_under_either_id():
+    store = example_helper.ExampleStore(verify_seconds=3600)
+    session = _session()
+    _record(store, session, "How many orders?", "SELECT COUNT(*) FROM orders", "leader")
+    store.share("leader", "follower")
+    assert store.feedback("follower", True) == "How many orders?"
+    assert store.nearest(session.scope, "how many orders")
@@ -0,0 +1,56 @@
+import datetime
+import decimal
+import io
+import json
+
+import pytest
+from mysql.connector.constants import FieldType
+
+import export_helper
+
+def _field(name, type_code, charset=33):
+    return (name, type_code, None, None, None, None, True, 0, charset)
+
+DESCRIPTION = [
+    _field("id", FieldType.LONGLONG),
+    _field("price", FieldType.NEWDECIMAL),
+    _field("digest", FieldType.STRING, export_helper.BINARY_CHARSET),
+    _field("created", FieldType.DATETIME),
+]
+PAGES = [
+    (DESCRIPTION, [(1, decimal.Decimal("12345678901234567890.123"), b"\x00\xff", datetime.datetime(2024, 1, 2, 3, 4, 5))]),
+    (DESCRIPTION, [(2, decimal.Decimal("0.10"), None, None), (3, None, b"\x01", None)]),
+]
+
+def test_csv_writes_the_header_once_and_one_chunk_per_page():
+    chunks = list(export_helper.export_csv(PAGES))
+    assert len(chunks) == 2
+    assert chunks[0].splitlines()[0] == "id,price,digest,created"
+    assert "12345678901234567890.123" in chunks[0]
+    assert chunks[1].splitlines() == ["2,0.10,,", "3,,\x01,"]
+
+def test_ndjson_keeps_decimals_exact():
+    chunks = list(export_helper.export_ndjson(PAGES))
+    assert len(chunks) == 2
+    first = json.loads(chunks[0])
+    assert first["price"] == "12345678901234567890.123" and first["created"] == "2024-01-02T03:04:05"
+    assert [json.loads(line)["price"] for line in chunks[1].splitlines()] == ["0.10", None]
+
+def test_arrow_keeps_decimals_as_text_and_binary_as_bytes():
+    pa = pytest.importorskip("pyarrow")
+    chunks = list(export_helper.export_arrow(PAGES))
+    assert len(chunks) == 3  # One per page, then the end of stream
+    table = pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+    assert table.schema.field("id").type == pa.int64()
+    assert table.schema.field("price").type == pa.string()
+    assert table.schema.field("digest").type == pa.binary()
+    assert table.column("price").to_pylist() == ["12345678901234567890.123", "0.10", None]
+    assert table.column("digest").to_pylist() == [b"\x00\xff", None, b"\x01"]
+
+def test_empty_results():
+    empty = [(DESCRIPTION, [])]
+    assert list(export_helper.export_csv(empty)) == ["id,price,digest,created\r\n"]
+    assert list(export_helper.export_ndjson(empty)) == [""]
+    pa = pytest.importorskip("pyarrow")
+    table = pa.ipc.open_stream(io.BytesIO(b"".join(export_helper.export_arrow(empty)))).read_all()
+    assert table.num_rows == 0 and table.column_names == ["id", "price", "digest", "created"]
@@ -0,0 +1,81 @@
+import pytest
+
+import guard_helper
+
+HINT = "/*+ MAX_EXECUTION_TIME(5000) */"
+
+def test_timeout_hint_goes_on_the_outermost_select():
+    sql = guard_helper.with_timeout("SELECT id FROM t WHERE id IN (SELECT id FROM u)", 5)
+    assert sql == f"SELECT {HINT} id FROM t WHERE id IN (SELECT id FROM u)"
+
+def test_timeout_hint_after_with_clause():
+    sql = guard_helper.with_timeout("WITH c AS (SELECT 1 AS x) SELECT x FROM c", 5)
+    assert sql == f"WITH c AS (SELECT 1 AS x) SELECT {HINT} x FROM c"
+
+def test_parenthesized_union_still_gets_a_timeout():
+    sql = guard_helper.with_timeout("(SELECT 1) UNION (SELECT 2)", 5)
+    assert sql == f"(SELECT {HINT} 1) UNION (SELECT 2)"
+
+def test_timeout_ignores_select_in_strings_and_comments():
+    sql = guard_helper.with_timeout("/* SELECT */ (SELECT 'SELECT')", 5)
+    assert sql.endswith(f"(SELECT {HINT} 'SELECT')")
+
+def test_timeout_on_mariadb_and_other_statements():
+    assert guard_helper.with_timeout("SELECT 1;", 2.5, mariadb=True) == "SET STATEMENT max_statement_time=2.5 FOR SELECT 1"
+    assert guard_helper.with_timeout("SHOW TABLES", 5) == "SHOW TABLES"
+    assert guard_helper.with_timeout("SELECT 1", 0) == "SELECT 1"
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders",
+    "(SELECT 1) UNION (SELECT 2)",
+    "WITH c AS (SELECT 1) SELECT * FROM c",
+    "SELECT REPLACE(name, 'a', 'b') FROM t",
+    "SHOW TABLES",
+    "SELECT 'DROP TABLE x' AS note;",
+])
+def test_validate_accepts_read_only_statements(sql):
+    assert guard_helper.validate(sql) == sql
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "DELETE FROM orders",
+    "SELECT 1; DROP TABLE orders",
+    "SELECT * INTO OUTFILE '/tmp/x' FROM orders",
+    "SELECT * FROM orders FOR UPDATE; UNLOCK TABLES",
+    "SELECT LOAD_FILE('/etc/passwd')",
+    "(DELETE FROM orders)",
+])
+def test_validate_rejects_writes_and_multiple_statements(sql):
+    with pytest.raises(guard_helper.QueryRejectedError):
+        guard_helper.validate(sql)
+
+def test_add_limit_only_without_a_top_level_limit():
+    assert guard_helper.add_limit("SELECT * FROM t;", 10) == "SELECT * FROM t LIMIT 10"
+    assert guard_helper.add_limit("SELECT * FROM t LIMIT 5", 10) == "SELECT * FROM t LIMIT 5"
+    sql = "SELECT * FROM t WHERE id IN (SELECT id FROM u LIMIT 3)"
+    assert guard_helper.add_limit(sql, 10) == sql + " LIMIT 10"
+
+def test_timeout_keeps_the_query_as_written():
+    sql = "SELECT name FROM products WHERE color = '#ff0000' AND note = 'a -- b'  -- trailing\n;"
+    assert guard_helper.with_timeout(sql, 5) == (
+        f"SELECT {HINT} name FROM products WHERE color = '#ff0000' AND note = 'a -- b'"
+    )
+
+def test_timeout_joins_the_users_optimizer_hints():
+    sql = guard_helper.with_timeout("SELECT /*+ BKA(t) */ * FROM t JOIN u ON t.id = u.id", 5)
+    assert sql == "SELECT /*+ MAX_EXECUTION_TIME(5000) BKA(t) */ * FROM t JOIN u ON t.id = u.id"
+
+def test_add_limit_after_a_trailing_comment():
+    assert guard_helper.add_limit("SELECT * FROM t WHERE c = '#1' -- all of them", 10) == \
+        "SELECT * FROM t WHERE c = '#1' LIMIT 10"
+
+class _Conn:
+    def get_server_info(self):
+        return "8.0.36"
+
+def test_check_runs_the_original_text():
+    guard = guard_helper.QueryGuard(timeout=5, explain=False)
+    sql = "SELECT /*+ NO_INDEX(p) */ name\nFROM products p WHERE color = '#ff0000';"
+    guarded = guard.check(_Conn(), sql)
+    assert guarded.sql == sql.rstrip(";")
+    assert guarded.execute_sql == "SELECT /*+ MAX_EXECUTION_TIME(5000) NO_INDEX(p) */ name\nFROM products p WHERE color = '#ff0000'"
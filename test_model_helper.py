@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import pytest
+
+import model_helper
+import ratelimit_helper
+
+RATE_LIMITED = RuntimeError("429 RESOURCE_EXHAUSTED")
+
+def _dispatcher(models=("fast", "backup"), **kwargs):
+    kwargs.setdefault("hedge_default_delay", 0.05)
+    return model_helper.ModelDispatcher(list(models), **kwargs)
+
+def _expire(breaker):
+    """Ends an open breaker's cooldown, making it half-open."""
+    breaker.open_until = time.monotonic() - 1
+
+def test_retry_delay_and_rate_limit_detection():
+    assert model_helper.retry_delay("429 ... 'retryDelay': '12s'") == 12.0
+    assert model_helper.retry_delay("Please retry in 3.5 s") == 3.5
+    assert model_helper.retry_delay("500 Internal") is None
+    assert model_helper.is_rate_limit_error(RATE_LIMITED)
+
+def test_breaker_opens_probes_and_closes():
+    breaker = model_helper.CircuitBreaker(failure_threshold=3, cooldown=30)
+    assert breaker.state == "closed" and breaker.allow() is True
+    breaker.record_failure(RuntimeError("500"))
+    assert breaker.state == "closed"  # Below the threshold
+    breaker.record_failure(RATE_LIMITED)
+    assert breaker.state == "open" and breaker.allow() is False
+    _expire(breaker)
+    assert breaker.state == "half_open"
+    assert breaker.allow() == "probe"
+    assert breaker.allow() is False  # One probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() is True
+
+def test_failed_probe_reopens_with_a_longer_cooldown():
+    breaker = model_helper.CircuitBreaker(cooldown=10, max_cooldown=15)
+    breaker.record_failure(RATE_LIMITED)
+    _expire(breaker)
+    assert breaker.allow() == "probe"
+    breaker.record_failure(RuntimeError("500"))
+    assert breaker.state == "open" and breaker.cooldown == 15
+    assert 14 < breaker.retry_in() <= 15
+
+def test_breaker_uses_the_providers_retry_delay():
+    breaker = model_helper.CircuitBreaker(cooldown=30)
+    breaker.record_failure(RuntimeError("429 RESOURCE_EXHAUSTED, retry in 2s"))
+    assert 1 < breaker.retry_in() <= 2
+
+def test_a_failing_model_falls_back_to_the_next():
+    dispatcher = _dispatcher()
+
+    async def start(model):
+        if model == "fast":
+            raise RATE_LIMITED
+        return f"answer from {model}"
+
+    result = asyncio.run(dispatcher.call(start))
+    assert (result.model, result.value) == ("backup", "answer from backup")
+    assert any("Rate limit hit for fast" in note for note in result.notes)
+    assert dispatcher.breakers["fast"].state == "open"
+    assert dispatcher.stats()["fallbacks"] == 1
+
+def test_open_breakers_are_skipped_until_every_model_is_out():
+    dispatcher = _dispatcher()
+    dispatcher.breakers["fast"].record_failure(RATE_LIMITED)
+    calls = []
+
+    async def start(model):
+        calls.append(model)
+        return model
+
+    assert asyncio.run(dispatcher.call(start)).model == "backup"
+    assert calls == ["backup"]
+    dispatcher.breakers["backup"].record_failure(RATE_LIMITED)
+    with pytest.raises(model_helper.ModelsUnavailableError):
+        asyncio.run(dispatcher.call(start))
+
+def test_slow_calls_are_hedged_and_the_loser_cancelled():
+    dispatcher = _dispatcher()
+    cancelled = []
+
+    async def start(model):
+        try:
+            await asyncio.sleep(5 if model == "fast" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    result = asyncio.run(dispatcher.call(start))
+    assert result.model == "backup" and cancelled == ["fast"]
+    assert any("slower than usual" in note for note in result.notes)
+    stats = dispatcher.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert dispatcher.breakers["fast"].state == "closed"  # Slow is not failing
+
+def test_no_hedging_when_disabled():
+    dispatcher = _dispatcher(hedge_percentile=None)
+
+    async def start(model):
+        await asyncio.sleep(0.1)
+        return model
+
+    assert asyncio.run(dispatcher.call(start)).model == "fast"
+    assert dispatcher.stats()["hedges"] == 0
+
+def test_shed_calls_do_not_trip_the_breaker():
+    dispatcher = _dispatcher()
+
+    async def start(model):
+        if model == "fast":
+            raise ratelimit_helper.OverloadedError("over quota")
+        return model
+
+    assert asyncio.run(dispatcher.call(start)).model == "backup"
+    assert dispatcher.breakers["fast"].state == "closed"
+
+def test_a_shed_probe_lets_a_later_call_probe():
+    dispatcher = _dispatcher(models=("only",))
+    breaker = dispatcher.breakers["only"]
+    breaker.record_failure(RATE_LIMITED)
+    _expire(breaker)
+    shed = [True]
+
+    async def start(model):
+        if shed.pop(0):
+            raise ratelimit_helper.OverloadedError("over quota")
+        return model
+
+    with pytest.raises(ratelimit_helper.OverloadedError):
+        asyncio.run(dispatcher.call(start))
+    assert breaker.state == "half_open" and not breaker.probing
+    shed.append(False)
+    assert asyncio.run(dispatcher.call(start)).model == "only"
+    assert breaker.state == "closed"
+
+def test_stream_races_to_the_first_chunk():
+    dispatcher = _dispatcher()
+
+    async def chunks(model):
+        yield f"{model}-1"
+        yield f"{model}-2"
+
+    async def start(model):
+        if model == "fast":
+            raise RuntimeError("500")
+        return chunks(model)
+
+    async def main():
+        result = await dispatcher.stream(start)
+        first, rest = result.value
+        return result.model, [first] + [chunk async for chunk in rest]
+
+    assert asyncio.run(main()) == ("backup", ["backup-1", "backup-2"])
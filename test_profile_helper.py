@@ -0,0 +1,44 @@
+import pytest
+
+import profile_helper
+import schema_helper
+
+def _model():
+    return schema_helper.SchemaModel("shop", {
+        "categories": {"columns": [{"name": "id", "type": "int"}], "primary_key": ["id"]},
+        "customers": {"columns": [{"name": "id", "type": "int"}], "primary_key": ["id"]},
+        "orders": {
+            "columns": [{"name": "id", "type": "int"}, {"name": "customer_id", "type": "int"},
+                        {"name": "category_id", "type": "int"}, {"name": "shipper_id", "type": "int"}],
+            "primary_key": ["id"],
+            "foreign_keys": [{"column": "category_id", "ref_table": "categories", "ref_column": "id"}],
+        },
+    })
+
+@pytest.mark.parametrize("column, candidates", [
+    ("customer_id", [("customers", "id")]),
+    ("category_id", []),  # Declared foreign key
+    ("shipper_id", []),  # No such table
+    ("id", []),  # The table's own primary key
+])
+def test_reference_candidates(column, candidates):
+    assert profile_helper.reference_candidates("orders", column, _model()) == candidates
+
+@pytest.mark.parametrize("column, kind", [
+    ({"name": "status", "type": "varchar(20)"}, "text"),
+    ({"name": "total", "type": "decimal(10,2)"}, "range"),
+    ({"name": "created_at", "type": "datetime"}, "range"),
+    ({"name": "notes", "type": "text"}, None),
+    ({"name": "password_hash", "type": "char(60)"}, None),
+    ({"name": "api_key", "type": "varchar(40)"}, None),
+])
+def test_sensitive_and_long_columns_are_not_profiled(column, kind):
+    assert profile_helper._kind(column) == kind
+
+def test_column_hint():
+    entry = {"kind": "text", "values": ["open", "shipped"], "nulls": 0.1}
+    assert profile_helper.column_hint("orders", "status", entry) == "orders.status: 'open', 'shipped'; 10% null"
+    assert profile_helper.column_hint("orders", "status", entry, complete=False).startswith("orders.status: e.g. ")
+    assert profile_helper.column_hint("orders", "total", {"kind": "range", "min": 1, "max": 9, "nulls": 0}) == \
+        "orders.total: 1 to 9"
+    assert profile_helper.column_hint("orders", "x", {"kind": "text", "nulls": 0}) is None
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+import ratelimit_helper
+
+def _limiter(rpm=600, tpm=1000000, burst=0.005, **kwargs):
+    # rpm 600 at headroom 1 refills one request every 0.1s; the burst holds 3
+    return ratelimit_helper.ModelLimiter(rpm, tpm, headroom=1.0, burst=burst, **kwargs)
+
+def test_requests_beyond_the_burst_wait_for_the_rpm_bucket():
+    limiter = _limiter()
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire(1)
+        burst = time.monotonic() - started
+        await limiter.acquire(1)
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.05 and 0.07 < total < 1
+    assert limiter.stats()["admitted"] == 4
+
+def test_large_prompts_wait_for_the_tpm_bucket():
+    # 6000 tokens per minute: 100 per second, 300 in the burst
+    limiter = _limiter(rpm=6000, tpm=6000, burst=0.05)
+
+    async def main():
+        await limiter.acquire(300)
+        started = time.monotonic()
+        await limiter.acquire(20)
+        return time.monotonic() - started
+
+    assert 0.15 < asyncio.run(main()) < 1
+
+def test_prompts_larger_than_the_bucket_still_fit():
+    limiter = _limiter(rpm=6000, tpm=6000, burst=0.05)
+    asyncio.run(limiter.acquire(10000))
+    assert limiter.stats()["admitted"] == 1
+
+def test_requests_are_shed_when_the_wait_is_too_long():
+    limiter = _limiter(max_wait=0.05)
+
+    async def main():
+        for _ in range(3):
+            await limiter.acquire(1)
+        await limiter.acquire(1)
+
+    with pytest.raises(ratelimit_helper.OverloadedError) as raised:
+        asyncio.run(main())
+    assert raised.value.shed and 0.05 < raised.value.retry_after <= 0.1
+    assert limiter.stats()["shed"] == 1
+
+def test_requests_are_shed_when_the_queue_is_full():
+    limiter = _limiter(max_queue=0)
+    with pytest.raises(ratelimit_helper.OverloadedError):
+        asyncio.run(limiter.acquire(1))
+
+def test_higher_priority_requests_are_admitted_first():
+    limiter = _limiter(burst=0.001)  # Holds one request
+    order = []
+
+    async def ask(name, priority):
+        await limiter.acquire(1, priority)
+        order.append(name)
+
+    async def main():
+        await limiter.acquire(1)
+        low = asyncio.ensure_future(ask("low", ratelimit_helper.PRIORITIES["low"]))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(ask("high", ratelimit_helper.PRIORITIES["high"]))
+        await asyncio.gather(low, high)
+
+    asyncio.run(main())
+    assert order == ["high", "low"]
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    limiter = _limiter(burst=0.001)
+
+    async def main():
+        await limiter.acquire(1)
+        waiter = asyncio.ensure_future(limiter.acquire(1))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return limiter.stats()["queued"]
+
+    assert asyncio.run(main()) == 0
+
+def test_settle_charges_actual_usage():
+    limiter = _limiter(tpm=6000, burst=0.05)
+    asyncio.run(limiter.acquire(100))
+    limiter.settle(100, 250)
+    assert limiter.tokens.tokens < 60
+
+def test_retry_after_is_none_while_some_model_has_room():
+    limiter = ratelimit_helper.RateLimiter({"a": {"rpm": 1}}, default_rpm=600, max_wait=0.5)
+    asyncio.run(limiter.acquire("a", 1))
+    assert limiter.retry_after(["a"], 1) > 0.5
+    assert limiter.retry_after(["a", "b"], 1) is None
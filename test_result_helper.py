@@ -0,0 +1,94 @@
+import contextlib
+
+import result_helper
+
+class _Cursor:
+    def __init__(self, rows, columns=("id", "status")):
+        self.description = [(c,) for c in columns]
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        pass
+
+class _Pool:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self, buffered=True):
+        return self._cursor
+
+    def get_server_info(self):
+        return "8.0.36"
+
+    def discard_on_release(self, conn):
+        pass
+
+def test_fetch_bounded_stops_at_the_row_cap():
+    rows = [(i, "paid" if i % 2 else "open") for i in range(10)]
+    fetched, summary, exhausted = result_helper.fetch_bounded(_Cursor(rows), max_rows=4, batch_size=3)
+    assert fetched == rows[:4] and not exhausted
+    assert summary.truncated and summary.row_count == 4
+    assert "stopped at the row limit" in summary.to_prompt()
+
+def test_fetch_bounded_reads_small_results_whole():
+    rows = [(1, "paid"), (2, "paid"), (3, None)]
+    fetched, summary, exhausted = result_helper.fetch_bounded(_Cursor(rows), batch_size=2)
+    assert fetched == rows and exhausted and not summary.truncated
+    assert summary.stats[1].describe() == "- status: 2 values, 1 nulls, min 'paid', max 'paid', 1 distinct, top: 'paid' (2)"
+
+def test_fetch_page_wraps_the_query_in_limit_and_offset():
+    cursor = _Cursor([(21, "paid"), (22, "open"), (23, "open")])
+    columns, rows, has_more = result_helper.fetch_page(_Pool(cursor), "SELECT id, status FROM orders;", 2, 2, timeout=5)
+    assert columns == ["id", "status"] and rows == [(21, "paid"), (22, "open")] and has_more
+    assert cursor.executed == [
+        "SELECT /*+ MAX_EXECUTION_TIME(5000) */ * FROM (SELECT id, status FROM orders) AS _page LIMIT 3 OFFSET 2"
+    ]
+
+def test_streamed_pages_and_exports_are_time_limited():
+    class _Failing(_Cursor):
+        def execute(self, sql):
+            super().execute(sql)
+            if "_page" in sql:
+                raise RuntimeError("Duplicate column name 'id'")
+
+    cursor = _Failing([(1, "paid"), (2, "open"), (3, "open")])
+    columns, rows, has_more = result_helper.fetch_page(_Pool(cursor), "SELECT id, status FROM orders", 2, 1, timeout=5)
+    assert rows == [(2, "open")] and has_more
+    assert cursor.executed[-1] == "SELECT /*+ MAX_EXECUTION_TIME(5000) */ id, status FROM orders"
+
+    cursor = _Cursor([(1, "paid")])
+    assert list(result_helper.iter_result_pages(_Pool(cursor), "SELECT id, status FROM orders", timeout=5)) == \
+        [([("id",), ("status",)], [(1, "paid")])]
+    assert cursor.executed == ["SELECT /*+ MAX_EXECUTION_TIME(5000) */ id, status FROM orders"]
+
+def test_fetch_page_keeps_comment_markers_in_literals():
+    cursor = _Cursor([(1, "#1")])
+    result_helper.fetch_page(_Pool(cursor), "SELECT id, status FROM orders WHERE status = '#1' -- note", 1, 10)
+    assert cursor.executed == ["SELECT * FROM (SELECT id, status FROM orders WHERE status = '#1') AS _page LIMIT 11 OFFSET 0"]
+
+def test_adopt_copies_a_handle_for_another_session():
+    store = result_helper.QueryStore()
+    query_id = store.register("SELECT id FROM orders", ["id"], 3, False, "a")
+    assert store.adopt(query_id, "a") == query_id
+    copy = store.adopt(query_id, "b")
+    assert copy != query_id
+    assert store.get(copy, "b")["sql"] == "SELECT id FROM orders"
+    assert store.get(copy, "a") is None
+
+def test_adopt_unknown_handle():
+    assert result_helper.QueryStore().adopt("missing", "a") is None
@@ -0,0 +1,90 @@
+import contextlib
+
+import pytest
+
+import router_helper
+
+class _Conn:
+    def __init__(self, lag=0):
+        self.lag = lag
+
+    def cursor(self):
+        return _StatusCursor(self.lag)
+
+    def is_connected(self):
+        return True
+
+class _StatusCursor:
+    def __init__(self, lag):
+        self.lag = lag
+        self.description = None
+
+    def execute(self, sql):
+        self.description = [("Seconds_Behind_Source",)]
+
+    def fetchall(self):
+        return [(self.lag,)]
+
+    def close(self):
+        pass
+
+class _Pool:
+    def __init__(self, lag=0, error=None):
+        self.conn = _Conn(lag)
+        self.error = error
+        self.checkouts = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        if self.error:
+            raise self.error
+        self.checkouts += 1
+        yield self.conn
+
+    def stats(self):
+        return {"in_use": 0, "size": 1}
+
+def test_skips_lagging_replica():
+    primary, behind, current = _Pool(), _Pool(lag=120), _Pool(lag=2)
+    router = router_helper.QueryRouter(primary, {"behind": behind, "current": current}, max_lag=30)
+    routes = set()
+    for _ in range(3):
+        with router.connection() as conn:
+            routes.add(router.route_of(conn))
+    assert routes == {"current"}
+    assert router.stats()["lag_skips"] >= 1
+    assert primary.checkouts == 0
+
+def test_fails_over_to_primary_and_marks_replica_down():
+    primary, broken = _Pool(), _Pool(error=ConnectionError("refused"))
+    router = router_helper.QueryRouter(primary, {"r1": broken}, failure_cooldown=60)
+    with router.connection() as conn:
+        assert router.route_of(conn) == "primary"
+    stats = router.stats()
+    assert stats["failovers"] == 1
+    assert stats["routes"]["r1"]["healthy"] is False
+    # Still down: the replica is not tried again during the cooldown
+    with router.connection():
+        pass
+    assert router.stats()["failovers"] == 1
+
+def test_no_route_without_primary_reads():
+    router = router_helper.QueryRouter(_Pool(), {"r1": _Pool(lag=120)}, max_lag=30, read_from_primary=False)
+    with pytest.raises(router_helper.NoRouteError):
+        with router.connection():
+            pass
+
+def test_reads_pinned_to_primary_after_write():
+    primary, replica = _Pool(), _Pool()
+    router = router_helper.QueryRouter(primary, {"r1": replica}, pin_after_write=60)
+    with router.connection() as conn:
+        assert router.route_of(conn) == "r1"
+    with router.write_connection() as conn:
+        assert router.route_of(conn) == "primary"
+    with router.connection() as conn:
+        assert router.route_of(conn) == "primary"
+    assert router.stats()["pinned_reads"] == 1
+
+    router._pinned_until = 0.0
+    with router.connection() as conn:
+        assert router.route_of(conn) == "r1"
@@ -0,0 +1,56 @@
+import schema_helper
+
+def _column(name, type_="int"):
+    return {"name": name, "type": type_}
+
+def _model():
+    return schema_helper.SchemaModel("shop", {
+        "customers": {"columns": [_column("id"), _column("full_name", "varchar(100)")], "primary_key": ["id"]},
+        "orders": {
+            "columns": [_column("id"), _column("customer_id"), _column("total", "decimal(10,2)")],
+            "primary_key": ["id"],
+            "foreign_keys": [{"column": "customer_id", "ref_table": "customers", "ref_column": "id"}],
+        },
+        "warehouses": {"columns": [_column("id"), _column("city", "varchar(50)")], "comment": "Stock locations"},
+    })
+
+def test_fingerprint_follows_structure_only():
+    model = _model()
+    same = _model()
+    same.versions = {"orders": "2024-01-01"}
+    changed = _model()
+    changed.tables["orders"]["columns"].append(_column("status", "varchar(20)"))
+    assert model.fingerprint == same.fingerprint
+    assert model.fingerprint != changed.fingerprint
+
+def test_schema_model_round_trips_through_dict():
+    model = _model()
+    restored = schema_helper.SchemaModel.from_dict(model.to_dict())
+    assert restored.tables == model.tables and restored.fingerprint == model.fingerprint
+
+def test_cached_schema_is_read_back_only_for_its_key(tmp_path):
+    key = schema_helper.cache_key("127.0.0.1", 3306, "shop")
+    schema_helper.save_cached_schema(key, _model(), str(tmp_path))
+    assert schema_helper.load_cached_schema(key, str(tmp_path)).fingerprint == _model().fingerprint
+    assert schema_helper.load_cached_schema(schema_helper.cache_key("127.0.0.1", 3306, "crm"), str(tmp_path)) is None
+
+def test_tampered_schema_cache_is_discarded(tmp_path):
+    key = schema_helper.cache_key("127.0.0.1", 3306, "shop")
+    schema_helper.save_cached_schema(key, _model(), str(tmp_path))
+    [path] = tmp_path.iterdir()
+    path.write_text(path.read_text().replace('"decimal(10,2)"', '"int"'))
+    assert schema_helper.load_cached_schema(key, str(tmp_path)) is None
+
+def test_tokenize_splits_identifiers_and_stems():
+    assert schema_helper.tokenize("Show me the orderItems of all companies") == ["order", "item", "company"]
+    assert schema_helper.tokenize("customer_id, boxes") == ["customer", "id", "box"]
+
+def test_small_schemas_are_sent_whole():
+    index = schema_helper.SchemaIndex(_model())
+    assert index.select_tables("anything", token_budget=4000) == ["customers", "orders", "warehouses"]
+
+def test_selects_matching_tables_and_their_neighbours():
+    index = schema_helper.SchemaIndex(_model())
+    assert index.score("Which city stocks the most?")[0][0] == "warehouses"
+    assert index.select_tables("total of orders", top_k=1, token_budget=60) == ["orders", "customers"]
+    assert index.select_tables("total of orders", top_k=1, token_budget=40) == ["orders"]
@@ -0,0 +1,93 @@
+import schema_helper
+import session_helper
+
+class _Pool:
+    size = 1
+
+    def close(self):
+        pass
+
+def _session(user, database="shop"):
+    params = {"host": "db", "port": 3306, "user": user, "password": "", "database": database}
+    return session_helper.Session("s", params, schema_helper.SchemaModel(database, {}), _Pool())
+
+def test_scope_separates_mysql_users():
+    assert _session("analyst").scope != _session("admin").scope
+    assert _session("analyst").scope == _session("analyst").scope
+    assert _session("analyst").scope != _session("analyst", "other").scope
+
+class _Store:
+    def __init__(self):
+        self.records = {}
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.records[key] = value
+
+    def touch(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.records.pop(key, None)
+
+    def stats(self):
+        return {}
+
+PARAMS = {
+    "host": "db", "port": 3306, "user": "app", "password": "s3cret", "database": "shop",
+    "replicas": [{"name": "r1", "host": "r1", "password": "r3plica"}, {"name": "r2", "host": "r2"}],
+}
+
+def _connect(params):
+    _connect.calls.append(params)
+    return schema_helper.SchemaModel(params["database"], {}), _Pool()
+
+def _manager(store, **kwargs):
+    _connect.calls = []
+    return session_helper.SessionManager(store, _connect, **kwargs)
+
+def test_split_and_join_secrets_round_trip():
+    public, passwords = session_helper.split_secrets(PARAMS)
+    assert "s3cret" not in repr(public) and "r3plica" not in repr(public)
+    assert session_helper.join_secrets(public, passwords) == PARAMS
+
+def test_stored_records_hold_no_passwords():
+    for kwargs in ({}, {"secret_key": "server key"}):
+        store = _Store()
+        _manager(store, **kwargs).create(PARAMS, schema_helper.SchemaModel("shop", {}), _Pool())
+        assert "s3cret" not in repr(store.records) and "r3plica" not in repr(store.records)
+
+def test_sealed_sessions_restore_on_another_worker():
+    store = _Store()
+    session = _manager(store, secret_key="server key").create(PARAMS, schema_helper.SchemaModel("shop", {}), _Pool())
+    other = _manager(store, secret_key="server key")
+    assert other.get(session.id) is not None
+    assert _connect.calls[0] == PARAMS
+
+def test_unsealed_sessions_only_restore_where_they_were_created():
+    store = _Store()
+    manager = _manager(store)
+    session = manager.create(PARAMS, schema_helper.SchemaModel("shop", {}), _Pool())
+    assert _manager(store).get(session.id) is None
+    assert _manager(store, secret_key="another key").get(session.id) is None
+
+    manager.close_all()
+    assert manager.get(session.id) is not None  # Evicted here, password still in memory
+    assert _connect.calls[-1]["password"] == "s3cret"
+
+def test_named_connections_restore_without_a_password():
+    store = _Store()
+    params = {"connection": "prod", "host": "db", "port": 3306, "user": "app", "password": "s3cret",
+              "database": "shop"}
+    session = _manager(store).create(params, schema_helper.SchemaModel("shop", {}), _Pool())
+    assert _manager(store).get(session.id) is not None
+    assert "password" not in _connect.calls[0] and _connect.calls[0]["connection"] == "prod"
+
+def test_new_session_is_not_evicted_by_its_own_size():
+    manager = _manager(_Store(), max_bytes=1)
+    old = manager.create(PARAMS, schema_helper.SchemaModel("shop", {}), _Pool())
+    new = manager.create(PARAMS, schema_helper.SchemaModel("shop", {}), _Pool())
+    live = manager.stats()["live"]
+    assert live == 1 and manager._live.get(new.id) is new and old.id not in manager._live
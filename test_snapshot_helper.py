@@ -0,0 +1,77 @@
+import time
+import types
+
+import pytest
+
+import snapshot_helper
+
+def test_translate_quotes_names_and_matches_case_insensitively():
+    assert snapshot_helper.translate("SELECT `order id` FROM orders WHERE name LIKE 'a%'") == \
+        'SELECT "order id" FROM orders WHERE name ILIKE \'a%\''
+    assert snapshot_helper.translate("SELECT 1 -- note\nFROM t") == "SELECT 1  \nFROM t"
+
+@pytest.mark.parametrize("sql", [
+    'SELECT * FROM t WHERE name = "x"',
+    "SELECT * FROM t WHERE name = 'it\\'s'",
+    "SELECT a || b FROM t",
+    "SELECT CONCAT(a, b) FROM t",
+    "SELECT DAYOFWEEK(created_at), COUNT(*) FROM t GROUP BY 1",
+])
+def test_translate_refuses_mysql_only_meanings(sql):
+    assert snapshot_helper.translate(sql) is None
+
+def test_translate_keeps_names_that_look_like_functions():
+    assert snapshot_helper.translate("SELECT length FROM t") == "SELECT length FROM t"
+
+@pytest.mark.parametrize("sql, analytical", [
+    ("SELECT status, COUNT(*) FROM orders GROUP BY status", True),
+    ("SELECT DISTINCT status FROM orders", True),
+    ("SELECT id, ROW_NUMBER() OVER (ORDER BY id) FROM orders", True),
+    ("SELECT id, total FROM orders WHERE total > 10", False),
+    ("SELECT 'GROUP BY' AS label FROM orders", False),
+    ("SELECT count FROM stats", False),
+])
+def test_is_analytical(sql, analytical):
+    assert snapshot_helper.is_analytical(sql) is analytical
+
+@pytest.fixture
+def engine(tmp_path):
+    pytest.importorskip("duckdb")
+    engine = snapshot_helper.SnapshotEngine(str(tmp_path), "shop")
+    engine.tables = {
+        "orders": types.SimpleNamespace(ready=True, age=lambda: 10.0, max_staleness=900),
+        "events": types.SimpleNamespace(ready=True, age=lambda: 5000.0, max_staleness=900),
+        "drafts": types.SimpleNamespace(ready=False, age=lambda: None, max_staleness=900),
+    }
+    yield engine
+    engine.close()
+
+@pytest.mark.parametrize("sql, reason", [
+    ("SELECT status, COUNT(*) FROM orders GROUP BY status", "fresh"),
+    ("SELECT id FROM orders", "not_analytical"),
+    ("SELECT COUNT(*) FROM customers", "not_snapshotted"),
+    ("SELECT COUNT(*) FROM drafts", "not_snapshotted"),
+    ("SELECT COUNT(*) FROM events", "stale"),
+    ("SELECT COUNT(*) FROM orders o JOIN customers c ON c.id = o.customer_id", "not_snapshotted"),
+    ('SELECT COUNT(*) FROM orders WHERE status = "paid"', "mysql_syntax"),
+    ("DELETE FROM orders", "not_select"),
+    ("SELECT COUNT(*) FROM orders; DROP TABLE orders", "not_select"),
+])
+def test_route_reasons(engine, sql, reason):
+    duck_sql, why = engine.route(sql)
+    assert why == reason
+    assert (duck_sql is not None) == (reason == "fresh")
+    assert engine.decisions[f"{'snapshot' if duck_sql else 'mysql'}:{reason}"] == 1
+
+def test_deadline_interrupts_long_queries(engine):
+    started = time.monotonic()
+    with engine.connection() as conn:
+        with pytest.raises(snapshot_helper.SnapshotTimeoutError):
+            with engine.deadline(conn, 0.2):
+                conn.execute("SELECT COUNT(*) FROM range(100000000000) a").fetchall()
+    assert time.monotonic() - started < 10
+
+def test_deadline_leaves_quick_queries_alone(engine):
+    with engine.connection() as conn:
+        with engine.deadline(conn, 5):
+            assert conn.execute("SELECT 42").fetchall() == [(42,)]
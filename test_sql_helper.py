@@ -0,0 +1,64 @@
+import pytest
+
+import sql_helper
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders WHERE order_date >= CURDATE() - INTERVAL 7 DAY",
+    "SELECT * FROM orders WHERE order_date = CURRENT_DATE",
+    "SELECT * FROM orders WHERE created_at > NOW() - INTERVAL 1 HOUR",
+    "SELECT UNIX_TIMESTAMP() - UNIX_TIMESTAMP(created_at) FROM orders",
+    "SELECT * FROM orders WHERE created_at < current_timestamp",
+    "SELECT * FROM orders WHERE created_at < LOCALTIMESTAMP()",
+    "SELECT * FROM orders ORDER BY RAND() LIMIT 5",
+])
+def test_clock_and_random_functions_are_not_deterministic(sql):
+    assert not sql_helper.is_deterministic(sql)
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM orders",
+    "SELECT * FROM orders WHERE status = 'NOW()'",
+    "SELECT `current_date` FROM calendar",
+    "SELECT * FROM orders WHERE order_date = '2024-01-01' -- CURRENT_DATE",
+])
+def test_plain_queries_are_deterministic(sql):
+    assert sql_helper.is_deterministic(sql)
+
+@pytest.mark.parametrize("sql, tables", [
+    ("SELECT * FROM orders", ["orders"]),
+    ("SELECT * FROM orders o JOIN customers c ON c.id = o.customer_id", ["customers", "orders"]),
+    ("SELECT * FROM orders, `order items` oi WHERE oi.order_id = orders.id", ["order items", "orders"]),
+    ("SELECT * FROM shop.orders LEFT JOIN `crm`.`people` p USING (id)", ["crm.people", "shop.orders"]),
+    ("SELECT * FROM (SELECT id FROM orders) t JOIN (customers c, regions r) ON 1", ["customers", "orders", "regions"]),
+    ("SELECT * FROM orders WHERE customer_id IN (SELECT id FROM customers WHERE vip)", ["customers", "orders"]),
+    ("WITH recent AS (SELECT * FROM orders), top (id) AS (SELECT id FROM recent) SELECT * FROM top", ["orders"]),
+    ("SELECT EXTRACT(YEAR FROM created_at) FROM orders", ["orders"]),
+    ("SELECT 'FROM secrets' FROM orders -- JOIN audit", ["orders"]),
+    ("SELECT 1 FROM DUAL", []),
+])
+def test_referenced_tables(sql, tables):
+    assert sql_helper.referenced_tables(sql) == tables
+
+def test_normalize_sql_collapses_whitespace_outside_strings():
+    assert sql_helper.normalize_sql("SELECT  *\n FROM t -- note\n WHERE a = 'x  y';") == "SELECT * FROM t WHERE a = 'x  y'"
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name FROM products WHERE color = '#ff0000' AND active = 1",
+    "SELECT name FROM products WHERE note = 'a -- b' AND active = 1",
+    "SELECT name FROM products WHERE note = 'a /* b' AND active = 1",
+    'SELECT name FROM products WHERE note = "x # y" AND active = 1',
+])
+def test_comment_markers_inside_literals_are_kept(sql):
+    assert sql_helper.normalize_sql(sql) == sql
+    assert sql_helper.strip_comments_and_strings(sql).endswith("'?' AND active = 1")
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM a WHERE x = 'foo -- bar' UNION SELECT * FROM b",
+    "SELECT * FROM a WHERE x = '#' UNION SELECT * FROM b",
+    "SELECT * FROM a WHERE x = '/*' UNION SELECT * FROM b WHERE y = '*/'",
+])
+def test_tables_after_comment_markers_in_literals_are_found(sql):
+    assert sql_helper.referenced_tables(sql) == ["a", "b"]
+
+def test_quotes_inside_comments_start_no_string():
+    assert sql_helper.normalize_sql("SELECT a /* it's */ FROM t # don't\nWHERE b = 1") == "SELECT a FROM t WHERE b = 1"
+    assert sql_helper.referenced_tables("SELECT a /* it's */ FROM t JOIN u -- don't\nON t.id = u.id") == ["t", "u"]
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import store_helper
+
+class _FakeRedis:
+    """The few redis.Redis calls RedisStore makes, with real expiry."""
+
+    def __init__(self):
+        self.data = {}  # key -> (value, expires_at or None)
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and time.time() > expires_at:
+            self.data.pop(key)
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value.encode("utf-8"), time.time() + ex if ex else None)
+
+    def expire(self, key, seconds):
+        if key in self.data:
+            self.data[key] = (self.data[key][0], time.time() + seconds)
+
+    def persist(self, key):
+        if key in self.data:
+            self.data[key] = (self.data[key][0], None)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+def _redis_store():
+    store = store_helper.RedisStore.__new__(store_helper.RedisStore)
+    store.url, store.prefix, store._client = "redis://:secret@cache:6379/0", "talk2db:", _FakeRedis()
+    return store
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return store_helper.MemoryStore()
+    if request.param == "sqlite":
+        return store_helper.SqliteStore(str(tmp_path / "store.db"))
+    return _redis_store()
+
+def _expire(store, key):
+    """Moves `key`'s expiry into the past without sleeping."""
+    if isinstance(store, store_helper.MemoryStore):
+        store._entries[key] = (store._entries[key][0], time.time() - 1)
+    elif isinstance(store, store_helper.SqliteStore):
+        store._db.execute("UPDATE kv_store SET expires_at = ? WHERE key = ?", (time.time() - 1, key))
+    else:
+        client_key = store.prefix + key
+        store._client.data[client_key] = (store._client.data[client_key][0], time.time() - 1)
+
+def test_values_round_trip_as_json(store):
+    store.set("session:a", {"params": {"port": 3306}, "tags": ["x"]})
+    assert store.get("session:a") == {"params": {"port": 3306}, "tags": ["x"]}
+    store.delete("session:a")
+    assert store.get("session:a") is None
+
+def test_entries_expire_after_their_ttl(store):
+    store.set("a", 1, ttl=60)
+    store.set("b", 2)
+    _expire(store, "a")
+    assert store.get("a") is None and store.get("b") == 2
+
+def test_touch_extends_the_ttl(store):
+    store.set("a", 1, ttl=60)
+    store.touch("a", 3600)
+    assert store.get("a") == 1
+    store.touch("a", None)
+    assert store.get("a") == 1
+    store.touch("missing", 60)
+    assert store.get("missing") is None
+
+def test_memory_store_evicts_the_least_recently_used():
+    store = store_helper.MemoryStore(max_entries=2)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.get("a")
+    store.set("c", 3)
+    assert store.get("b") is None and store.get("a") == 1
+    assert store.stats()["evictions"] == 1
+
+def test_memory_store_touch_keeps_an_entry_from_eviction():
+    store = store_helper.MemoryStore(max_entries=2)
+    store.set("session:a", 1, ttl=60)
+    store.set("query:1", 2)
+    store.touch("session:a", 60)
+    store.set("query:2", 3)
+    assert store.get("session:a") == 1 and store.get("query:1") is None
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "store.db")
+    store_helper.SqliteStore(path).set("a", {"x": 1}, ttl=60)
+    assert store_helper.SqliteStore(path).get("a") == {"x": 1}
+
+def test_redis_stats_never_show_credentials():
+    assert _redis_store().stats()["url"] == "cache:6379/0"
+
+def test_make_store():
+    assert isinstance(store_helper.make_store("memory"), store_helper.MemoryStore)
+    with pytest.raises(ValueError):
+        store_helper.make_store("etcd")